@@ -0,0 +1,318 @@
+# =========================
+# Activity Bitmap Index (1.2 Lurkers and active users)
+# =========================
+# The lurker query of 1.2 runs three NOT IN (SELECT DISTINCT user_id ...) subqueries, so every
+# run scans posts, comments and reactions again. ActivityIndex reads the three tables once and
+# keeps, per user, which days they posted or commented: one bitmap row per day, one bit per
+# user (NumPy uint8 arrays, np.packbits layout). Afterwards
+#   - lurkers are the users whose bit is not set in "ever posted | ever commented | ever reacted",
+#   - "active between two days" is an OR over the day rows of the window,
+#   - a cohort table is an AND of the cohort's bitmap (users by signup month) with every
+#     month's activity bitmap,
+# all of them bitwise operations on arrays of (users / 8) bytes.
+#
+# reactions has no timestamp, so reactions only count for "ever active" (the lurker test), not
+# for time windows. refresh() reads the rows above the last id of every table (and new users)
+# and sets their bits; deleted rows are not unset, build a new index after deletes. save() and
+# load() keep the index between runs, so a later run only reads the new rows (load_or_build).
+#
+# A created_at before MIN_DATE or after tomorrow counts as unparseable (the row is "ever active"
+# but on no day): the daily bitmaps span first to last day, so one bad value such as 1970-01-01
+# would otherwise allocate decades of rows.
+#
+# Usage:
+#   python activity_index.py [--db database.sqlite] [--days 30] [--index activity.npz]
+import argparse
+import datetime as dt
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+_DAY_NS = 86_400 * 10**9
+
+# earliest created_at that gets a day row
+MIN_DATE = "2000-01-01"
+
+# number of set bits of every byte value
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+TIMED_SOURCES = ("posts", "comments")
+SOURCES = ("posts", "comments", "reactions")
+
+# refresh() reads the rows above the watermarks (reactions have no timestamp); the 1.2 entries
+# of schema_optimization.py are these queries
+USERS_QUERY = "SELECT rowid, id, created_at FROM users WHERE rowid > ? ORDER BY rowid"
+ROWS_QUERY = "SELECT {columns} FROM {source} WHERE id > ? ORDER BY id"
+COLUMNS = {"posts": "id, user_id, created_at", "comments": "id, user_id, created_at", "reactions": "id, user_id, NULL"}
+
+
+def _days(timestamps):
+    """
+    Day numbers (days since 1970-01-01) of timestamp strings; -1 where they do not parse or lie
+    outside [MIN_DATE, tomorrow].
+    """
+    parsed = pd.to_datetime(pd.Series(timestamps, dtype=object), errors="coerce", format="mixed")
+    days = np.full(len(parsed), -1, dtype=np.int64)
+    valid = parsed.notna().to_numpy()
+    days[valid] = parsed[valid].to_numpy(dtype="datetime64[ns]").astype(np.int64) // _DAY_NS
+    low = pd.Timestamp(MIN_DATE).value // _DAY_NS
+    high = pd.Timestamp.now(tz="UTC").value // _DAY_NS + 1
+    days[(days < low) | (days > high)] = -1
+    return days
+
+
+def popcount(bitmap):
+    return int(_POPCOUNT[bitmap].sum())
+
+
+class ActivityIndex:
+    """
+    ids: user id of every bit position (positions are assigned in the order users are seen).
+    ever[source]: bitmap of the users with at least one row in source.
+    daily: (days x bytes) bitmaps of the users who posted or commented on day first_day + i.
+    user_rows: ids of the users table rows (a duplicated id counts once per row, like the SQL).
+    """
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self._bit_of = {}
+        self.ever = {source: np.zeros(0, dtype=np.uint8) for source in SOURCES}
+        self.daily = np.zeros((0, 0), dtype=np.uint8)
+        self.first_day = None
+        self.user_rows = np.empty(0, dtype=np.int64)
+        self.user_bits = np.empty(0, dtype=np.int64)  # bit position of every users row
+        self.user_days = np.empty(0, dtype=np.int64)  # signup day of every users row (-1: unknown)
+        self.last_ids = {source: 0 for source in SOURCES}
+        self.last_user_rowid = 0
+
+    @classmethod
+    def build(cls, conn):
+        index = cls()
+        index.refresh(conn)
+        return index
+
+    @classmethod
+    def load_or_build(cls, conn, path):
+        """
+        The index saved at `path`, refreshed with the new rows of conn and saved again. Builds a
+        new one when there is no file or a table has fewer rows than the saved watermarks (another
+        database, or rows were deleted). Returns (index, rows read).
+        """
+        index = cls.load(path) if os.path.exists(path) else None
+        if index is not None and index._behind(conn):
+            index = None
+        if index is None:
+            index = cls()
+        read = index.refresh(conn)
+        index.save(path)
+        return index, read
+
+    def _behind(self, conn):
+        """Whether a table's highest id (users: rowid) is below the watermark of this index."""
+        if conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM users").fetchone()[0] < self.last_user_rowid:
+            return True
+        return any(conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {source}").fetchone()[0] < self.last_ids[source]
+                   for source in SOURCES)
+
+    # ---- bit positions and storage
+
+    def _bits(self, user_ids):
+        """Bit positions of user ids, assigning new positions (and growing the bitmaps) as needed."""
+        distinct, inverse = np.unique(user_ids, return_inverse=True)
+        distinct_bits = np.empty(len(distinct), dtype=np.int64)
+        for i, user_id in enumerate(distinct.tolist()):
+            bit = self._bit_of.get(user_id)
+            if bit is None:
+                bit = self._bit_of[user_id] = len(self._bit_of)
+            distinct_bits[i] = bit
+        bits = distinct_bits[inverse.ravel()]
+        if len(self._bit_of) != len(self.ids):
+            self.ids = np.fromiter(self._bit_of, dtype=np.int64, count=len(self._bit_of))
+            self._grow_users()
+        return bits
+
+    def _grow_users(self):
+        nbytes = (len(self.ids) + 7) // 8
+        if nbytes <= self.daily.shape[1]:
+            return
+        capacity = max(nbytes, 2 * self.daily.shape[1])  # doubling keeps appends cheap
+        self.daily = np.pad(self.daily, ((0, 0), (0, capacity - self.daily.shape[1])))
+        for source in SOURCES:
+            self.ever[source] = np.pad(self.ever[source], (0, capacity - len(self.ever[source])))
+
+    def _grow_days(self, days):
+        low, high = int(days.min()), int(days.max())
+        if self.first_day is None:
+            self.first_day = low
+        if low < self.first_day:
+            self.daily = np.pad(self.daily, ((self.first_day - low, 0), (0, 0)))
+            self.first_day = low
+        missing = high - (self.first_day + len(self.daily)) + 1
+        if missing > 0:
+            self.daily = np.pad(self.daily, ((0, missing), (0, 0)))
+
+    @staticmethod
+    def _set(bitmaps, rows, bits):
+        """Sets bit `bits[i]` in row `rows[i]` of a 2-D bitmap (rows=None: of a 1-D bitmap)."""
+        masks = (0x80 >> (bits & 7)).astype(np.uint8)   # np.packbits order: bit 0 is the high bit
+        if rows is None:
+            np.bitwise_or.at(bitmaps, bits >> 3, masks)
+        else:
+            np.bitwise_or.at(bitmaps, (rows, bits >> 3), masks)
+
+    # ---- incremental maintenance
+
+    def refresh(self, conn):
+        """Adds the rows above the stored watermarks. Returns the number of rows read."""
+        read = 0
+        users = conn.execute(USERS_QUERY, (self.last_user_rowid,)).fetchall()
+        if users:
+            ids = np.array([row[1] for row in users], dtype=np.int64)
+            self.user_bits = np.concatenate([self.user_bits, self._bits(ids)])
+            self.user_rows = np.concatenate([self.user_rows, ids])
+            self.user_days = np.concatenate([self.user_days, _days([row[2] for row in users])])
+            self.last_user_rowid = users[-1][0]
+            read += len(users)
+
+        for source in SOURCES:
+            rows = conn.execute(ROWS_QUERY.format(columns=COLUMNS[source], source=source),
+                                (self.last_ids[source],)).fetchall()
+            if not rows:
+                continue
+            bits = self._bits(np.array([row[1] for row in rows], dtype=np.int64))
+            self._set(self.ever[source], None, bits)
+            if source in TIMED_SOURCES:
+                days = _days([row[2] for row in rows])
+                dated = days >= 0
+                if dated.any():
+                    self._grow_days(days[dated])
+                    self._set(self.daily, days[dated] - self.first_day, bits[dated])
+            self.last_ids[source] = rows[-1][0]
+            read += len(rows)
+        return read
+
+    # ---- queries
+
+    def _test(self, bitmap, bits):
+        """Whether each bit position is set in a 1-D bitmap."""
+        return (bitmap[bits >> 3] & (0x80 >> (bits & 7)).astype(np.uint8)) != 0
+
+    def ever_active(self, sources=SOURCES):
+        bitmap = np.zeros(self.daily.shape[1], dtype=np.uint8)
+        for source in sources:
+            bitmap |= self.ever[source]
+        return bitmap
+
+    def lurker_ids(self):
+        """Ids of the users rows with no post, comment or reaction."""
+        return self.user_rows[~self._test(self.ever_active(), self.user_bits)]
+
+    def lurkers(self):
+        """Same count as the NOT IN query of 1.2."""
+        return len(self.lurker_ids())
+
+    def day_number(self, when):
+        return int(pd.Timestamp(when).value // _DAY_NS)
+
+    def last_day(self):
+        return self.first_day + len(self.daily) - 1 if self.first_day is not None else None
+
+    def active_between(self, first_day, last_day):
+        """Bitmap of the users who posted or commented on a day in [first_day, last_day]."""
+        if self.first_day is None:
+            return np.zeros(self.daily.shape[1], dtype=np.uint8)
+        start = max(first_day - self.first_day, 0)
+        stop = min(last_day - self.first_day + 1, len(self.daily))
+        if start >= stop:
+            return np.zeros(self.daily.shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.daily[start:stop], axis=0)
+
+    def active_last(self, days, now=None):
+        """
+        Number of users who posted or commented in the last `days` days up to and including the
+        day of `now` (default: the last day with activity in the index).
+        """
+        end = self.day_number(now) if now is not None else self.last_day()
+        if end is None:
+            return 0
+        return popcount(self.active_between(end - days + 1, end))
+
+    def cohorts(self, freq="M"):
+        """
+        Cohort table: rows are signup periods (users.created_at), columns are activity periods,
+        values are how many users of the cohort posted or commented in that period.
+        """
+        if self.first_day is None or not len(self.user_rows):
+            return pd.DataFrame()
+        to_period = lambda days: pd.to_datetime(days * _DAY_NS).to_period(freq)
+        day_periods = to_period(np.arange(self.first_day, self.first_day + len(self.daily)))
+        activity = {}
+        for period in day_periods.unique():
+            rows = np.flatnonzero(day_periods == period)
+            activity[period] = np.bitwise_or.reduce(self.daily[rows[0]:rows[-1] + 1], axis=0)
+
+        bits = self.user_bits
+        known = self.user_days >= 0
+        signup = to_period(self.user_days[known])
+        table = {}
+        for cohort in sorted(signup.unique()):
+            members = np.zeros(self.daily.shape[1], dtype=np.uint8)
+            self._set(members, None, np.unique(bits[known][signup == cohort]))
+            table[cohort] = {period: popcount(members & bitmap) for period, bitmap in activity.items()}
+        return pd.DataFrame.from_dict(table, orient="index").sort_index(axis=1).rename_axis("cohort")
+
+    # ---- persistence
+
+    def save(self, path):
+        np.savez(path, ids=self.ids, daily=self.daily, user_rows=self.user_rows, user_bits=self.user_bits, user_days=self.user_days,
+                 first_day=np.array(-1 if self.first_day is None else self.first_day),
+                 last_ids=np.array([self.last_ids[s] for s in SOURCES]),
+                 last_user_rowid=np.array(self.last_user_rowid),
+                 **{f"ever_{source}": self.ever[source] for source in SOURCES})
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            index.ids = data["ids"]
+            index._bit_of = {int(user_id): bit for bit, user_id in enumerate(index.ids.tolist())}
+            index.daily = data["daily"]
+            index.user_rows = data["user_rows"]
+            index.user_bits = data["user_bits"]
+            index.user_days = data["user_days"]
+            first_day = int(data["first_day"])
+            index.first_day = None if first_day < 0 else first_day
+            index.last_ids = dict(zip(SOURCES, (int(v) for v in data["last_ids"])))
+            index.last_user_rowid = int(data["last_user_rowid"])
+            index.ever = {source: data[f"ever_{source}"] for source in SOURCES}
+        return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lurkers, active users and cohorts from an activity bitmap index")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--days", type=int, default=30, help="window for the active-users count")
+    parser.add_argument("--index", help="load the index from / save it to this .npz file")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.index:
+        index, read = ActivityIndex.load_or_build(conn, args.index)
+    else:
+        index = ActivityIndex()
+        read = index.refresh(conn)
+    conn.close()
+
+    last = index.last_day()
+    print(f"rows read: {read}, users: {len(index.user_rows)}, days: {len(index.daily)}")
+    print(f"lurkers: {index.lurkers()}")
+    if last is not None:
+        print(f"active in the {args.days} days up to {dt.date(1970, 1, 1) + dt.timedelta(days=last)}: "
+              f"{index.active_last(args.days)}")
+    print(index.cohorts())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+# =========================
+# Streaming Heavy Hitters (1.3 Influencers)
+# =========================
+# The influencer query of 1.3 groups every comments and reactions row on every run.
+# InfluencerStream consumes the engagement events instead, in id order from stored watermarks,
+# and keeps Space-Saving summaries (Metwally et al.): at most `capacity` counters per summary,
+# each with an overestimation bound, so
+#     count - error <= true engagement <= count
+# and every user with more than N / capacity events of the summary is in it.
+#
+# Summaries are kept for all time, per hour (the last keep_hours hours) and per day (the last
+# keep_days days); the rolling 30-day list merges the daily summaries. Memory is
+# (1 + keep_hours + keep_days) * capacity counters however long the stream is.
+#
+# comments are timed by created_at. reactions has no timestamp, so reactions count for the
+# all-time list only (the windowed lists are comment engagement). recount() gives the exact
+# totals of the final candidates with one indexed query per table.
+#
+# Usage:
+#   python heavy_hitters.py [--db database.sqlite] [--capacity 100] [--k 5] [--window all|hour|day|30d] [--exact]
+import argparse
+import collections
+import heapq
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+_HOUR = 3600
+_DAY = 86_400
+
+WINDOWS = ("all", "hour", "day", "30d")
+
+# consume() reads the events above the watermarks in batches; recount() counts the candidates
+# (schema_optimization.py imports these to check the 1.3 plans)
+STREAM_QUERY = "SELECT {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?"
+STREAM_COLUMNS = {"comments": "id, user_id, created_at", "reactions": "id, user_id"}
+RECOUNT_QUERY = "SELECT user_id, COUNT(*) FROM {table} WHERE user_id IN ({marks}){window} GROUP BY user_id"
+RECOUNT_WINDOW = " AND created_at >= ? AND created_at < ?"
+EXACT_QUERY = """
+    SELECT user_id, COUNT(*) AS total_engagement
+    FROM (SELECT user_id FROM comments UNION ALL SELECT user_id FROM reactions)
+    GROUP BY user_id ORDER BY total_engagement DESC, user_id
+"""
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary with weighted updates: counts[item] overestimates the true count by
+    at most errors[item]; when all counters are in use a new item replaces the smallest one.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        self._heap = []  # (count, item), may hold stale entries
+        self._absent = None  # merged summaries: bound of the count of items not in the summary
+
+    def offer(self, item, weight=1):
+        self.total += weight
+        count = self.counts.get(item)
+        if count is not None:
+            self.counts[item] = count + weight
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = weight
+            self.errors[item] = 0
+        else:
+            smallest, victim = self._pop_min()
+            del self.counts[victim], self.errors[victim]
+            self.counts[item] = smallest + weight
+            self.errors[item] = smallest
+        heapq.heappush(self._heap, (self.counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, i) for i, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return count, item
+
+    def min_count(self):
+        """Upper bound of the count of any item that is not in the summary."""
+        if self._absent is not None:
+            return self._absent
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def top(self, k):
+        """[(item, count, error)] of the k largest counts (ties: smaller item first)."""
+        return heapq.nsmallest(k, ((item, count, self.errors[item]) for item, count in self.counts.items()),
+                               key=lambda entry: (-entry[1], entry[0]))
+
+    @classmethod
+    def merge(cls, summaries, capacity=None):
+        """
+        A summary of the concatenated streams: counts and errors are added; an item missing
+        from a full summary may have up to that summary's min_count there, which goes into
+        both its count and its error.
+        """
+        summaries = list(summaries)
+        merged = cls(capacity or max((s.capacity for s in summaries), default=100))
+        items = set().union(*(s.counts for s in summaries)) if summaries else set()
+        for item in items:
+            count = error = 0
+            for s in summaries:
+                if item in s.counts:
+                    count += s.counts[item]
+                    error += s.errors[item]
+                else:
+                    missing = s.min_count()
+                    count += missing
+                    error += missing
+            merged.counts[item] = count
+            merged.errors[item] = error
+        merged.total = sum(s.total for s in summaries)
+        merged._absent = sum(s.min_count() for s in summaries)
+        merged._heap = [(c, i) for i, c in merged.counts.items()]
+        heapq.heapify(merged._heap)
+        return merged
+
+
+def ranked(summary, k):
+    """
+    The top k as dicts: user_id, count, error (true count is in [count - error, count]) and
+    guaranteed, True when the user is in the true top k whatever the errors are (its lower
+    bound is at least the count of the (k+1)-th entry and of any user outside the summary).
+    """
+    entries = summary.top(k + 1)
+    threshold = max(entries[k][1] if len(entries) > k else 0, summary.min_count())
+    return [{"user_id": item, "count": count, "error": error, "guaranteed": count - error >= threshold}
+            for item, count, error in entries[:k]]
+
+
+def _epochs(timestamps):
+    """Epoch seconds of timestamp strings; -1 where they do not parse."""
+    parsed = pd.to_datetime(pd.Series(timestamps, dtype=object), errors="coerce", format="mixed")
+    seconds = np.full(len(parsed), -1, dtype=np.int64)
+    valid = parsed.notna().to_numpy()
+    seconds[valid] = parsed[valid].to_numpy(dtype="datetime64[s]").astype(np.int64)
+    return seconds
+
+
+class InfluencerStream:
+    """
+    Args
+        capacity: counters per summary.
+        keep_hours / keep_days: how many hourly / daily summaries are kept (counted back from
+            the newest event seen).
+        batch_size: rows read per query; events of one batch are added up per user (and per
+            hour/day) before they go into the summaries.
+    """
+
+    def __init__(self, capacity=100, keep_hours=48, keep_days=60, batch_size=10_000):
+        self.capacity = capacity
+        self.keep_hours = keep_hours
+        self.keep_days = keep_days
+        self.batch_size = batch_size
+        self.all_time = SpaceSaving(capacity)
+        self.hourly = {}   # hour number -> SpaceSaving
+        self.daily = {}    # day number -> SpaceSaving
+        self.last_ids = {"comments": 0, "reactions": 0}
+        self.latest = None  # epoch seconds of the newest timed event
+
+    def consume(self, conn):
+        """Reads the comments and reactions above the watermarks. Returns the number of events."""
+        events = 0
+        for table, columns in STREAM_COLUMNS.items():
+            timed = table == "comments"
+            while True:
+                rows = conn.execute(STREAM_QUERY.format(columns=columns, table=table),
+                                    (self.last_ids[table], self.batch_size)).fetchall()
+                if not rows:
+                    break
+                self._add(rows, timed)
+                self.last_ids[table] = rows[-1][0]
+                events += len(rows)
+        self._evict()
+        return events
+
+    def _add(self, rows, timed):
+        for user_id, count in collections.Counter(row[1] for row in rows).items():
+            self.all_time.offer(user_id, count)
+        if not timed:
+            return
+        seconds = _epochs([row[2] for row in rows])
+        per_bucket = collections.Counter()
+        for row, t in zip(rows, seconds.tolist()):
+            if t >= 0:
+                per_bucket[("h", t // _HOUR, row[1])] += 1
+                per_bucket[("d", t // _DAY, row[1])] += 1
+        for (kind, bucket, user_id), count in per_bucket.items():
+            summaries = self.hourly if kind == "h" else self.daily
+            summary = summaries.get(bucket)
+            if summary is None:
+                summary = summaries[bucket] = SpaceSaving(self.capacity)
+            summary.offer(user_id, count)
+        if (seconds >= 0).any():
+            newest = int(seconds.max())
+            self.latest = newest if self.latest is None else max(self.latest, newest)
+
+    def _evict(self):
+        if self.latest is None:
+            return
+        for bucket in [b for b in self.hourly if b <= self.latest // _HOUR - self.keep_hours]:
+            del self.hourly[bucket]
+        for bucket in [b for b in self.daily if b <= self.latest // _DAY - self.keep_days]:
+            del self.daily[bucket]
+
+    def summary(self, window="all", at=None):
+        """
+        The summary of a window: "all", the hour or day containing `at` (epoch seconds or a
+        timestamp; default the newest event), or "30d", the 30 days up to that day.
+        """
+        if window == "all":
+            return self.all_time
+        if window not in WINDOWS:
+            raise ValueError(f"unknown window {window!r}, expected one of {WINDOWS}")
+        if self.latest is None:
+            # no timed event consumed yet: every hourly / daily summary is empty
+            return SpaceSaving(self.capacity)
+        if at is None:
+            at = self.latest
+        elif not isinstance(at, (int, np.integer)):
+            at = int(pd.Timestamp(at).timestamp())
+        if window == "hour":
+            hour = at // _HOUR
+            if hour <= self.latest // _HOUR - self.keep_hours:
+                raise ValueError(f"hour {hour} is older than the last {self.keep_hours} hours that are kept")
+            return self.hourly.get(hour, SpaceSaving(self.capacity))
+        last = at // _DAY
+        first = last - 29 if window == "30d" else last
+        if first <= self.latest // _DAY - self.keep_days:
+            raise ValueError(f"day {first} is older than the last {self.keep_days} days that are kept")
+        if window == "day":
+            return self.daily.get(last, SpaceSaving(self.capacity))
+        return SpaceSaving.merge([s for day, s in self.daily.items() if first <= day <= last], self.capacity)
+
+    def top(self, k=5, window="all", at=None):
+        return ranked(self.summary(window, at), k)
+
+
+def recount(conn, user_ids, start=None, end=None):
+    """
+    Exact engagement of the given users: comments (with created_at in [start, end) when given)
+    plus, without a time range, reactions. Returns {user_id: count}.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    marks = ",".join("?" * len(user_ids))
+    counts = dict.fromkeys(user_ids, 0)
+    params = list(user_ids)
+    window = ""
+    if start is not None:
+        window = RECOUNT_WINDOW
+        params += [start, end]
+    for user_id, count in conn.execute(RECOUNT_QUERY.format(table="comments", marks=marks, window=window), params):
+        counts[user_id] += count
+    if start is None:
+        for user_id, count in conn.execute(
+                RECOUNT_QUERY.format(table="reactions", marks=marks, window=""), user_ids):
+            counts[user_id] += count
+    return counts
+
+
+def exact_top(conn, stream, k=5, candidates=None):
+    """
+    All-time top k with exact counts: the largest entries of the summary (first `candidates`,
+    default 2k) are recounted. While a user that was not recounted could still reach the k-th
+    exact count (its upper bound is at least as large) the candidates are doubled, so the
+    result is the true top k; if the summary cannot rule out users it does not hold, the exact
+    GROUP BY is run instead. Returns [(user_id, total_engagement)] (ties: smaller id first).
+    """
+    summary = stream.all_time
+    n = candidates or 2 * k
+    while True:
+        entries = summary.top(n + 1)
+        counts = recount(conn, [item for item, _, _ in entries[:n]])
+        best = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+        outside = max(entries[n][1] if len(entries) > n else 0, summary.min_count())
+        if len(best) == k and best[-1][1] > outside:
+            return best
+        if len(entries) <= n:
+            # every counter was recounted and users that are not in the summary could still
+            # reach the top k (the capacity is too small for this stream): count them all
+            return exact_counts(conn)[:k]
+        n *= 2
+
+
+def exact_counts(conn):
+    """[(user_id, total_engagement)] of every user, the full GROUP BY of 1.3 (ties: smaller id first)."""
+    return conn.execute(EXACT_QUERY).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Top influencers from streaming Space-Saving summaries")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--capacity", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--window", choices=WINDOWS, default="all")
+    parser.add_argument("--exact", action="store_true", help="recount the all-time candidates exactly")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    stream = InfluencerStream(args.capacity)
+    events = stream.consume(conn)
+    print(f"events: {events}")
+    print(pd.DataFrame(stream.top(args.k, args.window)))
+    if args.exact:
+        print(pd.DataFrame(exact_top(conn, stream, args.k), columns=["user_id", "total_engagement"]))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# =========================
+# Near-Duplicate Spam Detection (1.4 Spammers)
+# =========================
+# The spam queries of 1.4 group posts and comments by the exact (user_id, content), so changing
+# one character hides a repeat, and each table is grouped separately. This module finds
+# near-duplicates instead:
+#   - every text is normalized (lowercase, runs of punctuation/whitespace become one space) and
+#     cut into character k-shingles (k bytes, packed into one integer),
+#   - a MinHash signature of num_perm 32-bit minimums (one 64-bit mixing hash per permutation)
+#     estimates the Jaccard similarity of two shingle sets as the share of equal positions,
+#   - LSH splits the signatures into bands; texts that share one band are candidates, and only
+#     candidates with an estimated similarity >= threshold are joined (union-find), so the
+#     work grows with the number of similar pairs, not with all pairs.
+# Texts with the same signature are joined at once, so large groups of exact repeats do not
+# make their buckets quadratic.
+#
+# posts and comments are read in one pass (a UNION ALL cursor, fetched chunk by chunk from
+# the id watermarks) and the signatures of the chunks are computed in a process pool.
+# The clusters are reported per user (one user repeating a text at least min_size times) and
+# across users (the same text from several accounts).
+#
+# Usage:
+#   python near_duplicates.py [--db database.sqlite] [--threshold 0.8] [--min-size 3] [--workers 4]
+import argparse
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+SOURCES = ("posts", "comments")
+
+# scan() reads posts and comments above the watermarks in one cursor (source 0 = posts, 1 = comments);
+# both queries are also the 1.4 near-duplicate entries of schema_optimization.py
+ROWS_QUERY = """
+    SELECT 0, id, user_id, content FROM posts WHERE id > ? AND content IS NOT NULL
+    UNION ALL
+    SELECT 1, id, user_id, content FROM comments WHERE id > ? AND content IS NOT NULL
+"""
+CONTENT_QUERY = "SELECT content FROM {table} WHERE id = ?"
+
+_NON_WORD = re.compile(r"[\W_]+")
+_MASK64 = (1 << 64) - 1
+
+
+def normalize(text):
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def shingles(text, k=5):
+    """Distinct character k-shingles of the normalized text as uint64 (k <= 8 bytes each)."""
+    data = np.frombuffer(normalize(text).encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+    if len(data) < k:  # a short text is one shingle
+        k = len(data)
+        if not k:
+            return np.empty(0, dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(data, k)
+    packed = np.zeros(len(windows), dtype=np.uint64)
+    for j in range(k):
+        packed = (packed << np.uint64(8)) | windows[:, j]
+    return np.unique(packed | np.uint64(k) << np.uint64(61))  # short shingles do not collide with long ones
+
+
+def _mix(x):
+    """splitmix64 finalizer, vectorized (uint64 arithmetic wraps around)."""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class MinHasher:
+    """MinHash signatures of num_perm 32-bit values; texts without shingles get an all-max row."""
+
+    EMPTY = np.iinfo(np.uint32).max
+
+    def __init__(self, num_perm=128, k=5, seed=1):
+        self.num_perm = num_perm
+        self.k = k
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.seeds = rng.integers(0, _MASK64, size=num_perm, dtype=np.uint64, endpoint=True)
+
+    def signatures(self, texts):
+        """(len(texts) x num_perm) uint32 signatures."""
+        sets = [shingles(text, self.k) for text in texts]
+        result = np.full((len(sets), self.num_perm), self.EMPTY, dtype=np.uint32)
+        present = [i for i, s in enumerate(sets) if len(s)]
+        if not present:
+            return result
+        values = np.concatenate([sets[i] for i in present])
+        offsets = np.cumsum([0] + [len(sets[i]) for i in present[:-1]])
+        for p, seed in enumerate(self.seeds):
+            # the top 32 bits of one mixing hash per permutation; minimum per text
+            hashed = (_mix(values ^ seed) >> np.uint64(32)).astype(np.uint32)
+            result[present, p] = np.minimum.reduceat(hashed, offsets)
+        return result
+
+
+def lsh_params(threshold, num_perm):
+    """
+    (bands, rows) with bands * rows <= num_perm minimizing the probability of missing a pair
+    above the threshold plus the probability of a candidate below it (both integrated over the
+    similarity, as in the usual MinHash LSH tuning).
+    """
+    best, best_error = (1, num_perm), None
+    below = np.linspace(0.0, threshold, 200)
+    above = np.linspace(threshold, 1.0, 200)
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positive = (1 - (1 - below ** rows) ** bands).mean() * threshold
+            false_negative = ((1 - above ** rows) ** bands).mean() * (1 - threshold)
+            error = false_positive + false_negative
+            if best_error is None or error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    Args
+        threshold: estimated Jaccard similarity above which two texts are near-duplicates.
+        num_perm: MinHash permutations (signature length).
+        k: shingle length in bytes (<= 8).
+        seed: seed of the permutations; signatures of different seeds cannot be compared.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, k=5, seed=1):
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold must be in (0, 1]")
+        if not 1 <= k <= 8:
+            raise ValueError("k must be between 1 and 8")
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, k, seed)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.buckets = [{} for _ in range(self.bands)]  # band -> band bytes -> [document]
+        self.same = {}                                    # signature bytes -> first document
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self.sources = []   # index into SOURCES per document
+        self.ids = []       # row id per document
+        self.user_ids = []  # user id per document
+        self._parent = []
+        self.last_ids = dict.fromkeys(SOURCES, 0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _find(self, doc):
+        parent = self._parent
+        while parent[doc] != doc:
+            parent[doc] = parent[parent[doc]]
+            doc = parent[doc]
+        return doc
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a != b:
+            self._parent[max(a, b)] = min(a, b)
+
+    def add(self, rows, signatures):
+        """
+        Adds documents: rows are (source index, id, user_id) tuples, signatures their MinHash
+        rows. Texts without shingles (empty after normalizing) are skipped.
+        """
+        keep = [i for i in range(len(rows)) if (signatures[i] != MinHasher.EMPTY).any()]
+        first = len(self.ids)
+        needed = first + len(keep)
+        if needed > len(self.signatures):
+            grown = np.empty((max(needed, 2 * len(self.signatures)), self.hasher.num_perm), dtype=np.uint32)
+            grown[:first] = self.signatures[:first]
+            self.signatures = grown
+        for doc, i in enumerate(keep, start=first):
+            source, row_id, user_id = rows[i]
+            signature = signatures[i]
+            self.signatures[doc] = signature
+            self.sources.append(source)
+            self.ids.append(row_id)
+            self.user_ids.append(user_id)
+            self._parent.append(doc)
+
+            key = signature.tobytes()
+            twin = self.same.get(key)
+            if twin is not None:
+                self._union(twin, doc)
+                continue
+            self.same[key] = doc
+            candidates = set()
+            for band, buckets in enumerate(self.buckets):
+                band_key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                members = buckets.setdefault(band_key, [])
+                candidates.update(members)
+                members.append(doc)
+            if candidates:
+                candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+                similarity = (self.signatures[candidates] == signature).mean(axis=1)
+                for other in candidates[similarity >= self.threshold].tolist():
+                    self._union(other, doc)
+
+    def similarity(self, a, b):
+        """Estimated Jaccard similarity of two documents."""
+        return float((self.signatures[a] == self.signatures[b]).mean())
+
+    def clusters(self):
+        """Lists of documents that are near-duplicates of each other (2 or more), largest first."""
+        groups = {}
+        for doc in range(len(self.ids)):
+            groups.setdefault(self._find(doc), []).append(doc)
+        return sorted((g for g in groups.values() if len(g) > 1), key=lambda g: (-len(g), g[0]))
+
+
+def _rows(conn, last_ids):
+    """One cursor over the posts and comments above the watermarks."""
+    return conn.execute(ROWS_QUERY, (last_ids["posts"], last_ids["comments"]))
+
+
+def _chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+_worker_hasher = None
+
+
+def _init_worker(num_perm, k, seed):
+    global _worker_hasher
+    _worker_hasher = MinHasher(num_perm, k, seed)
+
+
+def _signatures_in_worker(texts):
+    return _worker_hasher.signatures(texts)
+
+
+def scan(conn, index, workers=1, chunk_size=1000):
+    """
+    Reads the posts and comments above index.last_ids in one pass and adds them to the index.
+
+    Args
+        conn: sqlite3 connection to database.sqlite.
+        index: the NearDuplicateIndex to extend.
+        workers: worker processes computing the signatures (1 computes in this process).
+        chunk_size: texts per chunk (and per task sent to a worker).
+
+    Returns:
+        The number of texts read.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    hasher = index.hasher
+    read = 0
+
+    def add(rows, signatures):
+        nonlocal read
+        index.add([row[:3] for row in rows], signatures)
+        for source, row_id, *_ in rows:
+            name = SOURCES[source]
+            index.last_ids[name] = max(index.last_ids[name], row_id)
+        read += len(rows)
+
+    chunks = _chunks(_rows(conn, index.last_ids), chunk_size)
+    if workers <= 1:
+        for rows in chunks:
+            add(rows, hasher.signatures([row[3] for row in rows]))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(hasher.num_perm, hasher.k, hasher.seed)) as pool:
+            pending = []
+            for rows in chunks:
+                # at most two chunks per worker in flight, added in input order
+                pending.append((rows, pool.submit(_signatures_in_worker, [row[3] for row in rows])))
+                if len(pending) >= 2 * workers:
+                    add(*_result(pending.pop(0)))
+            while pending:
+                add(*_result(pending.pop(0)))
+    return read
+
+
+def _result(item):
+    rows, future = item
+    return rows, future.result()
+
+
+def _content(conn, source, row_id):
+    row = conn.execute(CONTENT_QUERY.format(table=SOURCES[source]), (row_id,)).fetchone()
+    return row[0] if row else None
+
+
+def user_clusters(conn, index, min_size=3):
+    """
+    Users who posted or commented near-duplicates of one text at least min_size times.
+    Returns a DataFrame: user_id, repeat_count, posts, comments, example (one of the texts).
+    """
+    records = []
+    for cluster in index.clusters():
+        per_user = {}
+        for doc in cluster:
+            per_user.setdefault(index.user_ids[doc], []).append(doc)
+        for user_id, docs in per_user.items():
+            if len(docs) >= min_size:
+                sources = [index.sources[doc] for doc in docs]
+                records.append({"user_id": user_id, "repeat_count": len(docs),
+                                "posts": sources.count(0), "comments": sources.count(1),
+                                "example": _content(conn, index.sources[docs[0]], index.ids[docs[0]])})
+    columns = ["user_id", "repeat_count", "posts", "comments", "example"]
+    return pd.DataFrame(records, columns=columns).sort_values(
+        ["repeat_count", "user_id"], ascending=[False, True], ignore_index=True)
+
+
+def cross_user_clusters(conn, index, min_users=2):
+    """
+    Near-duplicate texts from at least min_users different users.
+    Returns a DataFrame: size, users, user_ids, example.
+    """
+    records = []
+    for cluster in index.clusters():
+        users = sorted({index.user_ids[doc] for doc in cluster})
+        if len(users) >= min_users:
+            records.append({"size": len(cluster), "users": len(users), "user_ids": users,
+                            "example": _content(conn, index.sources[cluster[0]], index.ids[cluster[0]])})
+    return pd.DataFrame(records, columns=["size", "users", "user_ids", "example"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate posts and comments per user and across users")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Jaccard similarity threshold")
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--k", type=int, default=5, help="shingle length in characters")
+    parser.add_argument("--min-size", type=int, default=3, help="repeats that make a user a spammer")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes computing the signatures")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    index = NearDuplicateIndex(args.threshold, args.num_perm, args.k)
+    read = scan(conn, index, workers=args.workers, chunk_size=args.chunk_size)
+    print(f"texts: {read}, bands: {index.bands} x {index.rows} rows, clusters: {len(index.clusters())}")
+    with pd.option_context("display.max_colwidth", 60, "display.width", 200):
+        print("\nNear-duplicate spammers")
+        print(user_clusters(conn, index, args.min_size))
+        print("\nNear-duplicates across users")
+        print(cross_user_clusters(conn, index))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
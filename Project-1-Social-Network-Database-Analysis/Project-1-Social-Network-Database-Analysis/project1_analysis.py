@@ -9,6 +9,13 @@
 import sqlite3
 import pandas as pd
 import os
+import sys
+from table_profiler import profile_table, profile_snapshot, print_profile
+from activity_index import ActivityIndex
+from heavy_hitters import InfluencerStream, exact_top
+from near_duplicates import NearDuplicateIndex, scan, user_clusters, cross_user_clusters
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))  # snapshot.py is in the repository root
+from snapshot import from_environment
 os.system('clear')
 
 ###I am saving the database.sqlite in a variable and then connecting the database to python using sqlite3.connect()
@@ -24,12 +31,14 @@ except Exception as e:
 tablenames_df = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table'", conn)
 print(tablenames_df)
 
-###Now I want to see all the information and data about each table. I useSELECT* to see all columns and rows
+###Now I want to see all the information and data about each table. Each table is streamed in chunks
+###(see table_profiler.py) instead of loading it whole with SELECT *, and I print its row count, NULL
+###counts, distinct counts, time ranges, the first rows and the column names
+###With SNAPSHOT_DIR set (python ../../snapshot.py --project 1) the tables are profiled from the memory-mapped
+###columnar snapshot instead, so nothing is read from SQLite or parsed again
+snapshot = from_environment(conn)
 for table in ["follows", 'users', 'reactions', 'comments', 'posts']:
-    print(f'\n\nThis is the information of {table}')
-    table= pd.read_sql_query(f"SELECT * FROM {table}", conn)
-    print(table)
-    print(f"this is the column names of this table:{table.columns}")
+    print_profile(profile_snapshot(snapshot, table) if snapshot is not None else profile_table(conn, table))
 ### Information of (follows) table: I can see 2 columns named follower_id , followed_id
 #The table has 7225 rows
 ### Information of (users) table: I can see 7 columns named 'id', 'username', 'location', 'birthdate', 'created_at', 'profile','password'
@@ -50,17 +59,16 @@ for table in ["follows", 'users', 'reactions', 'comments', 'posts']:
 #After that, COUNT(*) counts all rows that I need. I put the column name lurkers with As lurkers.
 #FROM users takes the data from users table where users.id is not in posts, comments, and reactions tables. I use DISTINCT  because I want to remove duplicates if a user has many posts, comments or reactions. Only users who are missing from all three tables remain. I ran the code and the number of lurkers are 55.
 
+#The same count now comes from an activity bitmap index (see activity_index.py): posts, comments and reactions are read
+#once into per-user bitmaps, and the lurkers are the users whose bit is not set in any of them, so this is a
+#bitwise operation instead of three NOT IN subqueries over the whole tables.
+#The index is saved to activity_index.npz next to the database, so the next run only reads the rows added since.
+
+ACTIVITY_INDEX_FILE = "activity_index.npz"
+
 try:
-    lurkers_df = pd.read_sql_query("""
-    SELECT
-        COUNT(*) AS lurkers
-    FROM
-        users u
-    WHERE
-        u.id NOT IN (SELECT DISTINCT user_id FROM posts)
-        AND u.id NOT IN (SELECT DISTINCT user_id FROM comments)
-        AND u.id NOT IN (SELECT DISTINCT user_id FROM reactions);
-    """, conn)
+    activity, _ = ActivityIndex.load_or_build(conn, ACTIVITY_INDEX_FILE)
+    lurkers_df = pd.DataFrame({"lurkers": [activity.lurkers()]})
     
     print(f'\n\nNumber of lurkers on the platform')
     print(lurkers_df)
@@ -72,20 +80,14 @@ except Exception as e:
 # =========================
 ###I am using comments and reactions tables as they are engagement related tables. I am selecting all user IDs from the comments and reactions tables and combining them with union all. I use union all because I want to keep the duplicates and get one combined list of all user activity. I use order by desc because I want to see the biggest numbers first and limit5 to see top 5. The user_id 88 with total engagement 165 has the most engagement.
 
+#The ranking now comes from streaming Space-Saving summaries (see heavy_hitters.py): comments and reactions are read
+#once in id order and only the largest counters are kept, then exact_top recounts the candidates with indexed queries,
+#so the result is the same top 5 (ties: smaller user_id first) without grouping every row on every run.
+
 try:
-    influencers_df = pd.read_sql_query("""
-    SELECT
-        user_id,
-        (COUNT(*) ) AS total_engagement
-    FROM (
-        SELECT user_id FROM comments
-        UNION ALL
-        SELECT user_id FROM reactions
-    )
-    GROUP BY user_id
-    ORDER BY total_engagement DESC
-    LIMIT 5;
-    """, conn)
+    influencers = InfluencerStream(capacity=100)
+    influencers.consume(conn)
+    influencers_df = pd.DataFrame(exact_top(conn, influencers, k=5), columns=["user_id", "total_engagement"])
 
     print(f'\n\nTop 5 influencers')
     print(influencers_df)
@@ -146,3 +148,21 @@ else:
     print("Spammers found in comments")
     print(spam_comments_df)
 
+#The queries above only catch exact repeats of (user_id, content), so changing one character hides a spam post.
+#near_duplicates.py reads posts and comments in one pass, builds MinHash signatures of the character shingles and
+#groups texts with an estimated Jaccard similarity of 0.8 or more (LSH buckets, so not every pair is compared).
+#Every spammer found above is also found here, together with the near-duplicate repeats and the texts repeated by several users.
+
+try:
+    near_duplicates = NearDuplicateIndex(threshold=0.8)
+    scan(conn, near_duplicates)
+    near_spam_df = user_clusters(conn, near_duplicates, min_size=3)
+    shared_spam_df = cross_user_clusters(conn, near_duplicates)
+
+    print(f'\n\nNear-duplicate spammers (posts and comments)')
+    print(near_spam_df)
+    print(f'\n\nNear-duplicate texts posted by several users')
+    print(shared_spam_df)
+except Exception as e:
+    print(f"not working: {e}")
+
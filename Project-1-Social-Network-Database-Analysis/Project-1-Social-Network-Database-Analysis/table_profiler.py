@@ -0,0 +1,172 @@
+# =========================
+# Streaming Table Profiler (1.1 Database Exploration)
+# =========================
+# Section 1.1 read every table with "SELECT *" into one DataFrame to print it, so memory grew
+# with the table. profile_table streams a table in chunks (read_sql_query with chunksize, which
+# fetches from one cursor batch by batch) and keeps only a fixed-size summary per column:
+#   - rows and NULL counts,
+#   - a distinct-count estimate from a HyperLogLog sketch (2**precision one-byte registers per
+#     column, standard error about 1.04 / sqrt(2**precision), 0.8% for the default 14),
+#   - min/max of the time columns (declared date/time/timestamp), compared as parsed timestamps,
+#     and how many of their values did not parse,
+#   - the first few rows as examples.
+# Memory is one chunk plus the sketches, however large the table is.
+#
+# Usage:
+#   python table_profiler.py [--db database.sqlite] [--chunk-size 10000] [--json profile.json]
+import argparse
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+TABLES = ["follows", "users", "reactions", "comments", "posts"]
+# what profile_table streams; schema_optimization.py checks it as 1.1 explore <table>
+TABLE_QUERY = "SELECT * FROM {table}"
+
+# bit_length(x) of a uint64 x is the number of powers of two <= x
+_POWERS_OF_TWO = np.array([1 << i for i in range(64)], dtype=np.uint64)
+
+
+class HyperLogLog:
+    """Distinct-count estimate of 64-bit hashes in 2**precision registers."""
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return
+        p = np.uint64(self.precision)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        rest = hashes << p                                   # the remaining 64 - p bits, left-aligned
+        leading_zeros = 64 - np.searchsorted(_POWERS_OF_TWO, rest, side="right")
+        rank = np.minimum(leading_zeros + 1, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def add(self, values):
+        """Adds a pandas Series (NULLs are skipped, like COUNT(DISTINCT ...))."""
+        values = values.dropna()
+        if values.dtype.kind == "f" and (values == np.floor(values)).all():
+            values = values.astype(np.int64)  # a chunk with NULLs reads an integer column as float
+        if len(values):
+            self.add_hashes(pd.util.hash_pandas_object(values, index=False).to_numpy())
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        empty = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and empty:
+            return m * np.log(m / empty)  # linear counting for small cardinalities
+        return raw
+
+
+def time_columns(conn, table):
+    """Columns declared as date, time or timestamp."""
+    columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    return [name for _, name, decl, *_ in columns if any(t in (decl or "").lower() for t in ("date", "time"))]
+
+
+def profile_table(conn, table, chunk_size=10_000, precision=14, examples=5):
+    """
+    Args
+        conn: sqlite3 connection to database.sqlite.
+        table: table name.
+        chunk_size: rows held in memory at a time.
+        precision: HyperLogLog precision (2**precision registers per column).
+        examples: number of example rows kept from the start of the table.
+
+    Returns:
+        A dict with rows, columns ({name: {nulls, distinct_estimate[, min, max, unparsed]}})
+        and examples (a DataFrame of the first rows).
+    """
+    names = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    chunks = pd.read_sql_query(TABLE_QUERY.format(table=table), conn, chunksize=chunk_size)
+    return profile_chunks(table, chunks, names, time_columns(conn, table), precision, examples)
+
+
+def profile_snapshot(snapshot, table, chunk_size=10_000, precision=14, examples=5):
+    """
+    profile_table on a columnar snapshot (snapshot.py in the repository root). Time columns are
+    stored as epochs there, so a value that did not parse at export counts as a NULL.
+    """
+    names = [name for name in snapshot.columns(table) if name != "rowid"]
+    times = [name for name in names if snapshot.kind(table, name) == "time"]
+    return profile_chunks(table, snapshot.frames(table, names, chunk_size), names, times, precision, examples)
+
+
+def profile_chunks(table, chunks, names, times=(), precision=14, examples=5):
+    """The profile of a table read as DataFrame chunks with the columns `names`."""
+    times = set(times)
+    rows = 0
+    columns = {name: {"nulls": 0} for name in names}
+    sketches = {name: HyperLogLog(precision) for name in names}
+    head = None
+    for chunk in chunks:
+        if head is None:
+            head = chunk.head(examples).copy()
+        rows += len(chunk)
+        for name in chunk.columns:
+            values = chunk[name]
+            stats = columns[name]
+            stats["nulls"] += int(values.isna().sum())
+            sketches[name].add(values)
+            if name in times:
+                parsed = pd.to_datetime(values, errors="coerce", format="mixed")
+                stats["unparsed"] = stats.get("unparsed", 0) + int((parsed.isna() & values.notna()).sum())
+                if parsed.notna().any():
+                    low, high = parsed.min(), parsed.max()
+                    stats["min"] = low if stats.get("min") is None else min(stats["min"], low)
+                    stats["max"] = high if stats.get("max") is None else max(stats["max"], high)
+                else:
+                    stats.setdefault("min", None)
+                    stats.setdefault("max", None)
+
+    if head is None:  # empty table
+        head = pd.DataFrame(columns=names)
+    for name, stats in columns.items():
+        stats["distinct_estimate"] = int(round(sketches[name].estimate())) if rows else 0
+        for key in ("min", "max"):
+            if stats.get(key) is not None:
+                stats[key] = str(stats[key])
+    return {"table": table, "rows": rows, "columns": columns, "examples": head}
+
+
+def print_profile(profile):
+    print(f"\n\nThis is the information of {profile['table']}: {profile['rows']} rows")
+    stats = profile["columns"]
+    keys = list(dict.fromkeys(key for column in stats.values() for key in column))
+    # cell by cell, so the counts of the columns that only time columns have stay integers
+    summary = pd.DataFrame([[column.get(key, "") for key in keys] for column in stats.values()],
+                           index=pd.Index(list(stats), name="column"), columns=keys, dtype=object)
+    print(summary.to_string())
+    print("examples:")
+    print(profile["examples"])
+    print(f"this is the column names of this table:{list(profile['columns'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the tables of database.sqlite in bounded memory")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--precision", type=int, default=14, help="HyperLogLog precision (4-18)")
+    parser.add_argument("--tables", nargs="+", default=TABLES)
+    parser.add_argument("--json", help="also write the profiles (without examples) to this file")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    profiles = [profile_table(conn, table, args.chunk_size, args.precision) for table in args.tables]
+    conn.close()
+    for profile in profiles:
+        print_profile(profile)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([{k: v for k, v in p.items() if k != "examples"} for p in profiles], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,21 @@
 # Exercise 2.1 – Growth
 # =========================
 
+import os
+import sys
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import sqlite3
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # snapshot.py is in the repository root
+from snapshot import from_environment
+from rollups import TimeRollups, servers_needed
+
 conn = sqlite3.connect("database.sqlite")
+# With SNAPSHOT_DIR set (python ../snapshot.py --project 2 writes ./snapshot) exercises 2.2-2.4 read the
+# memory-mapped columns of the snapshot instead of running their queries; the results are the same.
+snapshot = from_environment(conn)
 
 q = """
 SELECT
@@ -16,19 +26,16 @@ FROM comments
 GROUP BY STRFTIME('%Y-%m', created_at)
 ORDER BY month;
 """
-df = pd.read_sql_query(q, conn)
+# The monthly counts of q are kept in the rollup_counts table (see rollups.py): refresh() only counts the
+# comments added since the last run, so this no longer groups every comment on every run.
+rollups = TimeRollups(conn)
+rollups.refresh()
+df = rollups.series("month", "comments").rename(columns={"bucket": "month", "count": "monthly_load"})
 df["month"] = pd.to_datetime(df["month"] + "-01")
 
 # I am calculating the average monthly growth rate
-df["growth"] = df["monthly_load"].pct_change()
-avg_growth = df["growth"].mean()
-current = df["monthly_load"].iloc[-1]
-forecast = current * (1 + avg_growth) ** 36  # 3 years ahead
-
-# Servers: 16 handle current load → scale up for forecast +20%
-servers_now = 16
-per_server = current / servers_now
-needed = int((forecast / per_server) * 1.2)
+# Servers: 16 handle current load → scale up for forecast 3 years ahead +20%
+needed, forecast, avg_growth = servers_needed(df["monthly_load"], servers_now=16, months_ahead=36, redundancy=0.2)
 
 plt.plot(df["month"], df["monthly_load"], marker="o")
 plt.title("Monthly comments trend")
@@ -61,7 +68,14 @@ GROUP BY p.id
 ORDER BY virality_score DESC
 LIMIT 3;
 """
-top3 = pd.read_sql_query(Being_viral, conn)
+if snapshot is not None:
+    top3 = pd.DataFrame({"post_id": snapshot.array("posts", "id")})
+    top3["comment_count"] = top3["post_id"].map(pd.Series(snapshot.array("comments", "post_id")).value_counts()).fillna(0).astype(int)
+    top3["reaction_count"] = top3["post_id"].map(pd.Series(snapshot.array("reactions", "post_id")).value_counts()).fillna(0).astype(int)
+    top3["virality_score"] = top3["comment_count"] + top3["reaction_count"]
+    top3 = top3.sort_values(["virality_score", "post_id"], ascending=[False, True]).head(3).reset_index(drop=True)
+else:
+    top3 = pd.read_sql_query(Being_viral, conn)
 print("\nTop 3 viral posts (by combined comments + reactions):")
 print(top3)
 
@@ -71,7 +85,7 @@ print(top3)
 # Exercise 2.3 – Content Lifecycle
 # =========================
 
-q = """
+lifecycle_query = """
 SELECT
   p.id                 AS post_id,
   p.created_at         AS post_time,
@@ -83,7 +97,14 @@ GROUP BY p.id
 ORDER BY p.id;
 """
 
-df = pd.read_sql_query(q, conn)
+if snapshot is not None:
+    engagement = snapshot.frame("comments", ["post_id", "created_at"]).groupby("post_id")["created_at"].agg(["min", "max"])
+    df = pd.DataFrame({"post_id": snapshot.array("posts", "id"), "post_time": snapshot.column("posts", "created_at")})
+    df["first_engagement_time"] = df["post_id"].map(engagement["min"])
+    df["last_engagement_time"] = df["post_id"].map(engagement["max"])
+    df = df.sort_values("post_id", ignore_index=True)
+else:
+    df = pd.read_sql_query(lifecycle_query, conn)
 
 # I am converting it to the datetime
 df["post_time"] = pd.to_datetime(df["post_time"])
@@ -169,7 +190,19 @@ ORDER BY total_engagement DESC
 LIMIT 3;
 """
 
-top3_pairs = pd.read_sql_query(connections_query, conn)
+if snapshot is not None:
+    posters = snapshot.frame("posts", ["id", "user_id"]).rename(columns={"id": "post_id", "user_id": "poster"})
+    events = pd.concat([snapshot.frame("comments", ["post_id", "user_id"]),
+                        snapshot.frame("reactions", ["post_id", "user_id"])], ignore_index=True)
+    events = events.rename(columns={"user_id": "engager"}).merge(posters, on="post_id")
+    events = events[events["engager"] != events["poster"]]
+    pairs = pd.DataFrame({"user_a": np.minimum(events["engager"], events["poster"]),
+                          "user_b": np.maximum(events["engager"], events["poster"])})
+    top3_pairs = (pairs.groupby(["user_a", "user_b"]).size().reset_index(name="total_engagement")
+                  .sort_values(["total_engagement", "user_a", "user_b"], ascending=[False, True, True])
+                  .head(3).reset_index(drop=True))
+else:
+    top3_pairs = pd.read_sql_query(connections_query, conn)
 print("\nTop 3 user pairs with strongest mutual engagement:")
 print(top3_pairs)
 #When I run the code I can see User 38 and User 88 with 16 engagements
@@ -0,0 +1,156 @@
+# =========================
+# Time-Bucket Rollups (Exercise 2.1 Growth)
+# =========================
+# Exercise 2.1 grouped every comment by STRFTIME('%Y-%m', created_at) on every run, so the
+# forecast got slower as the history grew. TimeRollups keeps hourly, daily and monthly counts of
+# posts, comments and reactions in the rollup_counts table of database.sqlite and only reads the
+# rows above a stored id watermark: each refresh() is one grouped INSERT ... ON CONFLICT per
+# grain and table, over the new id range of the primary key. The growth series is then a read
+# of a few hundred rollup rows, whatever the number of comments.
+#
+# Buckets are the same STRFTIME strings the queries use ('%Y-%m-%d %H:00', '%Y-%m-%d', '%Y-%m'),
+# so the monthly comment series equals the 2.1 query; rows whose created_at does not parse are
+# not counted. reactions has no timestamp, its rows are counted in the bucket of the post they
+# react to. The tables are treated as append-only (like the risk_* state of Project 3): edits or
+# deletes of already counted rows need rebuild().
+#
+# Usage:
+#   python rollups.py [--db database.sqlite] [--grain month] [--source comments] [--rebuild]
+import argparse
+import sqlite3
+
+import pandas as pd
+
+GRAINS = {
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+# source -> (table whose id is the watermark, FROM clause, timestamp expression)
+SOURCES = {
+    "posts": ("posts", "posts t", "t.created_at"),
+    "comments": ("comments", "comments t", "t.created_at"),
+    "reactions": ("reactions", "reactions t JOIN posts p ON p.id = t.post_id", "p.created_at"),
+}
+
+# (grain, source, bucket, count) of the rows in an id range, what refresh() adds to rollup_counts;
+# schema_optimization.py checks its plan per source (2.1 rollup <source>)
+BUCKET_COUNTS_QUERY = """
+    SELECT ?, ?, STRFTIME(?, {timestamp}) AS bucket, COUNT(*)
+    FROM {from_clause}
+    WHERE t.id > ? AND t.id <= ? AND bucket IS NOT NULL
+    GROUP BY bucket
+"""
+
+
+class TimeRollups:
+    """
+    Args
+        conn: sqlite3 connection to database.sqlite, the rollup_* tables are created there.
+
+    refresh() counts the new rows, series() reads one grain/source as a DataFrame.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS rollup_watermarks (
+                source  TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rollup_counts (
+                grain  TEXT    NOT NULL,            -- hour, day or month
+                source TEXT    NOT NULL,            -- posts, comments or reactions
+                bucket TEXT    NOT NULL,            -- STRFTIME of the grain
+                count  INTEGER NOT NULL,
+                PRIMARY KEY (grain, source, bucket)
+            ) WITHOUT ROWID;
+        """)
+        conn.commit()
+
+    def _watermark(self, source):
+        row = self.conn.execute("SELECT last_id FROM rollup_watermarks WHERE source=?", (source,)).fetchone()
+        return row[0] if row else 0
+
+    def refresh(self):
+        """
+        Adds the rows above the watermarks to every grain, in one transaction.
+        Returns {source: number of new rows}.
+        """
+        added = {}
+        with self.conn:
+            for source, (table, from_clause, timestamp) in SOURCES.items():
+                low = self._watermark(source)
+                high = self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+                if high <= low:
+                    added[source] = 0
+                    continue
+                for grain, fmt in GRAINS.items():
+                    self.conn.execute(
+                        "INSERT INTO rollup_counts (grain, source, bucket, count)"
+                        + BUCKET_COUNTS_QUERY.format(timestamp=timestamp, from_clause=from_clause)
+                        + "ON CONFLICT (grain, source, bucket) DO UPDATE SET count = count + excluded.count",
+                        (grain, source, fmt, low, high))
+                added[source] = self.conn.execute(f"SELECT COUNT(*) FROM {table} WHERE id > ? AND id <= ?",
+                                                  (low, high)).fetchone()[0]
+                self.conn.execute("""
+                    INSERT INTO rollup_watermarks (source, last_id) VALUES (?, ?)
+                    ON CONFLICT (source) DO UPDATE SET last_id = excluded.last_id
+                """, (source, high))
+        return added
+
+    def rebuild(self):
+        """Drops the counts and the watermarks and counts every row again."""
+        with self.conn:
+            self.conn.execute("DELETE FROM rollup_counts")
+            self.conn.execute("DELETE FROM rollup_watermarks")
+        return self.refresh()
+
+    def series(self, grain="month", source="comments"):
+        """DataFrame (bucket, count) of one grain and source in bucket order."""
+        if grain not in GRAINS:
+            raise ValueError(f"unknown grain {grain!r}, expected one of {list(GRAINS)}")
+        if source not in SOURCES:
+            raise ValueError(f"unknown source {source!r}, expected one of {list(SOURCES)}")
+        return pd.read_sql_query(
+            "SELECT bucket, count FROM rollup_counts WHERE grain = ? AND source = ? ORDER BY bucket",
+            self.conn, params=(grain, source))
+
+
+def servers_needed(monthly_load, servers_now=16, months_ahead=36, redundancy=0.2):
+    """
+    The 2.1 capacity estimate: the last month's load grows by the average monthly growth rate
+    for months_ahead months; servers scale with the load (servers_now handle the last month),
+    plus redundancy. Returns (servers, forecast load, average monthly growth).
+    """
+    monthly_load = pd.Series(monthly_load).reset_index(drop=True)
+    avg_growth = monthly_load.pct_change().mean()
+    current = monthly_load.iloc[-1]
+    forecast = current * (1 + avg_growth) ** months_ahead
+    per_server = current / servers_now
+    return int((forecast / per_server) * (1 + redundancy)), forecast, avg_growth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain hourly/daily/monthly rollups and forecast servers")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--grain", choices=list(GRAINS), default="month")
+    parser.add_argument("--source", choices=list(SOURCES), default="comments")
+    parser.add_argument("--rebuild", action="store_true", help="count every row again")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    rollups = TimeRollups(conn)
+    added = rollups.rebuild() if args.rebuild else rollups.refresh()
+    print("new rows: " + ", ".join(f"{source} {n}" for source, n in added.items()))
+    series = rollups.series(args.grain, args.source)
+    print(series.to_string(index=False))
+    if args.grain == "month" and len(series):
+        servers, forecast, growth = servers_needed(series["count"])
+        print(f"average monthly growth {growth:.1%}, load in 3 years {forecast:,.0f}, servers needed: {servers}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
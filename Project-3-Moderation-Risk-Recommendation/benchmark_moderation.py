@@ -0,0 +1,314 @@
+# =========================
+# Benchmark – moderate_content vs ModerationEngine
+# =========================
+# I run every post, comment and profile of database.sqlite through the original per-call
+# implementation of moderate_content and through the precompiled ModerationEngine, check that
+# both give exactly the same (moderated_content, score) for every text, and print texts/second.
+#
+# With --suite it also runs synthetic content classes (clean text, Tier 1 / Tier 2 hits that
+# exit early, URL-heavy spam, long all-caps rants, phone number posts and the database texts)
+# through both paths and reports per class the throughput, p50/p99 latency per call and the time
+# ModerationEngine spends in each rule stage. --json saves the suite, --compare checks a run
+# against a saved one and fails when a class got slower than --tolerance.
+#
+# Usage:
+#   python benchmark_moderation.py [--rules rules.json] [--db database.sqlite] [--repeat 3]
+#   python benchmark_moderation.py --suite [--texts 2000] [--json run.json] [--compare baseline.json]
+#
+# The real word lists come from the course rules document, which is not part of this
+# repository. Without --rules the benchmark uses SAMPLE_RULES below, a stand-in of the same shape.
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import time
+
+import instrumentation
+from moderation import ModerationEngine
+
+
+SAMPLE_RULES = {
+    "tier1_words": ["fucking", "fuck", "goddamn", "kill yourself", "retard"],
+    "tier2_phrases": ["referral link", "free money", "click here", "dm me for", "giveaway",
+                      "limited time offer", "work from home", "crypto investment"],
+    "tier3_words": ["damn", "hell", "crap", "stupid", "idiots", "idiot", "shit", "pissed"],
+}
+
+
+def legacy_moderate_content(content, TIER1_WORDS, TIER2_PHRASES, TIER3_WORDS):
+    """The original moderate_content from project3_analysis.py, kept as the reference."""
+    original_content = content
+    score = 0.0
+
+    TIER1_PATTERN = r'\b(' + '|'.join(TIER1_WORDS) + r')\b'
+    if re.search(TIER1_PATTERN, original_content, flags=re.IGNORECASE):
+        return "[content removed due to severe violation]", 5.0
+
+    for phrase in TIER2_PHRASES:
+        if phrase.lower() in original_content.lower():
+            return "[content removed due to spam/scam policy]", 5.0
+
+    moderated_content = original_content
+
+    TIER3_PATTERN = r'\b(' + '|'.join(TIER3_WORDS) + r')\b'
+    matches = re.findall(TIER3_PATTERN, moderated_content, flags=re.IGNORECASE)
+    score += len(matches) * 2.0
+    moderated_content = re.sub(TIER3_PATTERN, lambda m: '*' * len(m.group(0)), moderated_content, flags=re.IGNORECASE)
+
+    URL_PATTERN = r'https?://[^\s]+'
+    url_matches = re.findall(URL_PATTERN, moderated_content)
+    score += len(url_matches) * 2.0
+    moderated_content = re.sub(URL_PATTERN, '[link removed]', moderated_content)
+
+    alphabetic_chars = [c for c in moderated_content if c.isalpha()]
+    if len(alphabetic_chars) > 15:
+        uppercase_count = sum(1 for c in alphabetic_chars if c.isupper())
+        uppercase_ratio = uppercase_count / len(alphabetic_chars)
+        if uppercase_ratio > 0.70:
+            score += 0.5
+
+    PHONE_PATTERN = r'\b\d{3}[-.\s]?\d{3}[-.\s]?\d{4}\b|\b\d{10}\b'
+    phone_matches = re.findall(PHONE_PATTERN, moderated_content)
+    if phone_matches:
+        score += 3.0
+        moderated_content = re.sub(PHONE_PATTERN, '[phone number removed]', moderated_content)
+
+    return moderated_content, score
+
+
+def load_texts(db_path):
+    conn = sqlite3.connect(db_path)
+    texts = [row[0] for row in conn.execute("SELECT content FROM posts")]
+    texts += [row[0] for row in conn.execute("SELECT content FROM comments")]
+    texts += [row[0] for row in conn.execute("SELECT profile FROM users WHERE profile IS NOT NULL")]
+    conn.close()
+    return [t for t in texts if t]
+
+
+def best_rate(func, texts, repeat):
+    """Best-of-`repeat` throughput of func over all texts, in texts per second."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for t in texts:
+            func(t)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best
+
+
+# =========================
+# Content classes
+# =========================
+
+CLEAN_WORDS = (
+    "the weekend was great we went hiking near the lake and had coffee afterwards "
+    "new recipe tonight pasta with garlic and lemon anyone tried the museum downtown "
+    "finally finished my book club reading list so happy with the garden this year "
+    "thanks everyone for the birthday wishes see you at the meetup next friday"
+).split()
+URL_HOSTS = ["example.com", "shop.example.net", "bit.ly", "deals.example.org", "t.co"]
+PHONE_FORMATS = ["{a}-{b}-{c}", "{a}.{b}.{c}", "{a} {b} {c}", "{a}{b}{c}", "({a}) {b}-{c}"]
+
+
+def _sentence(rng, low, high):
+    return " ".join(rng.choice(CLEAN_WORDS) for _ in range(rng.randint(low, high)))
+
+
+def _insert(rng, text, item):
+    words = text.split()
+    words.insert(rng.randint(0, len(words)), item)
+    return " ".join(words)
+
+
+def _phone(rng):
+    a, b, c = rng.randint(200, 999), rng.randint(100, 999), rng.randint(1000, 9999)
+    return rng.choice(PHONE_FORMATS).format(a=a, b=b, c=c)
+
+
+def content_classes(rules, n, db_path=None, seed=0):
+    """
+    {class name: list of texts}. Every synthetic class has n texts generated from a fixed seed,
+    so two runs with the same rules moderate exactly the same input.
+    """
+    rng = random.Random(seed)
+    tier1 = rules["tier1_words"] or ["-"]
+    tier2 = rules["tier2_phrases"] or ["-"]
+    classes = {
+        "clean": [_sentence(rng, 5, 40) for _ in range(n)],
+        "tier1": [_insert(rng, _sentence(rng, 5, 40), rng.choice(tier1)) for _ in range(n)],
+        "tier2": [_insert(rng, _sentence(rng, 5, 40), rng.choice(tier2)) for _ in range(n)],
+        "url_spam": [
+            " ".join([_sentence(rng, 2, 8)] + [f"https://{rng.choice(URL_HOSTS)}/{rng.randint(1, 10**6)}?ref=x"
+                                               for _ in range(rng.randint(3, 8))])
+            for _ in range(n)],
+        "caps_rant": [_sentence(rng, 200, 600).upper() + "!!!" for _ in range(n)],
+        "phone": [_insert(rng, _sentence(rng, 5, 30), "call " + _phone(rng)) for _ in range(n)],
+    }
+    if db_path and os.path.exists(db_path):
+        classes["database"] = load_texts(db_path)
+    return classes
+
+
+# =========================
+# Per-stage timing
+# =========================
+# ModerationEngine.moderate records the time of each rule stage as moderation.<stage> when
+# instrumentation is on (see instrumentation.laps), so the breakdown times the real method.
+
+STAGES = ("prefilter", "tier1", "tier2", "tier3", "url", "caps", "phone")
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def latency_stats(func, texts, repeat):
+    """Throughput (best of `repeat` untimed loops) and p50/p99 per-call latency in microseconds."""
+    rate = best_rate(func, texts, repeat)
+    clock = time.perf_counter_ns
+    latencies = []
+    for t in texts:
+        start = clock()
+        func(t)
+        latencies.append((clock() - start) / 1000)
+    latencies.sort()
+    return {
+        "texts_per_s": round(rate, 1),
+        "p50_us": round(percentile(latencies, 50), 2),
+        "p99_us": round(percentile(latencies, 99), 2),
+    }
+
+
+def stage_breakdown(engine, texts, repeat):
+    """Milliseconds spent in each stage over `repeat` passes of texts, and each stage's share."""
+    was_enabled = instrumentation.enabled()
+    instrumentation.reset()
+    instrumentation.enable()
+    try:
+        for _ in range(repeat):
+            for t in texts:
+                engine.moderate(t)
+        timings = {}
+        for stage in STAGES:
+            histogram = instrumentation.RECORDER.histograms.get(f"moderation.{stage}")
+            timings[stage] = histogram.sum if histogram else 0.0
+    finally:
+        instrumentation.reset()
+        if not was_enabled:
+            instrumentation.disable()
+    total = sum(timings.values()) or 1.0
+    return {stage: {"ms": round(timings[stage] * 1000 / repeat, 3), "share": round(timings[stage] / total, 4)}
+            for stage in STAGES}
+
+
+def run_suite(engine, classes, repeat):
+    rules = engine.rules()
+
+    def legacy(t):
+        return legacy_moderate_content(t, rules["tier1_words"], rules["tier2_phrases"], rules["tier3_words"])
+
+    results = {}
+    for name, texts in classes.items():
+        for t in texts:
+            expected = engine.moderate(t)
+            if legacy(t) != expected:
+                raise SystemExit(f"{name}: text moderated differently: {t!r}")
+        results[name] = {
+            "texts": len(texts),
+            "flagged": sum(1 for t in texts if engine.moderate(t)[1] > 0),
+            "moderate_content": latency_stats(legacy, texts, repeat),
+            "engine": latency_stats(engine.moderate, texts, repeat),
+            "stages": stage_breakdown(engine, texts, repeat),
+        }
+    return {
+        "created": dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "ruleset_version": engine.version,
+        "repeat": repeat,
+        "classes": results,
+    }
+
+
+def print_suite(suite):
+    print(f"{'class':<10} {'texts':>6} {'legacy/s':>10} {'engine/s':>10} {'p50 us':>8} {'p99 us':>8}  stages (share)")
+    for name, r in suite["classes"].items():
+        stages = " ".join(f"{s}={v['share']:.0%}" for s, v in r["stages"].items() if v["share"] >= 0.005)
+        print(f"{name:<10} {r['texts']:>6} {r['moderate_content']['texts_per_s']:>10,.0f} "
+              f"{r['engine']['texts_per_s']:>10,.0f} {r['engine']['p50_us']:>8.1f} {r['engine']['p99_us']:>8.1f}  {stages}")
+
+
+def compare_suites(baseline, current, tolerance):
+    """Classes whose engine throughput dropped by more than `tolerance` (a fraction) against baseline."""
+    regressions = []
+    for name, r in current["classes"].items():
+        before = baseline.get("classes", {}).get(name)
+        if not before:
+            continue
+        old, new = before["engine"]["texts_per_s"], r["engine"]["texts_per_s"]
+        change = new / old - 1 if old else 0.0
+        print(f"{name:<10} {old:>10,.0f} -> {new:>10,.0f} texts/s ({change:+.1%})")
+        if change < -tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark moderate_content against ModerationEngine")
+    parser.add_argument("--rules", help="JSON file with tier1_words, tier2_phrases, tier3_words")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--suite", action="store_true", help="run the per-class microbenchmark suite")
+    parser.add_argument("--texts", type=int, default=2000, help="texts per synthetic class (--suite)")
+    parser.add_argument("--json", help="write the suite results to this file")
+    parser.add_argument("--compare", help="suite JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed throughput drop per class before --compare fails (default 0.15)")
+    args = parser.parse_args()
+
+    if args.suite or args.json or args.compare:
+        engine = ModerationEngine.from_json(args.rules) if args.rules else ModerationEngine(**SAMPLE_RULES)
+        suite = run_suite(engine, content_classes(engine.rules(), args.texts, args.db), args.repeat)
+        print_suite(suite)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(suite, f, indent=2)
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                baseline = json.load(f)
+            if baseline.get("ruleset_version") != suite["ruleset_version"]:
+                print("warning: the baseline was run with a different rule set")
+            regressions = compare_suites(baseline, suite, args.tolerance)
+            if regressions:
+                raise SystemExit(f"throughput regression in: {', '.join(regressions)}")
+        return
+
+    engine = ModerationEngine.from_json(args.rules) if args.rules else ModerationEngine(**SAMPLE_RULES)
+    rules = engine.rules()
+    texts = load_texts(args.db)
+
+    def legacy(t):
+        return legacy_moderate_content(t, rules["tier1_words"], rules["tier2_phrases"], rules["tier3_words"])
+
+    mismatches = [t for t in texts if legacy(t) != engine.moderate(t)]
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} texts moderated differently, first: {mismatches[0]!r}")
+
+    legacy_rate = best_rate(legacy, texts, args.repeat)
+    engine_rate = best_rate(engine.moderate, texts, args.repeat)
+
+    print(f"Texts moderated:   {len(texts)} (identical results)")
+    print(f"moderate_content:  {legacy_rate:,.0f} texts/s")
+    print(f"ModerationEngine:  {engine_rate:,.0f} texts/s")
+    print(f"Speedup:           {engine_rate / legacy_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
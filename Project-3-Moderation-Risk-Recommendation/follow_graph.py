@@ -0,0 +1,139 @@
+# =========================
+# Follow Graph (CSR)
+# =========================
+# recommend(filter_following=True) filtered posts with
+# "p.user_id IN (SELECT followed_id FROM follows WHERE follower_id = ?)", and follows has no
+# index, so every call scanned the whole table. FollowGraph loads follows once into compressed
+# sparse row arrays: the followees of the follower in row i are neighbors[offsets[i]:offsets[i+1]],
+# sorted, without duplicates (the IN subquery has set semantics as well).
+#
+# refresh() keeps the graph in sync: follows rows above the last seen rowid are added to a small
+# per-follower delta that is merged into the arrays when it grows; a trigger records deletes
+# (unfollows) in follow_graph_deletes and any delete rebuilds the arrays from the table.
+import threading
+
+import numpy as np
+
+
+class FollowGraph:
+    """
+    users: sorted follower ids that have a row, offsets / neighbors: the CSR arrays.
+    followees(u) is O(degree), is_following(u, v) is a dict lookup plus a binary search in the
+    row of u. refresh() and the lookups hold a lock, so one graph can be shared by request
+    threads.
+    """
+
+    def __init__(self, compact_every=10_000, track_deletes=True):
+        self.compact_every = compact_every
+        self.track_deletes = track_deletes
+        self.users = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.neighbors = np.empty(0, dtype=np.int64)
+        self._row_of = {}
+        self._added = {}        # follower -> followees added since the last merge
+        self._added_count = 0
+        self.last_rowid = 0
+        self.last_delete = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, conn, track_deletes=True, compact_every=10_000):
+        """
+        Builds the graph from the follows table. With track_deletes the delete trigger is
+        created so refresh() notices unfollows (needs a writable connection); without it
+        refresh() only adds new rows.
+        """
+        graph = cls(compact_every, track_deletes)
+        if track_deletes:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS follow_graph_deletes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT
+                );
+                CREATE TRIGGER IF NOT EXISTS follow_graph_delete AFTER DELETE ON follows BEGIN
+                    INSERT INTO follow_graph_deletes (id) VALUES (NULL);
+                END;
+            """)
+            conn.commit()
+        graph._rebuild(conn)
+        return graph
+
+    def _rebuild(self, conn):
+        if self.track_deletes:
+            self.last_delete = conn.execute("SELECT COALESCE(MAX(id), 0) FROM follow_graph_deletes").fetchone()[0]
+        rows = conn.execute("SELECT rowid, follower_id, followed_id FROM follows").fetchall()
+        self.last_rowid = max((row[0] for row in rows), default=0)
+        pairs = np.array([(a, b) for _, a, b in rows], dtype=np.int64).reshape(-1, 2)
+        self._build(pairs)
+
+    def _build(self, pairs):
+        pairs = np.unique(pairs, axis=0)  # sorted by follower, then followee; duplicates dropped
+        self.users, starts = np.unique(pairs[:, 0], return_index=True)
+        self.offsets = np.append(starts, len(pairs)).astype(np.int64)
+        self.neighbors = pairs[:, 1].copy()
+        self._row_of = {int(u): i for i, u in enumerate(self.users)}
+        self._added = {}
+        self._added_count = 0
+
+    def _compact(self):
+        followers = np.repeat(self.users, np.diff(self.offsets))
+        added = [(a, b) for a, bs in self._added.items() for b in bs]
+        pairs = np.concatenate([np.column_stack([followers, self.neighbors]),
+                                np.array(added, dtype=np.int64).reshape(-1, 2)])
+        self._build(pairs)
+
+    def refresh(self, conn):
+        """
+        Applies the follows rows added since the last refresh (or rebuilds after a delete).
+        Returns the number of rows read.
+        """
+        with self._lock:
+            if self.track_deletes:
+                deleted = conn.execute("SELECT COALESCE(MAX(id), 0) FROM follow_graph_deletes").fetchone()[0]
+                if deleted != self.last_delete:
+                    self._rebuild(conn)
+                    return len(self.neighbors)
+            rows = conn.execute("SELECT rowid, follower_id, followed_id FROM follows WHERE rowid > ?",
+                                (self.last_rowid,)).fetchall()
+            for rowid, a, b in rows:
+                if not self.is_following(a, b):
+                    self._added.setdefault(a, set()).add(b)
+                    self._added_count += 1
+                self.last_rowid = max(self.last_rowid, rowid)
+            if self._added_count >= self.compact_every:
+                self._compact()
+            return len(rows)
+
+    def _row(self, u):
+        i = self._row_of.get(u)
+        if i is None:
+            return self.neighbors[:0]
+        return self.neighbors[self.offsets[i]:self.offsets[i + 1]]
+
+    def followees(self, u):
+        """Sorted array of the users u follows."""
+        with self._lock:
+            row = self._row(u)
+            added = self._added.get(u)
+            if added:
+                row = np.union1d(row, np.fromiter(added, dtype=np.int64))
+            return row
+
+    def followee_set(self, u):
+        """The users u follows as a set, for membership tests in Python loops."""
+        return set(self.followees(u).tolist())
+
+    def is_following(self, u, v):
+        with self._lock:
+            row = self._row(u)
+            j = np.searchsorted(row, v)
+            if j < len(row) and row[j] == v:
+                return True
+            return v in self._added.get(u, ())
+
+    def out_degree(self, u):
+        with self._lock:
+            return len(self._row(u)) + len(self._added.get(u, ()))
+
+    def __len__(self):
+        """Number of distinct (follower, followee) edges."""
+        return len(self.neighbors) + self._added_count
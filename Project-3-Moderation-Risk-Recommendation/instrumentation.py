@@ -0,0 +1,243 @@
+# =========================
+# Per-stage Latency Instrumentation
+# =========================
+# recommend() and the risk scoring run several stages (SQL reads, keyword counting, candidate
+# scan, moderation, aggregation) and a total time does not say which one dominates. A stage is
+# timed with
+#
+#     with stage("recommend.liked_posts") as s:
+#         liked = ...
+#         s.rows = len(liked)
+#
+# or with the @timed("name") decorator. Every stage gets a latency histogram (fixed buckets,
+# cumulative like Prometheus histograms) and a row counter in the process; to_json() and
+# to_prometheus() dump them.
+#
+# Recording is off by default (or set STAGE_TIMINGS=1). When it is off stage() returns one
+# shared no-op context manager, so an instrumented call costs a function call and an attribute
+# check per stage.
+#
+# Functions that run in microseconds (ModerationEngine.moderate) cannot afford that per stage.
+# They time consecutive stages with one clock instead:
+#
+#     lap = laps("moderation.")    # None when recording is off
+#     ...
+#     if lap:
+#         lap("prefilter")         # records the time since the previous lap (or laps())
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+# upper bounds of the latency buckets in seconds (+Inf is implicit)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Latency histogram of one stage: per-bucket counts, count, sum, max and rows."""
+
+    __slots__ = ("counts", "count", "sum", "max", "rows")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def observe(self, seconds, rows=None):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if rows is not None:
+            self.rows += rows
+
+    def quantile(self, q):
+        """Upper bound of the bucket that holds the q-quantile (max for the +Inf bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self, buckets=True):
+        result = {
+            "count": self.count,
+            "total_s": round(self.sum, 6),
+            "mean_ms": round(1000 * self.sum / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(1000 * self.quantile(0.5), 3),
+            "p99_ms": round(1000 * self.quantile(0.99), 3),
+            "max_ms": round(1000 * self.max, 3),
+            "rows": self.rows,
+        }
+        if buckets:
+            result["buckets"] = {str(bound): n for bound, n in zip(BUCKETS + ("+Inf",), self.counts)}
+        return result
+
+
+class _Stage:
+    __slots__ = ("recorder", "name", "rows", "start")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.observe(self.name, time.perf_counter() - self.start, self.rows)
+        return False
+
+
+class _Laps:
+    """Times consecutive stages: each call records the time since the previous call (or the start)."""
+
+    __slots__ = ("recorder", "prefix", "last")
+
+    def __init__(self, recorder, prefix):
+        self.recorder = recorder
+        self.prefix = prefix
+        self.last = time.perf_counter()
+
+    def __call__(self, name, rows=None):
+        self.recorder.observe(self.prefix + name, time.perf_counter() - self.last, rows)
+        # restart after observe(), so the lock is not counted in the next stage
+        self.last = time.perf_counter()
+
+
+class _NullStage:
+    """Returned by stage() when recording is off; `rows` can be set and is ignored."""
+
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Recorder:
+    """Histograms by stage name; safe to use from several threads."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.histograms = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def laps(self, prefix=""):
+        """A _Laps for stages named prefix + name, or None when recording is off."""
+        if not self.enabled:
+            return None
+        return _Laps(self, prefix)
+
+    def observe(self, name, seconds, rows=None):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds, rows)
+
+    def timed(self, name):
+        """Decorator: times every call of the function as stage `name`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Stage(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def snapshot(self, buckets=True):
+        with self._lock:
+            return {name: h.to_dict(buckets) for name, h in sorted(self.histograms.items())}
+
+    def to_json(self, indent=2, buckets=True):
+        return json.dumps(self.snapshot(buckets), indent=indent)
+
+    def to_prometheus(self, prefix="stage"):
+        """Prometheus text exposition: a <prefix>_duration_seconds histogram and a <prefix>_rows_total counter."""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            lines = [f"# HELP {prefix}_duration_seconds Duration of instrumented stages.",
+                     f"# TYPE {prefix}_duration_seconds histogram"]
+            for name, h in histograms:
+                cumulative = 0
+                for bound, n in zip(BUCKETS + ("+Inf",), h.counts):
+                    cumulative += n
+                    lines.append(f'{prefix}_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_duration_seconds_sum{{stage="{name}"}} {h.sum:.9f}')
+                lines.append(f'{prefix}_duration_seconds_count{{stage="{name}"}} {h.count}')
+            lines += [f"# HELP {prefix}_rows_total Rows read or processed by instrumented stages.",
+                      f"# TYPE {prefix}_rows_total counter"]
+            for name, h in histograms:
+                lines.append(f'{prefix}_rows_total{{stage="{name}"}} {h.rows}')
+        return "\n".join(lines) + "\n"
+
+
+# the process-wide recorder the instrumented modules use
+RECORDER = Recorder(enabled=os.environ.get("STAGE_TIMINGS", "") not in ("", "0"))
+
+
+def stage(name):
+    return RECORDER.stage(name)
+
+
+def laps(prefix=""):
+    return RECORDER.laps(prefix)
+
+
+def timed(name):
+    return RECORDER.timed(name)
+
+
+def enable():
+    RECORDER.enabled = True
+
+
+def disable():
+    RECORDER.enabled = False
+
+
+def enabled():
+    return RECORDER.enabled
+
+
+def reset():
+    RECORDER.reset()
+
+
+def to_json(indent=2, buckets=True):
+    return RECORDER.to_json(indent, buckets)
+
+
+def to_prometheus(prefix="stage"):
+    return RECORDER.to_prometheus(prefix)
@@ -0,0 +1,88 @@
+# =========================
+# Load Test – recommendation service
+# =========================
+# Sends GET /recommend/<user_id> requests from a thread pool to a running recommend_service.py
+# and prints requests/second, latency percentiles and the status codes. User ids are read from
+# database.sqlite (--db) and requested in random order; --following sets the share of requests
+# with ?following=1.
+#
+# Usage:
+#   python recommend_service.py --db database.sqlite &
+#   python load_test.py --url http://127.0.0.1:5000 [--requests 2000] [--concurrency 32]
+import argparse
+import collections
+import json
+import random
+import sqlite3
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark_moderation import percentile
+
+
+def fetch(url, timeout):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as exc:
+        status = exc.code
+    except (urllib.error.URLError, OSError):
+        status = "error"
+    return status, time.perf_counter() - start
+
+
+def run(base_url, user_ids, requests, concurrency, following=0.5, timeout=10.0, seed=0):
+    rng = random.Random(seed)
+    urls = []
+    for _ in range(requests):
+        url = f"{base_url.rstrip('/')}/recommend/{rng.choice(user_ids)}"
+        if rng.random() < following:
+            url += "?following=1"
+        urls.append(url)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda u: fetch(u, timeout), urls))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(seconds * 1000 for status, seconds in results if status == 200)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "requests_per_s": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "status": {str(k): v for k, v in collections.Counter(status for status, _ in results).items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for recommend_service.py")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--db", default="database.sqlite", help="database the user ids are read from")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--following", type=float, default=0.5, help="share of requests with ?following=1")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+    conn.close()
+
+    result = run(args.url, user_ids, args.requests, args.concurrency, args.following)
+    print(f"{result['requests']} requests, concurrency {result['concurrency']}: "
+          f"{result['requests_per_s']:,.0f} req/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+          f"status {result['status']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
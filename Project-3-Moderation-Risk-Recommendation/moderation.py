@@ -0,0 +1,475 @@
+# =========================
+# Moderation Engine (Exercise 3.1, precompiled)
+# =========================
+# moderate_content used to rebuild the Tier 1 / Tier 3 regexes on every call and lowercase the
+# text once per Tier 2 phrase. The ModerationEngine compiles the whole rule set once, so one
+# engine can moderate every post, comment and profile of a run.
+import collections
+import hashlib
+import itertools
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import laps
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional, PhraseMatcher falls back to plain substring checks
+    ahocorasick = None
+
+
+SEVERE_MESSAGE = "[content removed due to severe violation]"
+SPAM_MESSAGE = "[content removed due to spam/scam policy]"
+LINK_MESSAGE = "[link removed]"
+PHONE_MESSAGE = "[phone number removed]"
+
+URL_PATTERN = r'https?://[^\s]+'
+PHONE_PATTERN = r'\b\d{3}[-.\s]?\d{3}[-.\s]?\d{4}\b|\b\d{10}\b'
+
+# bump when the rule logic below changes, so cached scores of the old logic are not reused
+MODERATION_LOGIC_VERSION = 1
+
+ASCII_UPPER = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+ASCII_LETTERS = ASCII_UPPER + ASCII_UPPER.lower()
+ASCII_DIGITS = b"0123456789"
+
+# the only non-ASCII characters re.IGNORECASE matches to ASCII letters
+ASCII_CASE_FOLDS = re.compile("[\u0130\u0131\u017f\u212a]")  # İ ı ſ K(Kelvin)
+
+
+def _stars(match):
+    return '*' * len(match.group(0))
+
+
+def _is_plain_word(word):
+    """True for ASCII words/phrases that contain no regex syntax (letters, digits, spaces, ' - _)."""
+    return bool(word) and word.isascii() and all(c.isalnum() or c in " '-_" for c in word)
+
+
+class PhraseMatcher:
+    """
+    Multi-pattern substring matcher. It takes groups of phrases ({"tier2": [...], ...}) and
+    finds every group that occurs in a text in a single pass: an Aho-Corasick automaton when
+    pyahocorasick is installed, otherwise one `in` check per phrase on the same string.
+    """
+
+    def __init__(self, groups):
+        self.groups = {name: [p.lower() for p in phrases] for name, phrases in groups.items()}
+        # '' is a substring of every text
+        self._always = {name for name, phrases in self.groups.items() if '' in phrases}
+        self._phrases = [(p, name) for name, phrases in self.groups.items() for p in phrases if p]
+        self._automaton = None
+        if ahocorasick is not None and self._phrases:
+            self._automaton = ahocorasick.Automaton()
+            for phrase, name in self._phrases:
+                # a phrase listed in two groups keeps both names
+                names = self._automaton.get(phrase, ()) + (name,)
+                self._automaton.add_word(phrase, names)
+            self._automaton.make_automaton()
+
+    def find(self, lowered_text):
+        """Returns the set of group names with at least one phrase in the (lowercased) text."""
+        found = set(self._always)
+        if self._automaton is not None:
+            for _, names in self._automaton.iter(lowered_text):
+                found.update(names)
+        else:
+            for phrase, name in self._phrases:
+                if name not in found and phrase in lowered_text:
+                    found.add(name)
+        return found
+
+
+class ModerationEngine:
+    """
+    Compiled version of the moderation rules. moderate() returns exactly what the original
+    moderate_content returned: a tuple (moderated_content, score).
+
+    All three tiers are looked up in one pass of a PhraseMatcher over the lowercased text.
+    Tier 2 is decided by that pass directly. The Tier 1 / Tier 3 regexes (which also check word
+    boundaries) only run when the pass found one of their words, or when the text has one of the
+    few characters where re.IGNORECASE and str.lower() disagree (ASCII_CASE_FOLDS).
+    The scored rules still run one after the other because each one reads the output of the
+    previous one (a Tier 3 word inside a URL is starred first and then the URL is removed).
+    """
+
+    def __init__(self, tier1_words, tier2_phrases, tier3_words):
+        self.tier1_words = list(tier1_words)
+        self.tier2_phrases = list(tier2_phrases)
+        self.tier3_words = list(tier3_words)
+
+        self._tier1 = re.compile(r'\b(' + '|'.join(self.tier1_words) + r')\b', re.IGNORECASE)
+        self._tier3 = re.compile(r'\b(' + '|'.join(self.tier3_words) + r')\b', re.IGNORECASE)
+        self._url = re.compile(URL_PATTERN)
+        self._phone = re.compile(PHONE_PATTERN)
+
+        # Tier 1 / Tier 3 can only be pre-filtered when every entry is a plain word, otherwise
+        # the regex may match text that is not a literal occurrence of the entry
+        groups = {"tier2": self.tier2_phrases}
+        self._prefilter = {}
+        for name, words in (("tier1", self.tier1_words), ("tier3", self.tier3_words)):
+            self._prefilter[name] = all(_is_plain_word(w) for w in words) and bool(words)
+            if self._prefilter[name]:
+                groups[name] = words
+        self._matcher = PhraseMatcher(groups)
+
+        # identifies this rule set (and rule logic) in the moderation_scores cache table
+        fingerprint = json.dumps([MODERATION_LOGIC_VERSION, self.rules()], sort_keys=True)
+        self.version = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def from_json(cls, path):
+        """
+        Builds an engine from a JSON file with the keys "tier1_words", "tier2_phrases" and
+        "tier3_words" (the three lists of the rules document).
+        """
+        with open(path, encoding="utf-8") as f:
+            rules = json.load(f)
+        return cls(rules["tier1_words"], rules["tier2_phrases"], rules["tier3_words"])
+
+    def rules(self):
+        """The rule lists, in the form from_json() reads and worker processes rebuild from."""
+        return {
+            "tier1_words": self.tier1_words,
+            "tier2_phrases": self.tier2_phrases,
+            "tier3_words": self.tier3_words,
+        }
+
+    def moderate(self, content):
+        """
+        Args
+            content: the text content of a post or comment to be moderated.
+
+        Returns:
+            A tuple containing the moderated content (string) and a severity score (float).
+        """
+        # per-stage timings (moderation.<stage>) when instrumentation is on, see instrumentation.py
+        lap = laps("moderation.")
+        found = self._matcher.find(content.lower())
+        foldable = not content.isascii() and ASCII_CASE_FOLDS.search(content) is not None
+        if lap:
+            lap("prefilter")
+
+        # Stage 1.1: severe violations remove the whole content
+        severe = self._may_match("tier1", found, foldable) and self._tier1.search(content)
+        if lap:
+            lap("tier1")
+        if severe:
+            return SEVERE_MESSAGE, 5.0
+        spam = "tier2" in found
+        if lap:
+            lap("tier2")
+        if spam:
+            return SPAM_MESSAGE, 5.0
+
+        # Stage 1.2: scored violations
+        score = 0.0
+        moderated_content = content
+
+        # Rule 1.2.1: Tier 3 words
+        if self._may_match("tier3", found, foldable):
+            moderated_content, n = self._tier3.subn(_stars, moderated_content)
+            score += n * 2.0
+        if lap:
+            lap("tier3")
+
+        # Rule 1.2.2: URLs (the pattern needs "http" so most texts skip the regex)
+        if 'http' in moderated_content:
+            moderated_content, n = self._url.subn(LINK_MESSAGE, moderated_content)
+            score += n * 2.0
+        if lap:
+            lap("url")
+
+        # Rule 1.2.3 (excessive capitalization) and the phone number rule. For ASCII text the
+        # letters/digits are counted on the bytes in C instead of character by character.
+        if moderated_content.isascii():
+            raw = moderated_content.encode("ascii")
+            letters = len(raw) - len(raw.translate(None, ASCII_LETTERS))
+            if letters > 15:
+                uppercase = len(raw) - len(raw.translate(None, ASCII_UPPER))
+                if uppercase / letters > 0.70:
+                    score += 0.5
+            # every phone number pattern needs 10 digits
+            maybe_phone = len(raw) - len(raw.translate(None, ASCII_DIGITS)) >= 10
+        else:
+            score += self._caps_score(moderated_content)
+            maybe_phone = True
+        if lap:
+            lap("caps")
+
+        if maybe_phone:
+            moderated_content, n = self._phone.subn(PHONE_MESSAGE, moderated_content)
+            if n:
+                score += 3.0
+        if lap:
+            lap("phone")
+
+        return moderated_content, score
+
+    __call__ = moderate
+
+    def moderate_many(self, texts, workers=None, chunk_size=1000):
+        """Batch version of moderate(), see moderate_many() below."""
+        return moderate_many(texts, self, workers=workers, chunk_size=chunk_size)
+
+    def _may_match(self, tier, found, foldable):
+        return not self._prefilter[tier] or foldable or tier in found
+
+    @staticmethod
+    def _caps_score(text):
+        # more than 70% of at least 16 letters means at least 12 uppercase characters,
+        # so the per-letter count only runs for texts that can actually qualify
+        if sum(map(str.isupper, text)) < 12:
+            return 0.0
+        alphabetic_chars = [c for c in text if c.isalpha()]
+        if len(alphabetic_chars) > 15:
+            uppercase_count = sum(1 for c in alphabetic_chars if c.isupper())
+            if uppercase_count / len(alphabetic_chars) > 0.70:
+                return 0.5
+        return 0.0
+
+
+# =========================
+# Batch moderation
+# =========================
+# Rescoring a whole posts/comments backlog one string at a time uses one core. moderate_many
+# splits the texts into chunks and moderates them in a process pool; every worker builds its
+# own ModerationEngine once from the rule lists.
+
+_worker_engine = None
+
+
+def _init_worker(rules):
+    global _worker_engine
+    _worker_engine = ModerationEngine(**rules)
+
+
+def _is_missing(text):
+    # None, NaN, and pd.NA / NaT from nullable ("string") columns
+    return text is None or (pd.api.types.is_scalar(text) and bool(pd.isna(text)))
+
+
+def _moderate_chunk(engine, chunk):
+    moderated, scores = [], []
+    for text in chunk:
+        # missing values (None / NaN / pd.NA in a Series) are passed through with score 0.0
+        if _is_missing(text):
+            moderated.append(text)
+            scores.append(0.0)
+        else:
+            m, s = engine.moderate(text)
+            moderated.append(m)
+            scores.append(s)
+    return moderated, scores
+
+
+def _moderate_chunk_in_worker(chunk):
+    return _moderate_chunk(_worker_engine, chunk)
+
+
+def _chunks(texts, chunk_size):
+    iterator = iter(texts)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def moderate_many(texts, engine, workers=None, chunk_size=1000):
+    """
+    Args
+        texts: a list, a generator or a pandas Series of post/comment texts.
+        engine: the ModerationEngine with the rules to apply.
+        workers: number of worker processes (default: all cores). 1 moderates in this process.
+        chunk_size: number of texts sent to a worker at a time.
+
+    Returns:
+        A tuple (moderated_content, scores) of NumPy arrays in the same order as the input:
+        an object array of moderated strings and a float64 array of severity scores.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if hasattr(texts, "tolist"):  # pandas Series / NumPy array
+        texts = texts.tolist()
+    if isinstance(texts, list):
+        # no point starting more processes than there are chunks
+        workers = min(workers, max(1, -(-len(texts) // chunk_size)))
+
+    moderated, scores = [], []
+    if workers <= 1:
+        for chunk in _chunks(texts, chunk_size):
+            m, s = _moderate_chunk(engine, chunk)
+            moderated.extend(m)
+            scores.extend(s)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(engine.rules(),)) as pool:
+            # map() returns the chunks in input order
+            for m, s in pool.map(_moderate_chunk_in_worker, _chunks(texts, chunk_size)):
+                moderated.extend(m)
+                scores.extend(s)
+
+    moderated_array = np.empty(len(moderated), dtype=object)
+    moderated_array[:] = moderated
+    return moderated_array, np.asarray(scores, dtype=np.float64)
+
+
+# =========================
+# Moderation score cache
+# =========================
+# The risk analysis moderates every post, comment and profile on every run, and spam texts are
+# heavily duplicated (one user posts the same text 22 times). ModerationCache keeps the results
+# in a moderation_scores side table keyed by (content hash, ruleset version), with an
+# in-process LRU in front of it, so a repeated text costs one lookup instead of the rules.
+
+def content_hash(content):
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ModerationCache:
+    """
+    Args
+        conn: sqlite3 connection of database.sqlite, the moderation_scores table is created there.
+        engine: the ModerationEngine that computes scores for texts not in the cache.
+        maxsize: number of texts kept in the in-process LRU.
+        flush_every: new scores are written to the table in batches of this size.
+    """
+
+    def __init__(self, conn, engine, maxsize=100_000, flush_every=1000):
+        self.conn = conn
+        self.engine = engine
+        self.maxsize = maxsize
+        self.flush_every = flush_every
+        self.hits = 0        # answered by the LRU
+        self.db_hits = 0     # answered by the moderation_scores table
+        self.misses = 0      # moderated by the engine
+        self._lru = collections.OrderedDict()
+        self._pending = []
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS moderation_scores (
+                content_hash      TEXT NOT NULL,
+                ruleset_version   TEXT NOT NULL,
+                moderated_content TEXT NOT NULL,
+                score             REAL NOT NULL,
+                PRIMARY KEY (content_hash, ruleset_version)
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+
+    def moderate(self, content):
+        """Same result as ModerationEngine.moderate(content), served from the cache when possible."""
+        result = self._lru.get(content)
+        if result is not None:
+            self._lru.move_to_end(content)
+            self.hits += 1
+            return result
+
+        key = content_hash(content)
+        row = self.conn.execute(
+            "SELECT moderated_content, score FROM moderation_scores WHERE content_hash=? AND ruleset_version=?",
+            (key, self.engine.version)).fetchone()
+        if row is not None:
+            self.db_hits += 1
+            result = (row[0], row[1])
+        else:
+            self.misses += 1
+            result = self.engine.moderate(content)
+            self._pending.append((key, self.engine.version, result[0], result[1]))
+            if len(self._pending) >= self.flush_every:
+                self.flush()
+        self._remember(content, result)
+        return result
+
+    __call__ = moderate
+
+    def moderate_many(self, texts, workers=None, chunk_size=1000):
+        """
+        Batch version of moderate(): one table lookup per chunk of unseen texts, and only the
+        texts missing from both cache levels go through moderate_many() in the process pool.
+        Returns the same NumPy arrays as moderate_many().
+        """
+        if hasattr(texts, "tolist"):
+            texts = texts.tolist()
+        texts = list(texts)
+        results = {}
+        unseen = []
+        for text in texts:
+            if _is_missing(text) or text in results:
+                continue
+            cached = self._lru.get(text)
+            if cached is not None:
+                self.hits += 1
+                results[text] = cached
+            else:
+                results[text] = None
+                unseen.append(text)
+
+        # look the unseen texts up in the side table (999 is SQLite's default variable limit)
+        keys = {text: content_hash(text) for text in unseen}
+        by_key = {}
+        for chunk in _chunks(unseen, 998):
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT content_hash, moderated_content, score FROM moderation_scores "
+                f"WHERE ruleset_version=? AND content_hash IN ({placeholders})",
+                [self.engine.version] + [keys[t] for t in chunk])
+            for key, moderated, score in rows:
+                by_key[key] = (moderated, score)
+
+        to_moderate = []
+        for text in unseen:
+            if keys[text] in by_key:
+                self.db_hits += 1
+                results[text] = by_key[keys[text]]
+            else:
+                to_moderate.append(text)
+
+        if to_moderate:
+            self.misses += len(to_moderate)
+            moderated, scores = moderate_many(to_moderate, self.engine, workers=workers, chunk_size=chunk_size)
+            for text, m, s in zip(to_moderate, moderated, scores):
+                results[text] = (m, float(s))
+                self._pending.append((keys[text], self.engine.version, m, float(s)))
+            self.flush()
+
+        for text in unseen:
+            self._remember(text, results[text])
+
+        moderated_array = np.empty(len(texts), dtype=object)
+        scores = np.zeros(len(texts), dtype=np.float64)
+        for i, text in enumerate(texts):
+            if _is_missing(text):
+                moderated_array[i] = text
+            else:
+                moderated_array[i], scores[i] = results[text]
+        return moderated_array, scores
+
+    def flush(self):
+        """Writes the scores computed since the last flush to the moderation_scores table."""
+        if not self._pending:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO moderation_scores VALUES (?, ?, ?, ?)", self._pending)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _remember(self, content, result):
+        self._lru[content] = result
+        if len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
@@ -0,0 +1,171 @@
+# =========================
+# Ingest-time Moderation Worker
+# =========================
+# Moderation used to run only inside the offline analysis scripts, so a new post was scored at
+# the next full scan. ModerationWorker is a long-running process that tails posts and comments:
+# it reads the rows above a stored id watermark in batches, moderates them and writes the
+# moderated text and score to content_moderation. Every batch (side-table rows and the new
+# watermark) is one transaction, so a restart continues exactly where the last batch ended.
+#
+# Usage:
+#   python moderation_worker.py --rules rules.json [--db database.sqlite] [--batch-size 500]
+#                               [--latency-target 2.0]
+import argparse
+import datetime as dt
+import sqlite3
+import time
+
+from moderation import ModerationEngine
+
+
+SOURCE_TABLES = ("posts", "comments")
+
+
+class ModerationWorker:
+    """
+    Args
+        conn: sqlite3 connection to database.sqlite, content_moderation and
+            moderation_watermarks are created there.
+        moderator: a ModerationEngine or ModerationCache (anything with moderate_many).
+        batch_size: maximum number of rows read from one table per batch. Only one batch is
+            held in memory, so this bounds the memory use of the worker.
+        latency_target: seconds within which a new row should be scored. The worker polls at
+            least this often when it is idle, and halves its batch size while a batch takes
+            longer than the target (it grows back to batch_size when batches are fast again).
+
+    processed / batches / busy_seconds count the work done since the worker started;
+    throughput() is rows per second of moderation and write time.
+    """
+
+    def __init__(self, conn, moderator, batch_size=500, latency_target=2.0):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.conn = conn
+        self.moderator = moderator
+        self.batch_size = batch_size
+        self.latency_target = latency_target
+        # a ModerationCache answers for its engine
+        self.ruleset_version = getattr(moderator, "engine", moderator).version
+        self._limit = batch_size
+        self.caught_up = False
+        self.processed = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self._stop = False
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS moderation_watermarks (
+                table_name TEXT PRIMARY KEY,
+                last_id    INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS content_moderation (
+                source            TEXT    NOT NULL,  -- 'posts' or 'comments'
+                source_id         INTEGER NOT NULL,
+                user_id           INTEGER NOT NULL,
+                moderated_content TEXT,
+                score             REAL    NOT NULL,
+                ruleset_version   TEXT,
+                moderated_at      TEXT    NOT NULL,
+                PRIMARY KEY (source, source_id)
+            ) WITHOUT ROWID;
+        """)
+        conn.commit()
+
+    def watermark(self, table):
+        row = self.conn.execute("SELECT last_id FROM moderation_watermarks WHERE table_name=?", (table,)).fetchone()
+        return row[0] if row else 0
+
+    def _fetch(self, table):
+        return self.conn.execute(
+            f"SELECT id, user_id, content FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+            (self.watermark(table), self._limit)).fetchall()
+
+    def run_once(self, workers=1):
+        """
+        Moderates one batch of every source table and returns the number of rows written.
+        caught_up is True afterwards when no table had a full batch left.
+        """
+        start = time.perf_counter()
+        written = 0
+        self.caught_up = True
+        for table in SOURCE_TABLES:
+            rows = self._fetch(table)
+            if len(rows) == self._limit:
+                self.caught_up = False
+            if not rows:
+                continue
+            texts = [content if content else None for _, _, content in rows]
+            moderated, scores = self.moderator.moderate_many(texts, workers=workers)
+            now = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            records = [(table, row_id, user_id, m, float(s), self.ruleset_version, now)
+                       for (row_id, user_id, _), m, s in zip(rows, moderated, scores)]
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO content_moderation VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO moderation_watermarks VALUES (?, ?)", (table, rows[-1][0]))
+            written += len(rows)
+        if written and hasattr(self.moderator, "flush"):
+            self.moderator.flush()  # new ModerationCache scores
+
+        elapsed = time.perf_counter() - start
+        if written:
+            self.processed += written
+            self.batches += 1
+            self.busy_seconds += elapsed
+        # keep one batch within the latency target
+        if elapsed > self.latency_target and self._limit > 1:
+            self._limit = max(1, self._limit // 2)
+        elif elapsed < self.latency_target / 2 and self._limit < self.batch_size:
+            self._limit = min(self.batch_size, self._limit * 2)
+        return written
+
+    def throughput(self):
+        return self.processed / self.busy_seconds if self.busy_seconds else 0.0
+
+    def stop(self):
+        self._stop = True
+
+    def run(self, workers=1, until_idle=False, report_every=30.0):
+        """
+        Polls until stop() is called (or KeyboardInterrupt). Batches follow each other without
+        a pause while there is a backlog; once caught up the worker sleeps for latency_target.
+        With until_idle=True it returns as soon as the backlog is empty.
+        """
+        self._stop = False
+        last_report = time.monotonic()
+        try:
+            while not self._stop:
+                self.run_once(workers)
+                if time.monotonic() - last_report >= report_every:
+                    print(f"{self.processed} rows moderated, {self.throughput():,.0f} rows/s, "
+                          f"batch size {self._limit}", flush=True)
+                    last_report = time.monotonic()
+                if self.caught_up:
+                    if until_idle:
+                        break
+                    time.sleep(self.latency_target)
+        except KeyboardInterrupt:
+            pass
+        return self.processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Moderate new posts and comments as they are inserted")
+    parser.add_argument("--rules", required=True, help="JSON file with tier1_words, tier2_phrases, tier3_words")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--batch-size", type=int, default=500, help="maximum rows per table and batch")
+    parser.add_argument("--latency-target", type=float, default=2.0, help="seconds until a new row is scored")
+    parser.add_argument("--workers", type=int, default=1, help="moderation processes per batch")
+    parser.add_argument("--until-idle", action="store_true", help="stop once the backlog is moderated")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    worker = ModerationWorker(conn, ModerationEngine.from_json(args.rules),
+                              batch_size=args.batch_size, latency_target=args.latency_target)
+    processed = worker.run(workers=args.workers, until_idle=args.until_idle)
+    print(f"{processed} rows moderated in {worker.batches} batches ({worker.throughput():,.0f} rows/s)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,49 @@
 # =========================
 # Exercise 3.1 – Censorship
 # =========================
+from moderation import ModerationEngine, ModerationCache
+
+# The rules are compiled once into a ModerationEngine (see moderation.py) the first time
+# moderate_content is called, instead of rebuilding every regex on each post and comment.
+_moderation_engine = None
+_moderation_cache = None
+
+def get_moderation_engine():
+    global _moderation_engine
+    if _moderation_engine is None:
+        _moderation_engine = ModerationEngine(TIER1_WORDS, TIER2_PHRASES, TIER3_WORDS)
+    return _moderation_engine
+
+def use_moderation_cache(conn):
+    """Makes moderate_content look scores up in the moderation_scores table of conn's database first."""
+    global _moderation_cache
+    _moderation_cache = ModerationCache(conn, get_moderation_engine())
+    return _moderation_cache
+
+def get_moderator():
+    return _moderation_cache if _moderation_cache is not None else get_moderation_engine()
+
 def moderate_content(content):
     """
     Args
         content: the text content of a post or comment to be moderated.
-        
-    Returns: 
+
+    Returns:
         A tuple containing the moderated content (string) and a severity score (float).
     """
-    original_content = content
-    score = 0.0
-    
-    # Stage 1.1.1: I Check for Tier 1 words (severe violation)
-    TIER1_PATTERN = r'\b(' + '|'.join(TIER1_WORDS) + r')\b'
-    if re.search(TIER1_PATTERN, original_content, flags=re.IGNORECASE):
-        return "[content removed due to severe violation]", 5.0
-    
-    # Stage 1.1.2:I Check for Tier 2 phrases (spam/scam)
-    for phrase in TIER2_PHRASES:
-        if phrase.lower() in original_content.lower():
-            return "[content removed due to spam/scam policy]", 5.0
-    
-    # Stage 1.2: Scored violations
-    moderated_content = original_content
-    
-    # use Rule 1.2.1: Tier 3 words (mild profanity)
-    TIER3_PATTERN = r'\b(' + '|'.join(TIER3_WORDS) + r')\b'
-    matches = re.findall(TIER3_PATTERN, moderated_content, flags=re.IGNORECASE)
-    score += len(matches) * 2.0
-    moderated_content = re.sub(TIER3_PATTERN, lambda m: '*' * len(m.group(0)), moderated_content, flags=re.IGNORECASE)
-    
-    # using rule 1.2.2: External links (URLs)
-    URL_PATTERN = r'https?://[^\s]+'
-    url_matches = re.findall(URL_PATTERN, moderated_content)
-    score += len(url_matches) * 2.0
-    moderated_content = re.sub(URL_PATTERN, '[link removed]', moderated_content)
-    
-    # using  rule 1.2.3: Excessive capitalization
-    alphabetic_chars = [c for c in moderated_content if c.isalpha()]
-    if len(alphabetic_chars) > 15:
-        uppercase_count = sum(1 for c in alphabetic_chars if c.isupper())
-        uppercase_ratio = uppercase_count / len(alphabetic_chars)
-        if uppercase_ratio > 0.70:
-            score += 0.5
-    
-    # Additional Safety Rule: Phone number detection (Privacy Protection)
-    PHONE_PATTERN = r'\b\d{3}[-.\s]?\d{3}[-.\s]?\d{4}\b|\b\d{10}\b'
-    phone_matches = re.findall(PHONE_PATTERN, moderated_content)
-    if phone_matches:
-        score += 3.0
-        moderated_content = re.sub(PHONE_PATTERN, '[phone number removed]', moderated_content)
-    
-    return moderated_content, score
+    return get_moderator().moderate(content)
+
+def moderate_many(texts, workers=None, chunk_size=1000):
+    """
+    Args
+        texts: a list, generator or pandas Series of posts/comments to be moderated.
+        workers: number of worker processes (default: all cores).
+        chunk_size: number of texts each worker gets at a time.
+
+    Returns:
+        A tuple of NumPy arrays (moderated contents, severity scores) in input order.
+    """
+    return get_moderator().moderate_many(texts, workers=workers, chunk_size=chunk_size)
 
 
 #My Full Explanation is this:
@@ -70,26 +61,27 @@ def moderate_content(content):
 # =========================
 # Exercise 3.2 – User Risk Analysis
 # =========================
+import os
+import sys
 import sqlite3
 import re
 import datetime as dt
 import pandas as pd
+import risk
+from instrumentation import stage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # snapshot.py is in the repository root
+from snapshot import from_environment
 
 
 
 # 2) User risk analysis (Rules Part 2) + extra risk measure
 
 def _parse_dt(s):
-    if not s:
-        return None
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
-        try:
-            return dt.datetime.strptime(s, fmt)
-        except Exception:
-            pass
-    return None
-
-def user_risk_analysis(user_row, cursor, lookback_days=14):
+    # "%Y-%m-%d %H:%M:%S", then "%Y-%m-%d", else None (fromisoformat for the usual zero-padded forms)
+    return risk.parse_timestamp(s)
+
+def user_risk_analysis(user_row, cursor, lookback_days=14, now=None):
     """
     Computes the user risk score per Rules Part 2 and adds one extra measure:
       - content_risk_score = 1*profile + 3*avg_post + 1*avg_comment
@@ -98,48 +90,61 @@ def user_risk_analysis(user_row, cursor, lookback_days=14):
     Extra measure: Recent Violation Boost
       - Count posts/comments in the last 14 days with content_score > 0
       - Add +0.2 per item (cap +1.0) BEFORE applying the age multiplier
+    `now` is the "current" time for the window and the account age (default: risk.analysis_now());
+    pass the same value for every user of one run.
     """
     user_id, username, location, birthdate, created_at, profile, password = user_row
 
     # Profile score
     profile_score = 0.0
     if profile:
-        _, profile_score = moderate_content(profile)
+        with stage("risk.moderate_profile"):
+            _, profile_score = moderate_content(profile)
 
     # All posts & comments
-    posts    = cursor.execute("SELECT content, created_at FROM posts WHERE user_id=?", (user_id,)).fetchall()
-    comments = cursor.execute("SELECT content, created_at FROM comments WHERE user_id=?", (user_id,)).fetchall()
+    with stage("risk.sql") as st:
+        posts    = cursor.execute("SELECT content, created_at FROM posts WHERE user_id=?", (user_id,)).fetchall()
+        comments = cursor.execute("SELECT content, created_at FROM comments WHERE user_id=?", (user_id,)).fetchall()
+        st.rows = len(posts) + len(comments)
 
     # Averages
     post_scores = []
-    for (c, _) in posts:
-        if c:
-            _, s = moderate_content(c)
-            post_scores.append(s)
+    with stage("risk.moderate_posts") as st:
+        for (c, _) in posts:
+            if c:
+                _, s = moderate_content(c)
+                post_scores.append(s)
+        st.rows = len(post_scores)
     avg_post = sum(post_scores)/len(post_scores) if post_scores else 0.0
 
     comment_scores = []
-    for (c, _) in comments:
-        if c:
-            _, s = moderate_content(c)
-            comment_scores.append(s)
+    with stage("risk.moderate_comments") as st:
+        for (c, _) in comments:
+            if c:
+                _, s = moderate_content(c)
+                comment_scores.append(s)
+        st.rows = len(comment_scores)
     avg_comment = sum(comment_scores)/len(comment_scores) if comment_scores else 0.0
 
     content_risk = (profile_score * 1.0) + (avg_post * 3.0) + (avg_comment * 1.0)
 
     # Extra: Recent Violation Boost
-    now = dt.datetime.utcnow()
+    # (now - created).days <= lookback_days  <=>  created > now - (lookback_days + 1) days
+    if now is None:
+        now = risk.analysis_now()
+    recent_after = now - dt.timedelta(days=lookback_days + 1)
     flagged_recent = 0
-    for (c, ts) in posts + comments:
-        if not c or not ts:
-            continue
-        created = _parse_dt(ts)
-        if not created:
-            continue
-        if (now - created).days <= lookback_days:
-            _, s = moderate_content(c)
-            if s > 0:
-                flagged_recent += 1
+    with stage("risk.recent_boost"):
+        for (c, ts) in posts + comments:
+            if not c or not ts:
+                continue
+            created = _parse_dt(ts)
+            if not created:
+                continue
+            if created > recent_after:
+                _, s = moderate_content(c)
+                if s > 0:
+                    flagged_recent += 1
     recent_boost = min(1.0, 0.2 * flagged_recent)
     content_risk += recent_boost
 
@@ -168,18 +173,42 @@ def user_risk_analysis(user_row, cursor, lookback_days=14):
     }
 
 
+def score_all_users(conn, lookback_days=14, now=None, snapshot=None, workers=None):
+    """
+    Bulk mode of user_risk_analysis for every user at once (see risk.py): posts and comments
+    are read once, every distinct text is moderated once (in `workers` processes, default all
+    cores) and the averages, the recent boost and the age multiplier are computed with grouped
+    aggregation.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return risk.score_all_users(conn, get_moderator(), now=now, lookback_days=lookback_days, workers=workers,
+                                snapshot=snapshot)
+
+
 # I print Top-5
 
 # I Connect to my uploaded file
 conn = sqlite3.connect("database.sqlite")
 cur = conn.cursor()
 
-# Pull all users
-users = cur.execute("SELECT id, username, location, birthdate, created_at, profile, password FROM users").fetchall()
-
-# I Compute risk for each user
-results = [user_risk_analysis(u, cur) for u in users]
-df = pd.DataFrame(results).sort_values(["final_user_risk", "content_risk_score"], ascending=[False, False]).reset_index(drop=True)
+# Moderation scores are cached in the moderation_scores table, so a second run (and every
+# duplicated spam text) is a lookup instead of a full rule evaluation
+moderation_cache = use_moderation_cache(conn)
+
+# I Compute risk for all users in one bulk pass. It gives the same table as
+#   pd.DataFrame([user_risk_analysis(u, cur) for u in users])
+# but reads posts and comments once instead of scanning both tables for every user.
+# One "now" for the whole run (set RISK_NOW="YYYY-MM-DD HH:MM:SS" to pin it for a reproducible run)
+now = risk.analysis_now()
+# With SNAPSHOT_DIR set (python ../snapshot.py --project 3) users, posts and comments come from the
+# memory-mapped snapshot instead of being read and parsed from SQLite again
+# The texts that are not in the moderation cache are moderated in a process pool (RISK_WORKERS
+# worker processes, default all cores; RISK_WORKERS=1 moderates in this process)
+results = score_all_users(conn, now=now, snapshot=from_environment(conn),
+                          workers=int(os.environ.get("RISK_WORKERS", 0)) or None)
+moderation_cache.flush()
+df = results.sort_values(["final_user_risk", "content_risk_score"], ascending=[False, False]).reset_index(drop=True)
 
 # to Show Top-5
 top5 = df.head(5)
@@ -254,6 +283,9 @@ print(top5)
 import sqlite3
 import re
 import collections
+import instrumentation
+import recommendation
+from follow_graph import FollowGraph
 
 
 def query_db(query, args=()):
@@ -262,6 +294,28 @@ def query_db(query, args=()):
     cursor.execute(query, args)
     return cursor.fetchall()
 
+# Candidate posts come from an inverted keyword index (see recommendation.py) instead of a
+# scan of every post, and followed users from an in-memory follow graph (follow_graph.py)
+# instead of a follows subquery; both are built once and pick up new rows before every request
+_post_index = None
+_follow_graph = None
+
+
+def get_post_index():
+    global _post_index
+    if _post_index is None:
+        recommendation.ensure_feed_indexes(conn)
+        _post_index = recommendation.PostIndex.build(conn)
+    return _post_index
+
+
+def get_follow_graph():
+    global _follow_graph
+    if _follow_graph is None:
+        _follow_graph = FollowGraph.load(conn)
+    return _follow_graph
+
+
 def recommend(user_id, filter_following):
     """
     Args:
@@ -270,58 +324,8 @@ def recommend(user_id, filter_following):
     Returns:
         A list of 5 recommended posts, in reverse-chronological order.
     """
-    # 1. I Get the content of all posts the user has liked (reacted to)
-    liked_posts_content = query_db('''
-        SELECT p.content FROM posts p
-        JOIN reactions r ON p.id = r.post_id
-        WHERE r.user_id = ?
-    ''', (user_id,))
-    
-    # If the user hasn't liked any posts return the 5 newest posts
-    if not liked_posts_content:
-        return query_db('''
-            SELECT p.id, p.content, p.created_at, u.username, u.id as user_id
-            FROM posts p JOIN users u ON p.user_id = u.id
-            WHERE p.user_id != ? ORDER BY p.created_at DESC LIMIT 5
-        ''', (user_id,))
-    
-    # 2.I  Find the most common words from the posts they liked
-    word_counts = collections.Counter()
-    # A simple list of common words to ignore
-    stop_words = {'a', 'an', 'the', 'in', 'on', 'is', 'it', 'to', 'for', 'of', 'and', 'with'}
-    
-    for post in liked_posts_content:
-        # Use regex to find all words in the post content
-        words = re.findall(r'\b\w+\b', post['content'].lower())
-        for word in words:
-            if word not in stop_words and len(word) > 2:
-                word_counts[word] += 1
-    
-    top_keywords = [word for word, _ in word_counts.most_common(10)]
-    
-    query = "SELECT p.id, p.content, p.created_at, u.username, u.id as user_id FROM posts p JOIN users u ON p.user_id = u.id"
-    params = []
-    
-    # If filtering by following,I add a WHERE clause to only include followed users.
-    if filter_following:
-        query += " WHERE p.user_id IN (SELECT followed_id FROM follows WHERE follower_id = ?)"
-        params.append(user_id)
-        
-    all_other_posts = query_db(query, tuple(params))
-    
-    recommended_posts = []
-    liked_post_ids = {post['id'] for post in query_db('SELECT post_id as id FROM reactions WHERE user_id = ?', (user_id,))}
-    
-    for post in all_other_posts:
-        if post['id'] in liked_post_ids or post['user_id'] == user_id:
-            continue
-        
-        if any(keyword in post['content'].lower() for keyword in top_keywords):
-            recommended_posts.append(post)
-
-    recommended_posts.sort(key=lambda p: p['created_at'], reverse=True)
-    
-    return recommended_posts[:5]
+    return recommendation.recommend(conn, user_id, filter_following, index=get_post_index(),
+                                    graph=get_follow_graph())
 
 
 # I Test the function
@@ -336,6 +340,10 @@ for i, post in enumerate(recommendations, 1):
     print(f"   Created: {post['created_at']}")
     print(f"   Content: {post['content'][:100]}...")  # Show first 100 characters
 
+# Run with STAGE_TIMINGS=1 to see where the time of the risk scoring and recommend() went
+if instrumentation.enabled():
+    print(instrumentation.to_json(buckets=False))
+
 conn.close()
 
 
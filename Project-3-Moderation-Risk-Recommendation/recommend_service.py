@@ -0,0 +1,213 @@
+# =========================
+# Recommendation HTTP Service
+# =========================
+# recommend() in project3_analysis.py runs on one global connection, so it cannot serve
+# concurrent requests. This Flask app serves GET /recommend/<user_id>[?following=1] from a pool
+# of read-only SQLite connections (with --wal the database is switched to WAL mode at startup,
+# so readers do not block a writer and vice versa; the mode is stored in the database file):
+#   - the PostIndex and FollowGraph recommend() reads candidates and followees from are built
+#     once at startup and shared by the request threads (recommend() refreshes them),
+#   - identical requests that arrive while one is being computed wait for that result instead
+#     of running the same queries again (RequestCoalescer),
+#   - at most max_concurrency requests are computed at a time (only the leader of a coalesced
+#     key takes a slot); a request that cannot get a slot and a connection within queue_timeout
+#     seconds gets 503 with Retry-After.
+# GET /stats reports the pool and coalescing counters.
+#
+# Usage:
+#   python recommend_service.py [--db database.sqlite] [--port 5000] [--max-concurrency 16] [--pool-size 16] [--wal]
+#   python load_test.py --url http://127.0.0.1:5000 --requests 2000 --concurrency 32
+import argparse
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from follow_graph import FollowGraph
+from recommendation import PostIndex, ensure_feed_indexes, recommend
+
+
+def prepare_database(db_path, wal=False):
+    """
+    Creates the indexes recommend() reads with (with wal, also switches the database to WAL
+    mode, which persists in the file) and returns (PostIndex, FollowGraph) built from it (their
+    edit and delete triggers need this writable connection, the request threads refresh both
+    from read-only ones).
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        if wal:
+            conn.execute("PRAGMA journal_mode=WAL")
+        ensure_feed_indexes(conn)
+        return PostIndex.build(conn), FollowGraph.load(conn)
+    finally:
+        conn.close()
+
+
+class ConnectionPool:
+    """A fixed number of read-only connections (mode=ro URI) shared by the request threads."""
+
+    def __init__(self, db_path, size=8):
+        self.size = size
+        self._idle = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + "?mode=ro", uri=True,
+                                   check_same_thread=False)
+            self._idle.put(conn)
+
+    def acquire(self, timeout=None):
+        return self._idle.get(timeout=timeout)
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    def idle(self):
+        return self._idle.qsize()
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+class RequestCoalescer:
+    """
+    Runs one computation per key at a time: callers that ask for a key that is already being
+    computed get the result (or exception) of that computation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.computed = 0
+        self.coalesced = 0
+
+    def run(self, key, func):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.computed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(func())
+        except BaseException as exc:
+            future.set_exception(exc)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result()
+
+
+class Overloaded(Exception):
+    """No concurrency slot became free within the queue timeout."""
+
+
+class RecommendService:
+    """
+    Args
+        db_path: path of database.sqlite.
+        pool_size: number of read-only connections (default: max_concurrency, one per slot).
+        max_concurrency: requests computed at the same time (further requests wait).
+        queue_timeout: seconds a request waits for a slot and a connection before it is rejected.
+        k: posts per recommendation.
+        wal: switch the database to WAL mode at startup (see prepare_database).
+    """
+
+    def __init__(self, db_path, pool_size=None, max_concurrency=16, queue_timeout=1.0, k=5, wal=False):
+        self.index, self.graph = prepare_database(db_path, wal)
+        self.pool = ConnectionPool(db_path, pool_size or max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.k = k
+        self.coalescer = RequestCoalescer()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.rejected = 0
+
+    def _compute(self, user_id, filter_following):
+        deadline = time.monotonic() + self.queue_timeout
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.rejected += 1
+            raise Overloaded()
+        try:
+            # a pool smaller than max_concurrency can run out of connections with a slot held
+            try:
+                conn = self.pool.acquire(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.rejected += 1
+                raise Overloaded() from None
+            try:
+                posts = recommend(conn, user_id, filter_following, index=self.index, k=self.k, graph=self.graph)
+            finally:
+                self.pool.release(conn)
+        finally:
+            self._slots.release()
+        return [dict(post) for post in posts]
+
+    def recommend(self, user_id, filter_following=False):
+        """
+        The recommended posts as dicts. Requests for a key that is being computed wait for that
+        result without a slot; raises Overloaded when the computation gets no slot or no
+        connection in time.
+        """
+        key = (user_id, bool(filter_following))
+        return self.coalescer.run(key, lambda: self._compute(user_id, filter_following))
+
+    def stats(self):
+        return {
+            "pool_size": self.pool.size,
+            "idle_connections": self.pool.idle(),
+            "max_concurrency": self.max_concurrency,
+            "computed": self.coalescer.computed,
+            "coalesced": self.coalescer.coalesced,
+            "rejected": self.rejected,
+        }
+
+
+def create_app(service):
+    from flask import Flask, jsonify, request
+
+    app = Flask(__name__)
+
+    @app.get("/recommend/<int:user_id>")
+    def recommend_endpoint(user_id):
+        following = request.args.get("following", "0").lower() in ("1", "true", "yes")
+        try:
+            posts = service.recommend(user_id, following)
+        except Overloaded:
+            response = jsonify(error="too many concurrent requests")
+            response.status_code = 503
+            response.headers["Retry-After"] = "1"
+            return response
+        return jsonify(user_id=user_id, filter_following=following, posts=posts)
+
+    @app.get("/stats")
+    def stats_endpoint():
+        return jsonify(service.stats())
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recommend() over HTTP")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--pool-size", type=int, default=None, help="read-only connections (default: --max-concurrency)")
+    parser.add_argument("--queue-timeout", type=float, default=1.0)
+    parser.add_argument("--wal", action="store_true", help="switch the database to WAL mode (persists in the file)")
+    args = parser.parse_args()
+
+    service = RecommendService(args.db, pool_size=args.pool_size, max_concurrency=args.max_concurrency,
+                               queue_timeout=args.queue_timeout, wal=args.wal)
+    create_app(service).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
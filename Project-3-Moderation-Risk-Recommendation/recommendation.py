@@ -0,0 +1,1010 @@
+# =========================
+# Recommendation with an inverted keyword index (Exercise 3.3)
+# =========================
+# recommend() loaded every post (or every post of the followed users) and ran
+# `any(keyword in content.lower() for keyword in top_keywords)` on each one, so one request cost
+# a full scan of posts. PostIndex keeps a token -> post ids index of posts in memory and the
+# candidates of a request are the union of the posting lists of its top keywords; only those
+# posts are read from the database.
+#
+# The original test is a substring test ("tea" also matches "steam"), not a word test. A keyword
+# only contains word characters, so it occurs in the lowercased text iff it occurs inside one of
+# the \w+ tokens of the lowercased text. PostIndex therefore looks a keyword up as "every token
+# that contains it", with a trigram index over the token vocabulary, and the results stay
+# identical to the full scan.
+#
+# Only the k newest matches are returned, so candidates are read newest first (an index on
+# posts(created_at DESC) serves "ORDER BY created_at DESC, id" without a sort) and reading stops
+# at the k-th match. Ranking by a score instead of recency keeps a heap of k posts.
+import argparse
+import collections
+import heapq
+import itertools
+import os
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from follow_graph import FollowGraph
+from instrumentation import stage
+
+
+STOP_WORDS = {'a', 'an', 'the', 'in', 'on', 'is', 'it', 'to', 'for', 'of', 'and', 'with'}
+WORD_PATTERN = re.compile(r'\b\w+\b')
+TOKEN_PATTERN = re.compile(r'\w+')
+
+POST_COLUMNS = "p.id, p.content, p.created_at, u.username, u.id as user_id"
+
+# SQLite's default limit on the number of ? parameters in one statement (older builds)
+_MAX_PARAMS = 999
+
+
+def _rows(conn, query, args=()):
+    """query_db with sqlite3.Row results, without changing the row_factory of conn."""
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(query, args)
+    return cursor.fetchall()
+
+
+def ensure_feed_indexes(conn):
+    """
+    Indexes the top-k path needs: newest-first order of posts (the DESC key makes a forward
+    scan return created_at DESC, id ASC, the order recommend() ranks ties in), the users join
+    and the followed users of a user.
+    """
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts (created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_users_id ON users (id);
+        CREATE INDEX IF NOT EXISTS idx_follows_follower ON follows (follower_id, followed_id);
+    """)
+    conn.commit()
+
+
+def keyword_counts(contents, n=10):
+    """(word, count) of the n most common words (not stop words, longer than 2 characters)."""
+    word_counts = collections.Counter()
+    for content in contents:
+        for word in WORD_PATTERN.findall(content.lower()):
+            if word not in STOP_WORDS and len(word) > 2:
+                word_counts[word] += 1
+    return word_counts.most_common(n)
+
+
+def top_keywords(contents, n=10):
+    """The n most common words (not stop words, longer than 2 characters) of the liked posts."""
+    return [word for word, _ in keyword_counts(contents, n)]
+
+
+def keyword_score(weights):
+    """
+    A score function for recommend(score=...): the summed weights (e.g. the liked-post counts
+    from keyword_counts) of the keywords a post contains.
+    """
+    weights = list(weights)
+
+    def score(post):
+        content = post['content'].lower()
+        return sum(weight for keyword, weight in weights if keyword in content)
+    return score
+
+
+def _trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+# posts whose content was edited or that were deleted, one row per post with the sequence
+# number of its last change (the table never grows beyond the number of changed posts)
+_EDIT_TRIGGERS = """
+    CREATE TABLE IF NOT EXISTS post_index_edits (
+        post_id INTEGER PRIMARY KEY,
+        seq     INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_post_index_edits_seq ON post_index_edits (seq);
+    CREATE TRIGGER IF NOT EXISTS post_index_update AFTER UPDATE OF content, user_id ON posts BEGIN
+        INSERT INTO post_index_edits (post_id, seq)
+        SELECT OLD.id, COALESCE(MAX(seq), 0) + 1 FROM post_index_edits WHERE true
+        ON CONFLICT (post_id) DO UPDATE SET seq = excluded.seq;
+    END;
+    CREATE TRIGGER IF NOT EXISTS post_index_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO post_index_edits (post_id, seq)
+        SELECT OLD.id, COALESCE(MAX(seq), 0) + 1 FROM post_index_edits WHERE true
+        ON CONFLICT (post_id) DO UPDATE SET seq = excluded.seq;
+    END;
+"""
+_EDITED_POSTS_QUERY = """
+    SELECT e.seq, e.post_id, p.user_id, p.content
+    FROM post_index_edits e LEFT JOIN posts p ON p.id = e.post_id
+    WHERE e.seq > ? ORDER BY e.seq
+"""
+
+
+class PostIndex:
+    """
+    In-memory inverted index of posts.content: lowercased \\w+ token -> set of post ids, plus a
+    trigram -> tokens index of the vocabulary for substring lookups.
+
+    refresh(conn) adds the posts above the highest indexed id, recommend() calls it before every
+    request. With track_edits (build() creates the trigger) it also re-tokenizes the posts whose
+    content was edited and drops the deleted ones, so lookups match the current content like the
+    full scan; without it posts are treated as append-only. refresh() and the lookups hold a
+    lock, so one index can be shared by request threads.
+    """
+
+    def __init__(self, track_edits=False):
+        self.track_edits = track_edits
+        self.postings = collections.defaultdict(set)
+        self.authors = {}  # post id -> user_id
+        self.tokens = {}   # post id -> its tokens, to drop its postings when it changes
+        self._grams = collections.defaultdict(set)
+        self._lock = threading.RLock()
+        self.last_id = 0
+        self.last_edit = 0
+
+    @classmethod
+    def build(cls, conn, track_edits=True):
+        """
+        Indexes every post. With track_edits the edit trigger is created so refresh() notices
+        edited and deleted posts (needs a writable connection); without it refresh() only adds
+        new posts.
+        """
+        index = cls(track_edits)
+        if track_edits:
+            conn.executescript(_EDIT_TRIGGERS)
+            conn.commit()
+            index.last_edit = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM post_index_edits").fetchone()[0]
+        index.refresh(conn)
+        return index
+
+    @property
+    def size(self):
+        return len(self.tokens)
+
+    def add(self, post_id, content, user_id=None):
+        """Indexes a post, replacing its tokens if it is already indexed."""
+        with self._lock:
+            self.remove(post_id)
+            tokens = set(TOKEN_PATTERN.findall(content.lower()))
+            self.authors[post_id] = user_id
+            self.tokens[post_id] = tokens
+            for token in tokens:
+                posting = self.postings[token]
+                if not posting:
+                    for gram in _trigrams(token):
+                        self._grams[gram].add(token)
+                posting.add(post_id)
+
+    def remove(self, post_id):
+        """Drops a post from the postings (no-op if it is not indexed)."""
+        with self._lock:
+            self.authors.pop(post_id, None)
+            for token in self.tokens.pop(post_id, ()):
+                posting = self.postings[token]
+                posting.discard(post_id)
+                if not posting:
+                    del self.postings[token]
+                    for gram in _trigrams(token):
+                        self._grams[gram].discard(token)
+
+    def refresh(self, conn):
+        """
+        Indexes the posts with id > last_id and re-reads the posts edited or deleted since the
+        last refresh. Returns the number of posts read.
+        """
+        with self._lock:
+            edits = []
+            if self.track_edits:
+                edits = conn.execute(_EDITED_POSTS_QUERY, (self.last_edit,)).fetchall()
+            rows = conn.execute("SELECT id, user_id, content FROM posts WHERE id > ? ORDER BY id",
+                                (self.last_id,)).fetchall()
+            for post_id, user_id, content in rows:
+                if content:
+                    self.add(post_id, content, user_id)
+            if rows:
+                self.last_id = rows[-1][0]
+            for seq, post_id, user_id, content in edits:
+                # an edited post is indexed like a new one, a deleted (or emptied) one is dropped
+                if content:
+                    self.add(post_id, content, user_id)
+                else:
+                    self.remove(post_id)
+                self.last_edit = seq
+            return len(rows) + len(edits)
+
+    def tokens_containing(self, keyword):
+        """Every indexed token that has `keyword` as a substring."""
+        with self._lock:
+            if len(keyword) < 3:
+                return [t for t in self.postings if keyword in t]
+            grams = sorted((self._grams.get(g, set()) for g in _trigrams(keyword)), key=len)
+            if not grams[0]:
+                return []
+            return [t for t in grams[0].intersection(*grams[1:]) if keyword in t]
+
+    def lookup(self, keyword):
+        """Ids of the posts whose lowercased content contains `keyword` (a run of word characters)."""
+        ids = set()
+        with self._lock:
+            for token in self.tokens_containing(keyword):
+                ids |= self.postings[token]
+        return ids
+
+    def candidates(self, keywords):
+        """Union of the posting lists of all keywords."""
+        ids = set()
+        for keyword in keywords:
+            ids |= self.lookup(keyword)
+        return ids
+
+
+# =========================
+# Interest profiles
+# =========================
+# Every request re-read and re-tokenized the content of every post the user liked to count 10
+# keywords, so heavy likers were the most expensive users to serve. InterestProfiles keeps the
+# word counts of every user as a sparse term -> count vector in SQLite (user_interest_terms) and
+# only adds the reactions above its rowid watermark. The top keywords are one index range read.
+#
+# Counter.most_common breaks count ties by first occurrence, so every term also stores where it
+# was first seen (reaction rowid, word position). Reactions are read in rowid order, the order
+# the liked-posts query returns them, so (count DESC, first_rowid, first_pos) is exactly the
+# most_common order. Triggers mark a user stale when one of their reactions is deleted or a post
+# they reacted to is edited or deleted; stale profiles are rebuilt from their reactions.
+
+_PROFILE_TABLES = """
+    CREATE TABLE IF NOT EXISTS user_interest_terms (
+        user_id     INTEGER NOT NULL,
+        term        TEXT    NOT NULL,
+        count       INTEGER NOT NULL,
+        first_rowid INTEGER NOT NULL,   -- reactions rowid of the first occurrence
+        first_pos   INTEGER NOT NULL,   -- word position in that post
+        PRIMARY KEY (user_id, term)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_user_interest_top
+        ON user_interest_terms (user_id, count DESC, first_rowid, first_pos);
+    CREATE TABLE IF NOT EXISTS user_interest_likes (
+        user_id INTEGER PRIMARY KEY,
+        likes   INTEGER NOT NULL        -- reactions joined with an existing post
+    );
+    CREATE TABLE IF NOT EXISTS user_interest_stale (
+        user_id INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS user_interest_watermark (
+        id         INTEGER PRIMARY KEY CHECK (id = 0),
+        last_rowid INTEGER NOT NULL
+    );
+    CREATE TRIGGER IF NOT EXISTS user_interest_reaction_delete AFTER DELETE ON reactions BEGIN
+        INSERT INTO user_interest_stale VALUES (OLD.user_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS user_interest_post_update AFTER UPDATE OF content ON posts BEGIN
+        INSERT INTO user_interest_stale SELECT user_id FROM reactions WHERE post_id = OLD.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS user_interest_post_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO user_interest_stale SELECT user_id FROM reactions WHERE post_id = OLD.id;
+    END;
+"""
+
+
+def _profile_terms(rows):
+    """
+    (user_id, term) -> [count, first_rowid, first_pos] and user_id -> likes for
+    (reaction rowid, user_id, content) rows in rowid order.
+    """
+    terms = {}
+    likes = collections.Counter()
+    for rowid, user_id, content in rows:
+        likes[user_id] += 1
+        for pos, word in enumerate(WORD_PATTERN.findall(content.lower())):
+            if word not in STOP_WORDS and len(word) > 2:
+                entry = terms.get((user_id, word))
+                if entry is None:
+                    terms[(user_id, word)] = [1, rowid, pos]
+                else:
+                    entry[0] += 1
+    return terms, likes
+
+
+class InterestProfiles:
+    """
+    Args
+        conn: sqlite3 connection to database.sqlite, the user_interest_* tables and triggers
+            are created there.
+
+    refresh() applies the new reactions and rebuilds stale users; top_keywords(user_id) and
+    has_likes(user_id) then read the stored profile.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        conn.executescript(_PROFILE_TABLES)
+        conn.commit()
+
+    def _watermark(self):
+        row = self.conn.execute("SELECT last_rowid FROM user_interest_watermark WHERE id = 0").fetchone()
+        return row[0] if row else 0
+
+    def refresh(self):
+        """Adds the reactions above the watermark and rebuilds stale users. Returns the reactions read."""
+        watermark = self._watermark()
+        last_rowid = self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM reactions").fetchone()[0]
+        stale_marks = self.conn.execute("SELECT rowid, user_id FROM user_interest_stale").fetchall()
+        if last_rowid == watermark and not stale_marks:
+            return 0
+        stale = {user_id for _, user_id in stale_marks}
+        query = """
+            SELECT r.rowid, r.user_id, p.content FROM reactions r JOIN posts p ON p.id = r.post_id
+            WHERE r.rowid > ? AND r.rowid <= ? {users} ORDER BY r.rowid
+        """
+        rows = [row for row in self.conn.execute(query.format(users=""), (watermark, last_rowid))
+                if row[1] not in stale]
+
+        with self.conn:
+            if stale:
+                marks = ",".join("?" * len(stale))
+                self.conn.execute(f"DELETE FROM user_interest_terms WHERE user_id IN ({marks})", tuple(stale))
+                self.conn.execute(f"DELETE FROM user_interest_likes WHERE user_id IN ({marks})", tuple(stale))
+                self.conn.execute("DELETE FROM user_interest_stale WHERE rowid <= ?",
+                                  (max(rowid for rowid, _ in stale_marks),))
+                # a stale user is rebuilt from all of their reactions up to the new watermark
+                rows += self.conn.execute(query.format(users=f"AND r.user_id IN ({marks})"),
+                                          (0, last_rowid, *stale)).fetchall()
+                rows.sort()
+            terms, likes = _profile_terms(rows)
+            self.conn.executemany("""
+                INSERT INTO user_interest_terms VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, term) DO UPDATE SET count = count + excluded.count
+            """, [(user_id, term, *entry) for (user_id, term), entry in terms.items()])
+            self.conn.executemany("""
+                INSERT INTO user_interest_likes VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET likes = likes + excluded.likes
+            """, likes.items())
+            self.conn.execute("INSERT OR REPLACE INTO user_interest_watermark VALUES (0, ?)", (last_rowid,))
+        return len(rows)
+
+    def has_likes(self, user_id):
+        return self.conn.execute("SELECT 1 FROM user_interest_likes WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+    def top_keywords(self, user_id, n=10):
+        """The same list as top_keywords() over the user's liked posts, read from the profile."""
+        return [row[0] for row in self.conn.execute("""
+            SELECT term FROM user_interest_terms WHERE user_id = ?
+            ORDER BY count DESC, first_rowid, first_pos LIMIT ?
+        """, (user_id, n))]
+
+    def terms(self, user_id):
+        """The whole sparse profile as {term: count}."""
+        return dict(self.conn.execute("SELECT term, count FROM user_interest_terms WHERE user_id = ?", (user_id,)))
+
+
+_FOLLOWING = " AND p.user_id IN (SELECT followed_id FROM follows WHERE follower_id = ?)"
+_NEWEST_FIRST = " ORDER BY p.created_at DESC, p.id"
+
+# the per-request queries of recommend(); the candidates are read newest first (_NEWEST_FIRST),
+# for filter_following with _FOLLOWING appended before it. schema_optimization.py checks the
+# plans of exactly these strings, keep the names when changing them
+LIKED_POSTS_QUERY = """
+    SELECT p.id, p.content FROM posts p
+    JOIN reactions r ON p.id = r.post_id
+    WHERE r.user_id = ?
+    ORDER BY r.rowid
+"""
+LIKED_IDS_QUERY = "SELECT post_id FROM reactions WHERE user_id = ?"
+NEWEST_QUERY = f"""
+    SELECT {POST_COLUMNS}
+    FROM posts p JOIN users u ON p.user_id = u.id
+    WHERE p.user_id != ?{_NEWEST_FIRST} LIMIT ?
+"""
+CANDIDATES_QUERY = f"SELECT {POST_COLUMNS} FROM posts p JOIN users u ON p.user_id = u.id WHERE p.user_id != ?"
+CANDIDATES_BY_ID_QUERY = (f"SELECT {POST_COLUMNS} FROM posts p JOIN users u ON p.user_id = u.id "
+                          "WHERE p.id IN ({marks}) AND p.user_id != ?")
+FOLLOWEES_QUERY = "SELECT followed_id FROM follows WHERE follower_id = ?"
+
+
+def _posts_by_id(conn, post_ids, filter_following, user_id, limit=None):
+    """
+    The candidate rows (posts joined with users, not written by user_id) for the given ids,
+    newest first. With a limit only the `limit` newest rows are read.
+    """
+    post_ids = sorted(post_ids)
+    chunks = []
+    for i in range(0, len(post_ids), _MAX_PARAMS - 3):
+        chunk = post_ids[i:i + _MAX_PARAMS - 3]
+        query = CANDIDATES_BY_ID_QUERY.format(marks=",".join("?" * len(chunk)))
+        params = [*chunk, user_id]
+        if filter_following:
+            query += _FOLLOWING
+            params.append(user_id)
+        query += _NEWEST_FIRST
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        chunks.append(_rows(conn, query, tuple(params)))
+    # every chunk is newest first and the chunks hold ascending id ranges, so a stable merge
+    # keeps "created_at DESC, id ASC"
+    return heapq.merge(*chunks, key=lambda p: p['created_at'], reverse=True)
+
+
+def _newest_posts(conn, user_id, filter_following):
+    """Every post not written by user_id (joined with users), newest first, read lazily."""
+    query = CANDIDATES_QUERY
+    params = [user_id]
+    if filter_following:
+        query += _FOLLOWING
+        params.append(user_id)
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(query + _NEWEST_FIRST, tuple(params))
+
+
+def _until(rows, deadline):
+    """Stops iterating rows once time.monotonic() passes the deadline (None: never)."""
+    for row in rows:
+        if deadline is not None and time.monotonic() > deadline:
+            return
+        yield row
+
+
+def recommend(conn, user_id, filter_following, index=None, k=5, score=None, budget=None, graph=None,
+              profiles=None):
+    """
+    Args:
+        conn: sqlite3 connection to database.sqlite.
+        user_id: The ID of the current user.
+        filter_following: Boolean, True if we only want to see recommendations from followed users.
+        index: a PostIndex of posts; refreshed before it is used. Without one, posts are read
+            newest first until k of them match a keyword.
+        k: number of posts to return.
+        score: optional function post -> number (see keyword_score). The k highest scores are
+            returned instead of the k newest posts (ties: newer first).
+        budget: optional time limit in seconds for reading candidates. When it runs out the
+            posts found so far are returned; for recency ranking they are still the newest
+            matches, only fewer than k.
+        graph: optional FollowGraph; refreshed and used for filter_following instead of the
+            follows subquery.
+        profiles: optional InterestProfiles (on the same connection); refreshed and used for
+            the top keywords instead of re-reading the liked posts.
+    Returns:
+        A list of k recommended posts (sqlite3.Row), in reverse-chronological order (or by score).
+    """
+    return _recommend(conn, user_id, filter_following, index, k, score, budget, graph, profiles)[0]
+
+
+def _recommend(conn, user_id, filter_following, index=None, k=5, score=None, budget=None, graph=None,
+               profiles=None):
+    """recommend(), also returning the top keywords it matched (None when the user has no likes)."""
+    deadline = time.monotonic() + budget if budget is not None else None
+    if profiles is not None:
+        with stage("recommend.profiles"):
+            profiles.refresh()
+            has_likes = profiles.has_likes(user_id)
+    else:
+        with stage("recommend.liked_posts") as s:
+            liked = _rows(conn, LIKED_POSTS_QUERY, (user_id,))
+            s.rows = len(liked)
+        has_likes = bool(liked)
+
+    # If the user hasn't liked any posts return the k newest posts
+    if not has_likes:
+        with stage("recommend.newest_fallback"):
+            return _rows(conn, NEWEST_QUERY, (user_id, k)), None
+
+    with stage("recommend.keywords"):
+        if profiles is not None:
+            keywords = profiles.top_keywords(user_id)
+        else:
+            keywords = top_keywords(post['content'] for post in liked)
+    with stage("recommend.liked_ids") as s:
+        liked_post_ids = {row[0] for row in conn.execute(LIKED_IDS_QUERY, (user_id,))}
+        s.rows = len(liked_post_ids)
+
+    # with a FollowGraph the follow filter is a set lookup instead of the follows subquery
+    followees = None
+    if filter_following and graph is not None:
+        with stage("recommend.follow_graph"):
+            graph.refresh(conn)
+            followees = graph.followee_set(user_id)
+    sql_following = filter_following and followees is None
+
+    if index is not None:
+        with stage("recommend.index_lookup") as s:
+            index.refresh(conn)
+            candidate_ids = index.candidates(keywords) - liked_post_ids
+            if followees is not None:
+                candidate_ids = {post_id for post_id in candidate_ids if index.authors.get(post_id) in followees}
+            candidates = _posts_by_id(conn, candidate_ids, sql_following, user_id,
+                                      limit=k if score is None else None)
+            s.rows = len(candidate_ids)
+    else:
+        candidates = (post for post in _newest_posts(conn, user_id, sql_following)
+                      if post['id'] not in liked_post_ids
+                      and (followees is None or post['user_id'] in followees)
+                      and any(keyword in post['content'].lower() for keyword in keywords))
+    candidates = _until(candidates, deadline)
+
+    # candidates are read lazily, so this stage is the candidate scan and the ranking together
+    with stage("recommend.scan") as s:
+        if score is None:
+            # newest first: the first k candidates are the answer
+            posts = [post for _, post in zip(range(k), candidates)]
+        else:
+            # bounded heap: O(k) memory however many posts match (ties: newer, then lower id first)
+            order = ((score(post), post['created_at'], -post['id'], post) for post in candidates)
+            posts = [item[3] for item in heapq.nlargest(k, order, key=lambda item: item[:3])]
+        s.rows = len(posts)
+    return posts, keywords
+
+
+# =========================
+# Recommendation cache
+# =========================
+# Identical recommend(user_id, filter_following) calls recompute everything although nothing
+# they depend on changed. RecommendationCache keeps the results in an LRU with a TTL. Triggers
+# on reactions, follows and posts append every write to recommendation_events, so writes of
+# any process are seen; before each lookup the cache reads the events above its watermark and
+# drops the entries they can affect:
+#   - a reaction (added or removed) of the user: both entries of the user,
+#   - a follow (added or removed) of the user: the filter_following entry,
+#   - a new or edited post that could enter the top k (newer than the oldest cached post or
+#     fewer than k cached, matches a keyword, not the user's own, from a followed user for
+#     filter_following),
+#   - an edited or deleted post: the entries that contain it and the entries of the users who
+#     reacted to it (their keywords come from its content).
+#
+# Every cache is a consumer in recommendation_event_consumers (its watermark, and until when it
+# may hold unexpired entries); after applying new events a cache deletes the events every live
+# consumer has applied, so the table only holds events some cache has not read yet. A consumer
+# that did not register within its ttl has no unexpired entry left and does not hold pruning
+# back (a crashed process does not make the table grow). Liveness is wall-clock time.
+#
+# The triggers only exist while a cache is registered: the last cache to close() drops them
+# and the remaining events, so writes to a database nobody caches cost nothing. A cache
+# registers before it creates the triggers (a cache closing at the same time then sees it and
+# keeps them), and one whose registration lapsed (all its entries expired, the triggers may be
+# gone) clears itself and attaches again before serving.
+
+_EVENT_TABLES = """
+    CREATE TABLE IF NOT EXISTS recommendation_events (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind    TEXT    NOT NULL,      -- 'reaction', 'follow', 'post' (new) or 'post_change'
+        user_id INTEGER,               -- reacting user, follower or post author
+        post_id INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS recommendation_event_consumers (
+        name       TEXT    PRIMARY KEY,
+        last_event INTEGER NOT NULL,   -- the events up to this id are applied
+        live_until REAL    NOT NULL    -- unix time after which all of its entries have expired
+    );
+"""
+_EVENT_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS recommendation_reaction_insert AFTER INSERT ON reactions BEGIN
+        INSERT INTO recommendation_events (kind, user_id, post_id) VALUES ('reaction', NEW.user_id, NEW.post_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS recommendation_reaction_delete AFTER DELETE ON reactions BEGIN
+        INSERT INTO recommendation_events (kind, user_id, post_id) VALUES ('reaction', OLD.user_id, OLD.post_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS recommendation_follow_insert AFTER INSERT ON follows BEGIN
+        INSERT INTO recommendation_events (kind, user_id) VALUES ('follow', NEW.follower_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS recommendation_follow_delete AFTER DELETE ON follows BEGIN
+        INSERT INTO recommendation_events (kind, user_id) VALUES ('follow', OLD.follower_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS recommendation_post_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO recommendation_events (kind, user_id, post_id) VALUES ('post', NEW.user_id, NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS recommendation_post_update AFTER UPDATE ON posts BEGIN
+        INSERT INTO recommendation_events (kind, user_id, post_id) VALUES ('post_change', OLD.user_id, OLD.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS recommendation_post_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO recommendation_events (kind, user_id, post_id) VALUES ('post_change', OLD.user_id, OLD.id);
+    END;
+"""
+_EVENT_TRIGGER_NAMES = re.findall(r"CREATE TRIGGER IF NOT EXISTS (\w+)", _EVENT_TRIGGERS)
+
+
+class RecommendationCache:
+    """
+    Args
+        conn: sqlite3 connection to database.sqlite, the recommendation_events table and its
+            triggers are created there (the triggers are dropped when the last cache closes).
+        index: optional PostIndex passed to recommend() on a miss (from PostIndex.build, so
+            the entries recomputed after a post_change event see the edit).
+        graph: optional FollowGraph passed to recommend() on a miss.
+        profiles: optional InterestProfiles passed to recommend() on a miss.
+        maxsize: number of (user_id, filter_following) results kept in the LRU.
+        ttl: seconds an entry is served at most, even without an invalidating event.
+        k: posts per recommendation.
+        clock: time source for the TTL (seconds).
+        consumer: name of the cache in recommendation_event_consumers (default: unique per cache).
+
+    hits / misses count lookups, invalidations and expirations count dropped entries.
+    """
+
+    def __init__(self, conn, index=None, maxsize=10_000, ttl=300.0, k=5, clock=time.monotonic, graph=None,
+                 profiles=None, consumer=None):
+        self.conn = conn
+        self.index = index
+        self.graph = graph
+        self.profiles = profiles
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.k = k
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.expirations = 0
+        self.consumer = consumer or f"cache-{os.getpid()}-{id(self)}"
+        self._entries = collections.OrderedDict()
+        conn.executescript(_EVENT_TABLES)
+        conn.commit()
+        self._attach()
+
+    def recommend(self, user_id, filter_following):
+        """recommend(conn, user_id, filter_following) from the cache when nothing relevant changed."""
+        self.sync()
+        key = (user_id, bool(filter_following))
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self.clock() < entry["expires"]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry["posts"])
+            del self._entries[key]
+            self.expirations += 1
+
+        self.misses += 1
+        posts, keywords = _recommend(self.conn, user_id, filter_following, self.index, self.k,
+                                     graph=self.graph, profiles=self.profiles)
+        following = None
+        if filter_following and keywords is not None:
+            if self.graph is not None:
+                following = self.graph.followee_set(user_id)
+            else:
+                following = {row[0] for row in self.conn.execute(FOLLOWEES_QUERY, (user_id,))}
+        self._entries[key] = {
+            "posts": posts,
+            "post_ids": {post['id'] for post in posts},
+            "oldest": posts[-1]['created_at'] if len(posts) == self.k else None,
+            "keywords": keywords,
+            "following": following,
+            "expires": self.clock() + self.ttl,
+        }
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        if time.time() + self.ttl > self._live_until:
+            self._register()
+        return list(posts)
+
+    def sync(self):
+        """Applies the events written since the last sync. Returns the number of events."""
+        if time.time() >= self._live_until:
+            self._attach()
+            return 0
+        events = self.conn.execute(
+            "SELECT id, kind, user_id, post_id FROM recommendation_events WHERE id > ? ORDER BY id",
+            (self.last_event,)).fetchall()
+        if not events:
+            return 0
+        self.last_event = events[-1][0]
+        for _, kind, user_id, post_id in events:
+            if kind == "reaction":
+                self._invalidate((user_id, False), (user_id, True))
+            elif kind == "follow":
+                self._invalidate((user_id, True))
+            elif self._entries:
+                self._post_changed(post_id, edited=kind == "post_change")
+        self.prune_events()
+        return len(events)
+
+    def prune_events(self):
+        """
+        Stores the watermark of this cache and deletes the events every live consumer has
+        applied (sync() runs it after new events). Returns the number of deleted events.
+        """
+        now = self._register(commit=False)
+        with self.conn:
+            self.conn.execute("DELETE FROM recommendation_event_consumers WHERE live_until < ?", (now,))
+            return self.conn.execute("""
+                DELETE FROM recommendation_events
+                WHERE id <= (SELECT MIN(last_event) FROM recommendation_event_consumers)
+            """).rowcount
+
+    def close(self):
+        """
+        Removes this cache from the consumers, so it no longer holds pruning back. The last live
+        consumer drops the event triggers and the events.
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM recommendation_event_consumers WHERE name = ?", (self.consumer,))
+            self.conn.execute("DELETE FROM recommendation_event_consumers WHERE live_until < ?", (time.time(),))
+            if self.conn.execute("SELECT 1 FROM recommendation_event_consumers LIMIT 1").fetchone() is None:
+                for name in _EVENT_TRIGGER_NAMES:
+                    self.conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+                self.conn.execute("DELETE FROM recommendation_events")
+        self._entries.clear()
+        self._live_until = 0.0
+
+    def _attach(self):
+        # the entries of a lapsed registration have expired, events it missed do not matter
+        self._entries.clear()
+        self.last_event = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM recommendation_events").fetchone()[0]
+        self._register()
+        self.conn.executescript(_EVENT_TRIGGERS)
+        self.conn.commit()
+
+    def _register(self, commit=True):
+        # an entry created now expires before now + ttl; registering two ttls ahead rewrites the
+        # row at most once per ttl however many misses there are
+        now = time.time()
+        self._live_until = now + 2 * self.ttl
+        self.conn.execute("""
+            INSERT INTO recommendation_event_consumers (name, last_event, live_until) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET last_event = excluded.last_event, live_until = excluded.live_until
+        """, (self.consumer, self.last_event, self._live_until))
+        if commit:
+            self.conn.commit()
+        return now
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _invalidate(self, *keys):
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def _post_changed(self, post_id, edited):
+        post = self.conn.execute("SELECT user_id, content, created_at FROM posts WHERE id = ?", (post_id,)).fetchone()
+        likers = set()
+        if edited:
+            likers = {row[0] for row in self.conn.execute("SELECT user_id FROM reactions WHERE post_id = ?", (post_id,))}
+        stale = [key for key, entry in self._entries.items()
+                 if key[0] in likers or post_id in entry["post_ids"]
+                 or (post is not None and self._may_enter(key, entry, *post))]
+        self._invalidate(*stale)
+
+    def _may_enter(self, key, entry, author_id, content, created_at):
+        user_id, filter_following = key
+        if author_id == user_id:
+            return False
+        if entry["oldest"] is not None and created_at < entry["oldest"]:
+            return False
+        if entry["keywords"] is None:
+            # the newest posts of the platform (filter_following does not apply)
+            return True
+        if filter_following and author_id not in entry["following"]:
+            return False
+        content = (content or "").lower()
+        return any(keyword in content for keyword in entry["keywords"])
+
+
+# =========================
+# Materialized feeds
+# =========================
+# Serving recommend() per request repeats the liked-posts query, the keyword count and the
+# candidate scan for every user. materialize_feeds computes the top-n feed of every user (both
+# filter_following variants) from one read of posts, reactions and follows and writes it to the
+# feeds table; serving a feed is then one primary-key range lookup (feed()). Users are split
+# into chunks scored in a process pool; every worker loads the data once from its own
+# read-only connection.
+
+class FeedData:
+    """posts, reactions and follows loaded once, with what recommend() needs per user."""
+
+    def __init__(self, conn):
+        # every post with its author, in the order recommend() ranks them (newest first)
+        self.posts = _rows(conn, f"SELECT {POST_COLUMNS} FROM posts p JOIN users u ON p.user_id = u.id"
+                                 + _NEWEST_FIRST)
+        self.rank = {post['id']: i for i, post in enumerate(self.posts)}
+        self.index = PostIndex()
+        for post_id, user_id, content in conn.execute("SELECT id, user_id, content FROM posts ORDER BY id"):
+            if content:
+                self.index.add(post_id, content, user_id)
+        # liked contents in reactions order, the order the per-user liked query returns them
+        self.liked = collections.defaultdict(list)
+        for user_id, post_id, content in conn.execute(
+                "SELECT r.user_id, p.id, p.content FROM reactions r JOIN posts p ON p.id = r.post_id ORDER BY r.rowid"):
+            self.liked[user_id].append((post_id, content))
+        self.reacted = collections.defaultdict(set)
+        for user_id, post_id in conn.execute("SELECT user_id, post_id FROM reactions"):
+            self.reacted[user_id].add(post_id)
+        # a snapshot: the batch job does not refresh it (and may run on a read-only connection)
+        self.graph = FollowGraph.load(conn, track_deletes=False)
+
+    def feed(self, user_id, filter_following, n=5):
+        """The post ids recommend(conn, user_id, filter_following, k=n) returns, in order."""
+        liked = self.liked.get(user_id)
+        if not liked:
+            return [p['id'] for p in itertools.islice(
+                (p for p in self.posts if p['user_id'] != user_id), n)]
+        keywords = top_keywords(content for _, content in liked)
+        excluded = self.reacted[user_id]
+        following = self.graph.followee_set(user_id) if filter_following else None
+        ranks = [self.rank[post_id] for post_id in self.index.candidates(keywords) - excluded
+                 if post_id in self.rank]
+        feed = []
+        for i in sorted(ranks):
+            post = self.posts[i]
+            if post['user_id'] == user_id or (filter_following and post['user_id'] not in following):
+                continue
+            feed.append(post['id'])
+            if len(feed) == n:
+                break
+        return feed
+
+
+_feed_data = None
+
+
+def _init_feed_worker(db_path):
+    global _feed_data
+    conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    _feed_data = FeedData(conn)
+    conn.close()
+
+
+def _feed_rows(data, user_ids, n):
+    rows = []
+    for user_id in user_ids:
+        for filter_following in (0, 1):
+            for rank, post_id in enumerate(data.feed(user_id, filter_following, n)):
+                rows.append((user_id, filter_following, rank, post_id))
+    return rows
+
+
+def _feed_chunk(task):
+    user_ids, n = task
+    return _feed_rows(_feed_data, user_ids, n)
+
+
+def materialize_feeds(db_path, n=5, workers=None, chunk_size=500):
+    """
+    Args
+        db_path: path of database.sqlite; the feeds table is (re)written there.
+        n: posts per feed.
+        workers: worker processes (default: all cores, 1 computes in this process).
+        chunk_size: users per task.
+
+    Returns:
+        (number of users, seconds). feeds holds (user_id, filter_following, rank, post_id) with
+        rank 0 the first post of recommend(user_id, filter_following).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS feeds (
+            user_id          INTEGER NOT NULL,
+            filter_following INTEGER NOT NULL,
+            rank             INTEGER NOT NULL,
+            post_id          INTEGER NOT NULL,
+            PRIMARY KEY (user_id, filter_following, rank)
+        ) WITHOUT ROWID
+    """)
+    conn.commit()
+    user_ids = [row[0] for row in conn.execute("SELECT DISTINCT id FROM users ORDER BY id")]
+    tasks = [(user_ids[i:i + chunk_size], n) for i in range(0, len(user_ids), chunk_size)]
+
+    if workers <= 1 or len(tasks) <= 1:
+        data = FeedData(conn)
+        parts = [_feed_rows(data, chunk, n) for chunk, n in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_feed_worker,
+                                 initargs=(os.path.abspath(db_path),)) as pool:
+            parts = list(pool.map(_feed_chunk, tasks))
+
+    with conn:
+        conn.execute("DELETE FROM feeds")
+        for rows in parts:
+            conn.executemany("INSERT INTO feeds VALUES (?, ?, ?, ?)", rows)
+    conn.close()
+    return len(user_ids), time.perf_counter() - start
+
+
+def feed(conn, user_id, filter_following):
+    """A materialized feed: the recommend() rows of the user, read from feeds by primary key."""
+    return _rows(conn, f"""
+        SELECT {POST_COLUMNS}
+        FROM feeds f JOIN posts p ON p.id = f.post_id JOIN users u ON p.user_id = u.id
+        WHERE f.user_id = ? AND f.filter_following = ?
+        ORDER BY f.rank
+    """, (user_id, int(bool(filter_following))))
+
+
+def check_feeds(conn, user_ids=None):
+    """
+    Compares the materialized feeds with recommend() (run it after indexes are created or
+    dropped: the feeds must not depend on the query plans).
+
+    Args
+        conn: sqlite3 connection to a database with a materialized feeds table.
+        user_ids: users to check (default: every user).
+
+    Returns:
+        The (user_id, filter_following) pairs whose feed differs from recommend().
+    """
+    if user_ids is None:
+        user_ids = [row[0] for row in conn.execute("SELECT DISTINCT id FROM users ORDER BY id")]
+    # the n of materialize_feeds
+    k = conn.execute("SELECT COALESCE(MAX(rank) + 1, 5) FROM feeds").fetchone()[0]
+    mismatches = []
+    for user_id in user_ids:
+        for filter_following in (0, 1):
+            expected = [post['id'] for post in recommend(conn, user_id, filter_following, k=k)]
+            if [post['id'] for post in feed(conn, user_id, filter_following)] != expected:
+                mismatches.append((user_id, filter_following))
+    return mismatches
+
+
+def check_cache(conn, edits=10):
+    """
+    Compares RecommendationCache (with a PostIndex) with the scan path of recommend() for every
+    user, before and after editing posts, on an in-memory copy of the database: the cache must
+    drop the entries an edit affects and recompute them from the new content.
+
+    Args
+        conn: sqlite3 connection to database.sqlite (not modified).
+        edits: number of served posts whose content is replaced (it is copied to the oldest
+            posts, which then match the keywords instead).
+
+    Returns:
+        The (user_id, filter_following) pairs whose cached feed differs from recommend().
+    """
+    copy = sqlite3.connect(":memory:")
+    conn.backup(copy)
+    ensure_feed_indexes(copy)
+    cache = RecommendationCache(copy, index=PostIndex.build(copy))
+    keys = [(row[0], filter_following) for row in copy.execute("SELECT id FROM users ORDER BY id")
+            for filter_following in (False, True)]
+
+    def mismatches():
+        return {key for key in keys
+                if [post['id'] for post in cache.recommend(*key)] != [post['id'] for post in recommend(copy, *key)]}
+
+    try:
+        before = mismatches()
+        served = list(dict.fromkeys(post['id'] for key in keys for post in cache.recommend(*key)))[:edits]
+        oldest = [row[0] for row in copy.execute("SELECT id FROM posts ORDER BY created_at, id LIMIT ?", (edits,))]
+        with copy:
+            for post_id, old_id in zip(served, oldest):
+                copy.execute("UPDATE posts SET content = (SELECT content FROM posts WHERE id = ?) WHERE id = ?",
+                             (post_id, old_id))
+                copy.execute("UPDATE posts SET content = 'edited' WHERE id = ?", (post_id,))
+        return sorted(before | mismatches())
+    finally:
+        cache.close()
+        copy.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the recommendation feed of every user into the feeds table")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--n", type=int, default=5, help="posts per feed")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--check", action="store_true",
+                        help="compare every feed with recommend() afterwards, and the cache after post edits")
+    args = parser.parse_args()
+
+    users, seconds = materialize_feeds(args.db, n=args.n, workers=args.workers)
+    print(f"{users} users, {2 * users} feeds in {seconds:.2f}s ({users / seconds:,.0f} users/s)")
+    if args.check:
+        conn = sqlite3.connect(args.db)
+        mismatches = check_feeds(conn)
+        print(f"{len(mismatches)} feeds differ from recommend()" + (f": {mismatches[:10]}" if mismatches else ""))
+        stale = check_cache(conn)
+        conn.close()
+        print(f"{len(stale)} cached feeds differ from recommend() after post edits"
+              + (f": {stale[:10]}" if stale else ""))
+        if mismatches or stale:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
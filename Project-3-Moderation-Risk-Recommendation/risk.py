@@ -0,0 +1,543 @@
+# =========================
+# Bulk User Risk Analysis (Exercise 3.2, set-based)
+# =========================
+# user_risk_analysis(u, cur) runs two "SELECT ... WHERE user_id=?" queries per user on tables
+# without an index on user_id, so scoring every user scans posts and comments once per user.
+# score_all_users reads users, posts and comments once, moderates every distinct text once and
+# computes the same per-user numbers with grouped pandas aggregation.
+import argparse
+import datetime as dt
+import os
+import pathlib
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from moderation import ModerationEngine
+
+
+RISK_COLUMNS = [
+    "user_id", "username", "profile_score", "avg_post_score", "avg_comment_score",
+    "recent_violation_boost", "content_risk_score", "age_multiplier", "final_user_risk",
+]
+
+
+# =========================
+# Timestamps and the analysis clock
+# =========================
+# created_at values are parsed once, when a table is loaded, into integer epoch seconds
+# (created_epoch). Every window test is then an integer comparison against one `now`:
+# "now - t < days" <=> t > _newer_than(now_us, days).
+
+_SECOND_US = 1_000_000
+_DAY_US = 86_400 * _SECOND_US
+# the loaders of the scoring, {where} filters the rows (a shard, or the rows above a watermark);
+# schema_optimization.py imports these names to check their plans
+USERS_QUERY = "SELECT rowid AS row_id, id AS user_id, username, created_at, profile FROM users {where} ORDER BY rowid"
+CONTENT_QUERY = "SELECT user_id, content, created_at FROM {table} {where}"
+NEW_CONTENT_QUERY = "SELECT rowid AS row_id, user_id, content, created_at FROM {table} WHERE rowid > ? ORDER BY rowid"
+SHARD_WHERE = "WHERE {} BETWEEN ? AND ?"
+
+_CANONICAL_TIMESTAMP = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}( [0-9]{2}:[0-9]{2}:[0-9]{2})?")
+
+
+def parse_timestamp(s):
+    """
+    Same result as _parse_dt ("%Y-%m-%d %H:%M:%S", then "%Y-%m-%d", else None), but the
+    canonical zero-padded forms go through datetime.fromisoformat instead of strptime.
+    """
+    if not s:
+        return None
+    if isinstance(s, str) and _CANONICAL_TIMESTAMP.fullmatch(s):
+        try:
+            return dt.datetime.fromisoformat(s)
+        except ValueError:
+            return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return dt.datetime.strptime(s, fmt)
+        except (ValueError, TypeError):
+            continue
+    return None
+
+
+def parse_timestamps(values):
+    """
+    Vectorized version of _parse_dt: "%Y-%m-%d %H:%M:%S" first, then "%Y-%m-%d".
+    Anything else (or a missing value) becomes NaT.
+    """
+    values = pd.Series(values, dtype=object)
+    parsed = pd.to_datetime(values, format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    # pandas rolls seconds 60/61 over into the next minute, strptime rejects them
+    leap = values.str.contains(r":6[01]$", na=False)
+    parsed[leap] = pd.NaT
+    missing = parsed.isna() & values.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(values[missing], format="%Y-%m-%d", errors="coerce")
+    return parsed
+
+
+def epoch_seconds(values):
+    """created_at strings as nullable Int64 epoch seconds (naive = UTC), <NA> where _parse_dt gives None."""
+    parsed = parse_timestamps(values)
+    seconds = pd.Series(parsed.to_numpy().astype("datetime64[s]").astype(np.int64), index=parsed.index)
+    return seconds.astype("Int64").mask(parsed.isna())
+
+
+def analysis_now():
+    """
+    The default "now" of the risk analysis: the RISK_NOW environment variable if it is set
+    ("YYYY-MM-DD HH:MM:SS" or "YYYY-MM-DD", UTC), otherwise the current UTC time (naive, like the
+    stored timestamps). Pin RISK_NOW to make runs reproducible.
+    """
+    pinned = os.environ.get("RISK_NOW")
+    if pinned:
+        now = parse_timestamp(pinned)
+        if now is None:
+            raise ValueError(f"RISK_NOW is not a timestamp: {pinned!r}")
+        return now
+    return dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+
+
+def _now_us(now):
+    """`now` (naive UTC datetime) as integer epoch microseconds, so no precision is lost."""
+    now = pd.Timestamp(now)
+    return int((now - pd.Timestamp(0)) // pd.Timedelta(microseconds=1))
+
+
+def _newer_than(now_us, days):
+    """
+    Epoch second t is "newer than `days` days before now" (now - t < days) iff t > this value.
+    Timestamps have whole seconds, so the exact comparison is t > floor((now - days) in seconds).
+    """
+    return (now_us - days * _DAY_US) // _SECOND_US
+
+
+def _recent(epochs, now_us, days):
+    """Boolean mask of the epochs newer than `days` days before now (<NA> -> False)."""
+    return (epochs > _newer_than(now_us, days)).fillna(False).astype(bool)
+
+
+def load_users(conn, where="", params=()):
+    """The users columns the risk analysis needs, in table order (optionally filtered), plus created_epoch."""
+    users = pd.read_sql_query(USERS_QUERY.format(where=where), conn, params=params)
+    users["created_epoch"] = epoch_seconds(users["created_at"])
+    return users
+
+
+def load_content(conn, where="", params=()):
+    """All posts and comments as one DataFrame (user_id, content, created_at, kind, created_epoch)."""
+    posts = pd.read_sql_query(CONTENT_QUERY.format(table="posts", where=where), conn, params=params)
+    comments = pd.read_sql_query(CONTENT_QUERY.format(table="comments", where=where), conn, params=params)
+    posts["kind"] = "post"
+    comments["kind"] = "comment"
+    items = pd.concat([posts, comments], ignore_index=True)
+    items["created_epoch"] = epoch_seconds(items["created_at"])
+    return items
+
+
+def _stored_epochs(snapshot, table):
+    """created_at of a snapshot table as nullable Int64 epoch seconds (NaT -> <NA>)."""
+    seconds = pd.Series(np.asarray(snapshot.array(table, "created_at")))
+    return seconds.astype("Int64").mask(seconds == np.iinfo(np.int64).min)
+
+
+def load_snapshot(snapshot):
+    """
+    load_users() and load_content() from a columnar snapshot (snapshot.py in the repository root):
+    created_epoch is the stored epoch column, so nothing is parsed; created_at is datetime64.
+    """
+    users = snapshot.frame("users", ["rowid", "id", "username", "created_at", "profile"])
+    users = users.rename(columns={"rowid": "row_id", "id": "user_id"})
+    users["created_epoch"] = _stored_epochs(snapshot, "users")
+    parts = []
+    for table, kind in (("posts", "post"), ("comments", "comment")):
+        part = snapshot.frame(table, ["user_id", "content", "created_at"])
+        part["kind"] = kind
+        part["created_epoch"] = _stored_epochs(snapshot, table)
+        parts.append(part)
+    return users, pd.concat(parts, ignore_index=True)
+
+
+# =========================
+# Set-based scoring
+# =========================
+
+def _is_filled(values):
+    """Same test as `if c:` in user_risk_analysis, for a column of strings."""
+    return values.map(lambda v: bool(v) and not (isinstance(v, float) and np.isnan(v))).astype(bool)
+
+
+def _round2(values):
+    # Python's round() (not numpy's) so the values are identical to user_risk_analysis
+    return values.map(lambda v: round(float(v), 2))
+
+
+def score_all_users(conn, moderator, now=None, lookback_days=14, workers=1, snapshot=None):
+    """
+    Args
+        conn: sqlite3 connection to database.sqlite.
+        moderator: a ModerationEngine or ModerationCache (anything with moderate_many).
+        now: the "current" time for the recent window and the account age (default: analysis_now()).
+        lookback_days: length of the Recent Violation Boost window.
+        workers: worker processes used to moderate the texts.
+        snapshot: a snapshot.Snapshot to read users, posts and comments from instead of conn.
+
+    Returns:
+        A DataFrame with one row per user and the same columns and values as
+        pd.DataFrame([user_risk_analysis(u, cursor) for u in users]).
+    """
+    if now is None:
+        now = analysis_now()
+    with stage("risk.load") as st:
+        users, items = load_snapshot(snapshot) if snapshot is not None else (load_users(conn), load_content(conn))
+        st.rows = len(users) + len(items)
+    with stage("risk.score"):
+        return _score_users(users, items, moderator, now, lookback_days, workers)
+
+
+def _score_users(users, items, moderator, now, lookback_days, workers=1):
+    """score_all_users on already loaded users/items; the result keeps the index of `users`."""
+    now_us = _now_us(now)
+    items = items[_is_filled(items["content"])].reset_index(drop=True)
+    profiles = users["profile"].where(_is_filled(users["profile"]))
+
+    # every distinct text is moderated once
+    texts = pd.unique(pd.concat([items["content"], profiles.dropna()], ignore_index=True))
+    with stage("risk.moderate") as st:
+        _, scores = moderator.moderate_many(list(texts), workers=workers)
+        st.rows = len(texts)
+    score_of = pd.Series(scores, index=texts)
+    items["score"] = items["content"].map(score_of).to_numpy(dtype=np.float64)
+
+    # avg_post / avg_comment per user
+    averages = items.groupby(["user_id", "kind"])["score"].mean().unstack("kind")
+    avg_post = users["user_id"].map(averages.get("post", pd.Series(dtype=float))).fillna(0.0)
+    avg_comment = users["user_id"].map(averages.get("comment", pd.Series(dtype=float))).fillna(0.0)
+    profile_score = profiles.map(score_of).fillna(0.0).astype(np.float64)
+
+    # Recent Violation Boost: (now - created).days <= lookback_days  <=>  now - created < lookback_days + 1 days
+    recent = _recent(items["created_epoch"], now_us, lookback_days + 1)
+    flagged = items[recent & (items["score"] > 0)].groupby("user_id").size()
+    flagged_recent = users["user_id"].map(flagged).fillna(0).astype(np.int64)
+    recent_boost = np.minimum(1.0, 0.2 * flagged_recent)
+
+    content_risk = (profile_score * 1.0) + (avg_post * 3.0) + (avg_comment * 1.0)
+    content_risk = content_risk + recent_boost
+
+    # Age multiplier: days_old < 7 -> 1.5, < 30 -> 1.2, otherwise (or unknown) 1.0
+    created = users["created_epoch"]
+    age_multiplier = np.select(
+        [_recent(created, now_us, 7), _recent(created, now_us, 30)], [1.5, 1.2], default=1.0)
+
+    final_risk = np.minimum(5.0, content_risk * age_multiplier)
+
+    return pd.DataFrame({
+        "user_id": users["user_id"],
+        "username": users["username"],
+        "profile_score": _round2(profile_score),
+        "avg_post_score": _round2(avg_post),
+        "avg_comment_score": _round2(avg_comment),
+        "recent_violation_boost": _round2(recent_boost),
+        "content_risk_score": _round2(content_risk),
+        "age_multiplier": age_multiplier,
+        "final_user_risk": _round2(final_risk),
+    }, columns=RISK_COLUMNS)
+
+
+def rank_users(results):
+    """The ranking the Project 3 top-5 report prints: highest final risk, then content risk."""
+    return results.sort_values(["final_user_risk", "content_risk_score"],
+                               ascending=[False, False]).reset_index(drop=True)
+
+
+# =========================
+# Incremental User Risk
+# =========================
+# Between two runs only a few posts and comments are added, but score_all_users still starts
+# from scratch. IncrementalRiskScorer keeps per-user running sums and counts of post/comment
+# scores in database.sqlite and only reads rows above a stored rowid watermark. Flagged items
+# (score > 0) are kept with their timestamp so the Recent Violation Boost window can move with
+# "now"; items that fell out of the window are deleted. posts, comments and users are treated as
+# append-only: edits or deletes of already ingested rows are not picked up.
+
+class IncrementalRiskScorer:
+    """
+    Args
+        conn: sqlite3 connection to database.sqlite, the risk_* state tables are created there.
+        moderator: a ModerationEngine or ModerationCache (anything with moderate_many).
+        lookback_days: length of the Recent Violation Boost window.
+
+    refresh() ingests the new rows, user_risk()/final_user_risk() read one user in O(1) and
+    results() returns the same DataFrame as score_all_users for the same data and "now".
+    """
+
+    def __init__(self, conn, moderator, lookback_days=14):
+        self.conn = conn
+        self.moderator = moderator
+        self.lookback_days = lookback_days
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS risk_watermarks (
+                table_name TEXT PRIMARY KEY,
+                last_rowid INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS risk_state (
+                user_id         INTEGER PRIMARY KEY,
+                user_rowid      INTEGER,             -- NULL until the users row was ingested
+                username        TEXT,
+                account_created INTEGER,             -- epoch seconds, NULL if unknown
+                profile_score   REAL    NOT NULL DEFAULT 0.0,
+                post_sum        REAL    NOT NULL DEFAULT 0.0,
+                post_count      INTEGER NOT NULL DEFAULT 0,
+                comment_sum     REAL    NOT NULL DEFAULT 0.0,
+                comment_count   INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS risk_recent_violations (
+                user_id    INTEGER NOT NULL,
+                created_at INTEGER NOT NULL          -- epoch seconds
+            );
+            CREATE INDEX IF NOT EXISTS idx_risk_recent_user
+                ON risk_recent_violations (user_id, created_at);
+            CREATE INDEX IF NOT EXISTS idx_risk_recent_created
+                ON risk_recent_violations (created_at);
+        """)
+        conn.commit()
+
+    def _watermark(self, table):
+        row = self.conn.execute("SELECT last_rowid FROM risk_watermarks WHERE table_name=?", (table,)).fetchone()
+        return row[0] if row else 0
+
+    def refresh(self, now=None, workers=1):
+        """
+        Ingests users, posts and comments rows above the watermarks and expires flagged items
+        that are outside the window at `now`. Everything is written in one transaction.
+        Returns the number of new posts + comments.
+        """
+        if now is None:
+            now = analysis_now()
+        keep_after = _newer_than(_now_us(now), self.lookback_days + 1)
+
+        users = load_users(self.conn, "WHERE rowid > ?", (self._watermark("users"),))
+        new_items = []
+        for table, kind in (("posts", "post"), ("comments", "comment")):
+            rows = pd.read_sql_query(NEW_CONTENT_QUERY.format(table=table), self.conn,
+                                     params=(self._watermark(table),))
+            rows["kind"] = kind
+            rows["table"] = table
+            rows["created_epoch"] = epoch_seconds(rows["created_at"])
+            new_items.append(rows)
+        items = pd.concat(new_items, ignore_index=True)
+
+        watermarks = {"users": int(users["row_id"].max()) if len(users) else None}
+        for table in ("posts", "comments"):
+            rowids = items.loc[items["table"] == table, "row_id"]
+            watermarks[table] = int(rowids.max()) if len(rowids) else None
+
+        items = items[_is_filled(items["content"])].reset_index(drop=True)
+        profiles = users["profile"].where(_is_filled(users["profile"]))
+        texts = pd.unique(pd.concat([items["content"], profiles.dropna()], ignore_index=True))
+        score_of = pd.Series(dtype=np.float64)
+        if len(texts):
+            _, scores = self.moderator.moderate_many(list(texts), workers=workers)
+            score_of = pd.Series(scores, index=texts)
+        items["score"] = items["content"].map(score_of).to_numpy(dtype=np.float64)
+
+        # per-user [post_sum, post_count, comment_sum, comment_count] of the new rows
+        totals = {}
+        for user_id, kind, score in zip(items["user_id"], items["kind"], items["score"]):
+            t = totals.setdefault(int(user_id), [0.0, 0, 0.0, 0])
+            i = 0 if kind == "post" else 2
+            t[i] += float(score)
+            t[i + 1] += 1
+        deltas = [(user_id, *t) for user_id, t in totals.items()]
+
+        flagged = items[(items["score"] > 0) & (items["created_epoch"] > keep_after).fillna(False).astype(bool)]
+        recent = [(int(u), int(c)) for u, c in zip(flagged["user_id"], flagged["created_epoch"])]
+
+        user_rows = [
+            (int(u), int(rowid), name, None if pd.isna(created) else int(created),
+             float(score_of[p]) if isinstance(p, str) else 0.0)
+            for rowid, u, name, created, p in zip(users["row_id"], users["user_id"], users["username"],
+                                                 users["created_epoch"], profiles)
+        ]
+
+        with self.conn:
+            self.conn.executemany("""
+                INSERT INTO risk_state (user_id, post_sum, post_count, comment_sum, comment_count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    post_sum = post_sum + excluded.post_sum,
+                    post_count = post_count + excluded.post_count,
+                    comment_sum = comment_sum + excluded.comment_sum,
+                    comment_count = comment_count + excluded.comment_count
+            """, deltas)
+            self.conn.executemany("""
+                INSERT INTO risk_state (user_id, user_rowid, username, account_created, profile_score)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    user_rowid = COALESCE(user_rowid, excluded.user_rowid),
+                    username = excluded.username,
+                    account_created = excluded.account_created,
+                    profile_score = excluded.profile_score
+            """, user_rows)
+            self.conn.executemany("INSERT INTO risk_recent_violations VALUES (?, ?)", recent)
+            self.conn.execute("DELETE FROM risk_recent_violations WHERE created_at <= ?", (keep_after,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO risk_watermarks VALUES (?, ?)",
+                [(table, rowid) for table, rowid in watermarks.items() if rowid is not None])
+        return len(items)
+
+    def _row(self, state, flagged_recent, now_us):
+        """The user_risk_analysis dict from one risk_state row."""
+        (user_id, username, account_created, profile_score,
+         post_sum, post_count, comment_sum, comment_count) = state
+        avg_post = post_sum / post_count if post_count else 0.0
+        avg_comment = comment_sum / comment_count if comment_count else 0.0
+
+        content_risk = (profile_score * 1.0) + (avg_post * 3.0) + (avg_comment * 1.0)
+        recent_boost = min(1.0, 0.2 * flagged_recent)
+        content_risk += recent_boost
+
+        age_multiplier = 1.0
+        if account_created is not None:
+            if account_created > _newer_than(now_us, 7):
+                age_multiplier = 1.5
+            elif account_created > _newer_than(now_us, 30):
+                age_multiplier = 1.2
+
+        final_risk = min(5.0, content_risk * age_multiplier)
+        return {
+            "user_id": user_id,
+            "username": username,
+            "profile_score": round(profile_score, 2),
+            "avg_post_score": round(avg_post, 2),
+            "avg_comment_score": round(avg_comment, 2),
+            "recent_violation_boost": round(recent_boost, 2),
+            "content_risk_score": round(content_risk, 2),
+            "age_multiplier": age_multiplier,
+            "final_user_risk": round(final_risk, 2),
+        }
+
+    _STATE_COLUMNS = ("user_id, username, account_created, profile_score, "
+                      "post_sum, post_count, comment_sum, comment_count")
+
+    def user_risk(self, user_id, now=None):
+        """The user_risk_analysis dict of one user: a primary-key lookup plus an index range count."""
+        if now is None:
+            now = analysis_now()
+        now_us = _now_us(now)
+        state = self.conn.execute(
+            f"SELECT {self._STATE_COLUMNS} FROM risk_state WHERE user_id=?", (user_id,)).fetchone()
+        if state is None:
+            return None
+        flagged_recent = self.conn.execute(
+            "SELECT COUNT(*) FROM risk_recent_violations WHERE user_id=? AND created_at > ?",
+            (user_id, _newer_than(now_us, self.lookback_days + 1))).fetchone()[0]
+        return self._row(state, flagged_recent, now_us)
+
+    def final_user_risk(self, user_id, now=None):
+        row = self.user_risk(user_id, now)
+        return row["final_user_risk"] if row else None
+
+    def results(self, now=None):
+        """All users (in users table order), the same DataFrame as score_all_users."""
+        if now is None:
+            now = analysis_now()
+        now_us = _now_us(now)
+        flagged = dict(self.conn.execute(
+            "SELECT user_id, COUNT(*) FROM risk_recent_violations WHERE created_at > ? GROUP BY user_id",
+            (_newer_than(now_us, self.lookback_days + 1),)))
+        states = self.conn.execute(
+            f"SELECT {self._STATE_COLUMNS} FROM risk_state WHERE user_rowid IS NOT NULL ORDER BY user_rowid")
+        return pd.DataFrame([self._row(s, flagged.get(s[0], 0), now_us) for s in states], columns=RISK_COLUMNS)
+
+
+# =========================
+# Sharded Risk Scoring
+# =========================
+# For a large user base one process and one cursor are the limit. score_users_sharded splits the
+# users into user_id ranges and scores every range in its own process; each worker opens its own
+# read-only connection (mode=ro URI) to database.sqlite and its own ModerationEngine.
+
+_shard_conn = None
+_shard_engine = None
+
+
+def _init_shard_worker(db_path, rules):
+    global _shard_conn, _shard_engine
+    _shard_conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    _shard_engine = ModerationEngine(**rules)
+
+
+def _score_shard(task):
+    low, high, now, lookback_days = task
+    users = load_users(_shard_conn, SHARD_WHERE.format("id"), (low, high))
+    items = load_content(_shard_conn, SHARD_WHERE.format("user_id"), (low, high))
+    results = _score_users(users, items, _shard_engine, now, lookback_days)
+    results.index = users["row_id"]
+    return results
+
+
+def user_id_shards(conn, shards):
+    """Splits the distinct user ids into at most `shards` contiguous (low, high) ranges of similar size."""
+    ids = [row[0] for row in conn.execute("SELECT DISTINCT id FROM users ORDER BY id")]
+    shards = max(1, min(shards, len(ids)))
+    bounds = []
+    for i in range(shards):
+        part = ids[len(ids) * i // shards: len(ids) * (i + 1) // shards]
+        if part:
+            bounds.append((part[0], part[-1]))
+    return bounds
+
+
+def score_users_sharded(db_path, rules, workers=None, now=None, lookback_days=14):
+    """
+    Args
+        db_path: path of database.sqlite (opened read-only by every worker).
+        rules: the moderation rule lists (ModerationEngine.rules()).
+        workers: maximum number of worker processes (default: all cores).
+        now: the single "current" time every shard uses (default: analysis_now()).
+        lookback_days: length of the Recent Violation Boost window.
+
+    Returns:
+        The same DataFrame as score_all_users (users in table order).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if now is None:
+        now = analysis_now()
+    conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        shards = user_id_shards(conn, workers)
+    finally:
+        conn.close()
+
+    tasks = [(low, high, now, lookback_days) for low, high in shards]
+    with ProcessPoolExecutor(max_workers=max(1, len(tasks)), initializer=_init_shard_worker,
+                             initargs=(os.path.abspath(db_path), rules)) as pool:
+        parts = list(pool.map(_score_shard, tasks))
+    if not parts:
+        return pd.DataFrame(columns=RISK_COLUMNS)
+    return pd.concat(parts).sort_index().reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score every user in parallel and print the highest-risk users")
+    parser.add_argument("--rules", required=True, help="JSON file with tier1_words, tier2_phrases, tier3_words")
+    parser.add_argument("--db", default="database.sqlite")
+    parser.add_argument("--workers", type=int, default=None, help="maximum number of worker processes")
+    parser.add_argument("--lookback-days", type=int, default=14)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    rules = ModerationEngine.from_json(args.rules).rules()
+    results = score_users_sharded(args.db, rules, workers=args.workers, lookback_days=args.lookback_days)
+    print(rank_users(results).head(args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# =========================
+# TF-IDF Recommendation Scoring
+# =========================
+# recommend() ranks by a yes/no keyword match and then by recency. TfidfRanker scores posts by
+# similarity instead: posts.content becomes a sparse TF-IDF matrix X (scipy.sparse CSR, one
+# L2-normalized row per post), a user is the normalized sum of the rows of the posts they liked,
+# and the scores of every post are one sparse matrix-vector product X @ profile. The scores stay
+# sparse: only posts that share a word with the profile have one, so own posts, already liked
+# posts and (with filter_following) posts of users that are not followed are masked out of
+# those candidates only and the top k are selected with argpartition.
+#
+# top_k_many() scores a batch of users at once: the profiles are the sparse product
+# reactions (users x posts) @ X and the scores of a chunk of users one sparse matrix-matrix
+# product with X.T, read row by row from the CSR result (never a dense users x posts array).
+#
+# Words are the same as for the keyword matcher (lowercased \w+ words longer than 2 characters
+# that are not stop words); idf is the smoothed log((1 + n) / (1 + df)) + 1.
+#
+# refresh() appends rows for new posts, weighted with the idf of the current document
+# frequencies; the rows already in X keep the idf they were weighted with. X is rebuilt when
+# that idf has drifted (mean absolute change over the vocabulary above max_idf_drift), when
+# the new words exceed max_new_terms of the vocabulary, or when posts were deleted.
+import collections
+
+import numpy as np
+import scipy.sparse as sp
+
+from recommendation import POST_COLUMNS, STOP_WORDS, WORD_PATTERN, _rows
+
+
+def tokenize(content):
+    return [w for w in WORD_PATTERN.findall((content or "").lower()) if w not in STOP_WORDS and len(w) > 2]
+
+
+def _normalize_rows(matrix):
+    """L2-normalizes the rows of a CSR matrix (all-zero rows stay zero)."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sp.diags(1.0 / norms) @ matrix
+
+
+class TfidfRanker:
+    """
+    post_ids: ids of all posts (ascending), row i of `matrix` is post post_ids[i].
+    authors: author user id per row (-1 for posts whose author is not in users; those are never
+    recommended, like in the users join of recommend()).
+    recency: rank of every row in "created_at DESC, id" order (0 = newest), used for ties.
+    df: document frequency of every word, idf: the idf the matrix rows were built with.
+    max_idf_drift / max_new_terms: the rebuild thresholds of refresh().
+    """
+
+    _POSTS = """
+        SELECT p.id, p.content, p.created_at, COALESCE(u.id, -1)
+        FROM posts p LEFT JOIN users u ON p.user_id = u.id
+        {where} ORDER BY p.id
+    """
+
+    def __init__(self, conn, max_idf_drift=0.05, max_new_terms=0.05):
+        self.conn = conn
+        self.max_idf_drift = max_idf_drift
+        self.max_new_terms = max_new_terms
+        self._build()
+
+    def _build(self):
+        rows = self.conn.execute(self._POSTS.format(where="")).fetchall()
+        self.post_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.authors = np.array([r[3] for r in rows], dtype=np.int64)
+        self.created_at = [r[2] for r in rows]
+        self._rank_recency()
+
+        self.vocabulary = {}
+        tf = self._term_counts(rows)
+        self.df = np.bincount(tf.indices, minlength=len(self.vocabulary))
+        self.idf = self._current_idf()
+        self.matrix = _normalize_rows(tf @ sp.diags(self.idf)).tocsr()
+        self.last_id = int(self.post_ids[-1]) if len(rows) else 0
+
+    def _rank_recency(self):
+        ids, created = self.post_ids, self.created_at
+        newest_first = sorted(range(len(ids)), key=lambda i: (created[i], -ids[i]), reverse=True)
+        self.recency = np.empty(len(ids), dtype=np.int64)
+        self.recency[newest_first] = np.arange(len(ids))
+
+    def _term_counts(self, rows):
+        """CSR matrix of the word counts of the rows (words missing from the vocabulary are added)."""
+        indptr, indices, counts = [0], [], []
+        for _, content, _, _ in rows:
+            tf = collections.Counter(self.vocabulary.setdefault(w, len(self.vocabulary)) for w in tokenize(content))
+            indices.extend(tf.keys())
+            counts.extend(tf.values())
+            indptr.append(len(indices))
+        return sp.csr_matrix((np.array(counts, dtype=np.float64), np.array(indices, dtype=np.int64), indptr),
+                             shape=(len(rows), len(self.vocabulary)))
+
+    def _current_idf(self):
+        return np.log((1 + len(self.post_ids)) / (1 + self.df)) + 1.0
+
+    def refresh(self):
+        """
+        Appends the posts added since the last refresh, or rebuilds the matrix (see the module
+        comment). Returns "appended", "rebuilt" or None when nothing changed.
+        """
+        last_id, count = self.conn.execute("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM posts").fetchone()
+        if last_id == self.last_id and count == len(self.post_ids):
+            return None
+        rows = self.conn.execute(self._POSTS.format(where="WHERE p.id > ?"), (self.last_id,)).fetchall()
+        if count != len(self.post_ids) + len(rows):
+            # posts were deleted: the rows and the document frequencies are stale
+            self._build()
+            return "rebuilt"
+
+        built_terms = len(self.idf)
+        tf = self._term_counts(rows)
+        self.post_ids = np.concatenate([self.post_ids, np.array([r[0] for r in rows], dtype=np.int64)])
+        self.authors = np.concatenate([self.authors, np.array([r[3] for r in rows], dtype=np.int64)])
+        self.created_at.extend(r[2] for r in rows)
+        self.last_id = int(self.post_ids[-1])
+        self.df = np.concatenate([self.df, np.zeros(len(self.vocabulary) - len(self.df), dtype=self.df.dtype)])
+        self.df += np.bincount(tf.indices, minlength=len(self.vocabulary))
+        idf = self._current_idf()
+        drift = np.abs(idf[:built_terms] - self.idf).mean() if built_terms else np.inf
+        if drift > self.max_idf_drift or len(self.vocabulary) - built_terms > self.max_new_terms * built_terms:
+            self._build()
+            return "rebuilt"
+
+        # the old rows keep their weights; the new words get the current idf
+        self.idf = np.concatenate([self.idf, idf[built_terms:]])
+        self.matrix.resize((self.matrix.shape[0], len(self.vocabulary)))
+        self.matrix = sp.vstack([self.matrix, _normalize_rows(tf @ sp.diags(idf))]).tocsr()
+        self._rank_recency()
+        return "appended"
+
+    def _rows_of(self, post_ids):
+        """Matrix rows of the given post ids (ids that are not in posts are dropped)."""
+        post_ids = np.asarray(post_ids, dtype=np.int64)
+        pos = np.searchsorted(self.post_ids, post_ids)
+        pos = np.minimum(pos, max(len(self.post_ids) - 1, 0))
+        return pos[self.post_ids[pos] == post_ids] if len(self.post_ids) else pos[:0]
+
+    def _liked(self, user_ids):
+        """Sparse users x posts matrix of reaction counts, and whether each user has a liked post."""
+        index = {u: i for i, u in enumerate(user_ids)}
+        marks = ",".join("?" * len(user_ids))
+        reactions = self.conn.execute(
+            f"SELECT user_id, post_id FROM reactions WHERE user_id IN ({marks})", tuple(user_ids)).fetchall()
+        users = np.array([index[u] for u, _ in reactions], dtype=np.int64)
+        posts = np.array([p for _, p in reactions], dtype=np.int64)
+        rows = np.searchsorted(self.post_ids, posts)
+        rows = np.minimum(rows, max(len(self.post_ids) - 1, 0))
+        found = self.post_ids[rows] == posts if len(self.post_ids) else np.zeros(len(posts), dtype=bool)
+        liked = sp.csr_matrix((np.ones(found.sum()), (users[found], rows[found])),
+                              shape=(len(user_ids), len(self.post_ids)))
+        return liked, np.asarray(liked.sum(axis=1)).ravel() > 0
+
+    def _select(self, rows, scores, user_id, liked_rows, k, followees=None):
+        """
+        The k best of the scored rows (the nonzero entries of a sparse score row): score DESC,
+        then newest; only rows with score > 0 that may be recommended to user_id.
+        Returns (rows, scores).
+        """
+        authors = self.authors[rows]
+        keep = (scores > 0) & (authors != user_id) & (authors != -1) & ~np.isin(rows, liked_rows)
+        if followees is not None:
+            keep &= np.isin(authors, np.fromiter(followees, dtype=np.int64))
+        rows, scores = rows[keep], scores[keep]
+        if len(rows) > k:
+            # every row tied with the k-th best score stays a candidate, recency decides
+            keep = scores >= scores[np.argpartition(-scores, k - 1)[:k]].min()
+            rows, scores = rows[keep], scores[keep]
+        order = np.lexsort((self.recency[rows], -scores))[:k]
+        return rows[order], scores[order]
+
+    def _newest(self, user_id, k):
+        """Fallback for users without likes: the k newest posts not written by the user."""
+        mask = (self.authors != user_id) & (self.authors != -1)
+        candidates = np.flatnonzero(mask)
+        return candidates[np.argsort(self.recency[candidates], kind="stable")[:k]]
+
+    def top_k(self, user_id, filter_following=False, k=5, graph=None):
+        """
+        [(post_id, score)] of the k most similar posts for one user (score 0.0 for the newest-post
+        fallback of users without likes). graph: optional FollowGraph for filter_following.
+        """
+        liked, has_likes = self._liked([user_id])
+        if not has_likes[0]:
+            return [(int(self.post_ids[i]), 0.0) for i in self._newest(user_id, k)]
+        profile = _normalize_rows(liked @ self.matrix)
+        scores = (self.matrix @ profile.T).tocoo()
+        followees = self._followees(user_id, graph) if filter_following else None
+        rows, best = self._select(scores.row.astype(np.int64), scores.data, user_id, liked.indices, k, followees)
+        return [(int(self.post_ids[i]), float(score)) for i, score in zip(rows, best)]
+
+    def top_k_many(self, user_ids, filter_following=False, k=5, graph=None, chunk_size=256):
+        """{user_id: [(post_id, score)]} for many users, one sparse matrix product per chunk of users."""
+        results = {}
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            liked, has_likes = self._liked(chunk)
+            profiles = _normalize_rows(liked @ self.matrix)
+            scores = (profiles @ self.matrix.T).tocsr()
+            for i, user_id in enumerate(chunk):
+                if not has_likes[i]:
+                    results[user_id] = [(int(self.post_ids[j]), 0.0) for j in self._newest(user_id, k)]
+                    continue
+                liked_rows = liked.indices[liked.indptr[i]:liked.indptr[i + 1]]
+                followees = self._followees(user_id, graph) if filter_following else None
+                row = slice(scores.indptr[i], scores.indptr[i + 1])
+                rows, best = self._select(scores.indices[row].astype(np.int64), scores.data[row], user_id,
+                                          liked_rows, k, followees)
+                results[user_id] = [(int(self.post_ids[j]), float(score)) for j, score in zip(rows, best)]
+        return results
+
+    def _followees(self, user_id, graph):
+        if graph is not None:
+            graph.refresh(self.conn)
+            return graph.followee_set(user_id)
+        return {row[0] for row in self.conn.execute("SELECT followed_id FROM follows WHERE follower_id = ?", (user_id,))}
+
+
+def recommend_tfidf(conn, ranker, user_id, filter_following, k=5, graph=None):
+    """recommend() ranked by TF-IDF similarity: the rows (sqlite3.Row) of ranker.top_k, best first."""
+    ranker.refresh()
+    ranked = [post_id for post_id, _ in ranker.top_k(user_id, filter_following, k, graph)]
+    if not ranked:
+        return []
+    rows = _rows(conn, f"""
+        SELECT {POST_COLUMNS} FROM posts p JOIN users u ON p.user_id = u.id
+        WHERE p.id IN ({','.join('?' * len(ranked))})
+    """, tuple(ranked))
+    by_id = {row['id']: row for row in rows}
+    return [by_id[post_id] for post_id in ranked if post_id in by_id]
@@ -23,19 +23,31 @@ from gensim.corpora import Dictionary
 from gensim.models.ldamodel import LdaModel
 from gensim.models.coherencemodel import CoherenceModel
 
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # snapshot.py is in the repository root
+from snapshot import from_environment
+
+# With SNAPSHOT_DIR set (export the platform database with python ../snapshot.py --db <database.sqlite> --out snapshot)
+# the posts and comments come from the memory-mapped columnar snapshot instead of the CSV files
+snapshot = from_environment()
+
 CANDIDATE_PATHS = [
     Path("posts.csv"),
     Path("/content/posts.csv"),
     Path("/mnt/data/posts.csv"),  
 ]
-for p in CANDIDATE_PATHS:
-    if p.exists():
-        POSTS_PATH = p
-        break
+if snapshot is not None:
+    posts = snapshot.frame("posts")
 else:
-    raise FileNotFoundError("posts.csv not found. Upload it to Colab workspace or set the correct path.")
+    for p in CANDIDATE_PATHS:
+        if p.exists():
+            POSTS_PATH = p
+            break
+    else:
+        raise FileNotFoundError("posts.csv not found. Upload it to Colab workspace or set the correct path.")
 
-posts = pd.read_csv(POSTS_PATH)
+    posts = pd.read_csv(POSTS_PATH)
 
 #  Basic text cleaning 
 URL_RE = re.compile(r"https?://\S+|www\.\S+")
@@ -236,11 +248,15 @@ def find_path(fname):
             return p
     raise FileNotFoundError(f"{fname} not found. Upload it to Colab or set path.")
 
-posts_path = find_path("posts.csv")
-comments_path = find_path("comments.csv")
+if snapshot is not None:
+    posts = snapshot.frame("posts")
+    comments = snapshot.frame("comments")
+else:
+    posts_path = find_path("posts.csv")
+    comments_path = find_path("comments.csv")
 
-posts = pd.read_csv(posts_path)
-comments = pd.read_csv(comments_path)
+    posts = pd.read_csv(posts_path)
+    comments = pd.read_csv(comments_path)
 
 # 2) Text cleaning & tokenization
 URL_RE = re.compile(r"https?://\S+|www\.\S+")
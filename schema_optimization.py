@@ -0,0 +1,302 @@
+# =========================
+# Schema Optimization – indexes and query-plan checks
+# =========================
+# The database.sqlite files of Projects 1-3 (same schema) ship without indexes, so every filter
+# or join on user_id, post_id, created_at or follower_id in the analysis scripts is a full
+# table scan. This module
+#   - creates the indexes those queries need (covering where the query only reads key columns),
+#   - runs EXPLAIN QUERY PLAN on every analysis query and fails when a step still scans a
+#     table or a whole index,
+#   - prints the time of every query before and after the indexes were created.
+#
+# The queries are the strings the analysis code runs: imported from the modules that run them,
+# or, for the notebook-style analysis scripts, read from their source (script_queries).
+#
+# Queries that have to read every row of a table are marked full_read: the "SELECT *"
+# exploration of Project 1, the spam grouping by content, the bulk loaders of the risk scoring
+# and the aggregates of Project 2 (per post, and per pair of users for 2.4). A scan is the
+# right plan for those and they are only timed. The newest-first reads of recommend() are
+# marked ordered: they walk idx_posts_created_at and stop early.
+#
+# Usage:
+#   python schema_optimization.py                  # all three projects, default database paths
+#   python schema_optimization.py --project 2 --db Project-2-Platform-Growth-Virality-Lifecycle/database.sqlite
+#   python schema_optimization.py --rebuild        # drop the indexes first, so "before" is the bare schema
+#   python schema_optimization.py --check-only     # plans only, no indexes are created
+# Exit status 1 when a query plan has a full table scan.
+import argparse
+import ast
+import collections
+import os
+import re
+import sqlite3
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DATABASES = {
+    "1": os.path.join(HERE, "Project-1-Social-Network-Database-Analysis",
+                      "Project-1-Social-Network-Database-Analysis", "database.sqlite"),
+    "2": os.path.join(HERE, "Project-2-Platform-Growth-Virality-Lifecycle", "database.sqlite"),
+    "3": os.path.join(HERE, "Project-3-Moderation-Risk-Recommendation", "database.sqlite"),
+}
+
+# name -> CREATE INDEX statement. idx_posts_created_at, idx_users_id and idx_follows_follower
+# are the indexes recommendation.ensure_feed_indexes creates in Project 3 (same definitions).
+INDEXES = {
+    "idx_posts_user_id": "CREATE INDEX IF NOT EXISTS idx_posts_user_id ON posts (user_id)",
+    "idx_posts_created_at": "CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts (created_at DESC)",
+    "idx_comments_user_post": "CREATE INDEX IF NOT EXISTS idx_comments_user_post ON comments (user_id, post_id)",
+    "idx_comments_post_created": "CREATE INDEX IF NOT EXISTS idx_comments_post_created ON comments (post_id, created_at)",
+    "idx_comments_created_at": "CREATE INDEX IF NOT EXISTS idx_comments_created_at ON comments (created_at)",
+    "idx_reactions_user_post": "CREATE INDEX IF NOT EXISTS idx_reactions_user_post ON reactions (user_id, post_id)",
+    "idx_reactions_post_id": "CREATE INDEX IF NOT EXISTS idx_reactions_post_id ON reactions (post_id)",
+    "idx_users_id": "CREATE INDEX IF NOT EXISTS idx_users_id ON users (id)",
+    "idx_follows_follower": "CREATE INDEX IF NOT EXISTS idx_follows_follower ON follows (follower_id, followed_id)",
+}
+
+# full_read: the query needs every row of the table, a scan is expected.
+# ordered: the query walks an index in ORDER BY order and stops at the LIMIT (or, in recommend(),
+# at the k-th match), so a scan of that index is expected.
+# params(user_id): the values bound to the ? of the query, for the sample user (see _sample_user)
+AnalysisQuery = collections.namedtuple("AnalysisQuery", "name sql full_read ordered params",
+                                       defaults=(False, False, lambda user_id: ()))
+
+PROJECT_DIRS = {project: os.path.dirname(path) for project, path in DATABASES.items()}
+for _directory in PROJECT_DIRS.values():
+    sys.path.insert(0, _directory)
+
+# the queries are the strings the analysis modules execute, imported from them
+import activity_index  # noqa: E402
+import heavy_hitters  # noqa: E402
+import near_duplicates  # noqa: E402
+import recommendation  # noqa: E402
+import risk  # noqa: E402
+import rollups  # noqa: E402
+import table_profiler  # noqa: E402
+
+
+def script_queries(path):
+    """
+    The SQL literals of an analysis script (the scripts run on import, so they are parsed):
+    {name the statement is assigned to: sql}. A name assigned more than one statement is left
+    out, so looking it up fails instead of checking whichever statement comes last.
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    found = collections.defaultdict(list)
+    assignments = [node for node in ast.walk(tree)
+                   if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)]
+    for node in assignments:
+        for value in ast.walk(node.value):
+            if (isinstance(value, ast.Constant) and isinstance(value.value, str)
+                    and value.value.lstrip().upper().startswith(("SELECT", "WITH"))):
+                found[node.targets[0].id].append(value.value)
+                break
+    return {name: sqls[0] for name, sqls in found.items() if len(sqls) == 1}
+
+
+def _project_queries():
+    p1 = script_queries(os.path.join(PROJECT_DIRS["1"], "project1_analysis.py"))
+    p2 = script_queries(os.path.join(PROJECT_DIRS["2"], "project2_analysis.py"))
+    p3 = script_queries(os.path.join(PROJECT_DIRS["3"], "project3_analysis.py"))
+    following = recommendation._FOLLOWING + recommendation._NEWEST_FIRST
+    return {
+        "1": [
+            *(AnalysisQuery(f"1.1 explore {table}", table_profiler.TABLE_QUERY.format(table=table), full_read=True)
+              for table in table_profiler.TABLES),
+            AnalysisQuery("1.2 activity users", activity_index.USERS_QUERY, params=lambda user_id: (0,)),
+            *(AnalysisQuery(f"1.2 activity {source}",
+                            activity_index.ROWS_QUERY.format(columns=activity_index.COLUMNS[source], source=source),
+                            params=lambda user_id: (0,))
+              for source in activity_index.SOURCES),
+            *(AnalysisQuery(f"1.3 stream {table}", heavy_hitters.STREAM_QUERY.format(columns=columns, table=table),
+                            params=lambda user_id: (0, 10_000))
+              for table, columns in heavy_hitters.STREAM_COLUMNS.items()),
+            AnalysisQuery("1.3 recount comments",
+                          heavy_hitters.RECOUNT_QUERY.format(table="comments", marks="?", window=""),
+                          params=lambda user_id: (user_id,)),
+            AnalysisQuery("1.3 recount comments window",
+                          heavy_hitters.RECOUNT_QUERY.format(table="comments", marks="?",
+                                                             window=heavy_hitters.RECOUNT_WINDOW),
+                          params=lambda user_id: (user_id, "2024-01-01", "2024-02-01")),
+            AnalysisQuery("1.3 recount reactions",
+                          heavy_hitters.RECOUNT_QUERY.format(table="reactions", marks="?", window=""),
+                          params=lambda user_id: (user_id,)),
+            AnalysisQuery("1.3 exact fallback", heavy_hitters.EXACT_QUERY, full_read=True),
+            AnalysisQuery("1.4 spam posts", p1["spam_posts_df"], full_read=True),
+            AnalysisQuery("1.4 spam comments", p1["spam_comments_df"], full_read=True),
+            AnalysisQuery("1.4 near-duplicate scan", near_duplicates.ROWS_QUERY, params=lambda user_id: (0, 0)),
+            *(AnalysisQuery(f"1.4 near-duplicate {table}", near_duplicates.CONTENT_QUERY.format(table=table),
+                            params=lambda user_id: (1,))
+              for table in near_duplicates.SOURCES),
+        ],
+        "2": [
+            *(AnalysisQuery(f"2.1 rollup {source}",
+                            rollups.BUCKET_COUNTS_QUERY.format(timestamp=timestamp, from_clause=from_clause),
+                            params=lambda user_id, source=source: ("month", source, rollups.GRAINS["month"], 0, 2**62))
+              for source, (_, from_clause, timestamp) in rollups.SOURCES.items()),
+            AnalysisQuery("2.2 virality", p2["Being_viral"], full_read=True),
+            AnalysisQuery("2.3 lifecycle", p2["lifecycle_query"], full_read=True),
+            AnalysisQuery("2.4 connections", p2["connections_query"], full_read=True),
+        ],
+        "3": [
+            AnalysisQuery("3.2 risk users", risk.USERS_QUERY.format(where=""), full_read=True),
+            *(AnalysisQuery(f"3.2 risk {table}", risk.CONTENT_QUERY.format(table=table, where=""), full_read=True)
+              for table in ("posts", "comments")),
+            AnalysisQuery("3.2 shard users", risk.USERS_QUERY.format(where=risk.SHARD_WHERE.format("id")),
+                          params=lambda user_id: (user_id, user_id)),
+            *(AnalysisQuery(f"3.2 shard {table}",
+                            risk.CONTENT_QUERY.format(table=table, where=risk.SHARD_WHERE.format("user_id")),
+                            params=lambda user_id: (user_id, user_id))
+              for table in ("posts", "comments")),
+            *(AnalysisQuery(f"3.2 new {table}", risk.NEW_CONTENT_QUERY.format(table=table),
+                            params=lambda user_id: (0,))
+              for table in ("posts", "comments")),
+            AnalysisQuery("3.2 user posts", p3["posts"], params=lambda user_id: (user_id,)),
+            AnalysisQuery("3.2 user comments", p3["comments"], params=lambda user_id: (user_id,)),
+            AnalysisQuery("3.3 liked posts", recommendation.LIKED_POSTS_QUERY, params=lambda user_id: (user_id,)),
+            AnalysisQuery("3.3 liked ids", recommendation.LIKED_IDS_QUERY, params=lambda user_id: (user_id,)),
+            AnalysisQuery("3.3 newest fallback", recommendation.NEWEST_QUERY, ordered=True,
+                          params=lambda user_id: (user_id, 5)),
+            AnalysisQuery("3.3 candidates", recommendation.CANDIDATES_QUERY + recommendation._NEWEST_FIRST,
+                          ordered=True, params=lambda user_id: (user_id,)),
+            AnalysisQuery("3.3 candidates (following)", recommendation.CANDIDATES_QUERY + following,
+                          params=lambda user_id: (user_id, user_id)),
+            AnalysisQuery("3.3 candidates by id",
+                          recommendation.CANDIDATES_BY_ID_QUERY.format(marks="?") + following + " LIMIT ?",
+                          params=lambda user_id: (1, user_id, user_id, 5)),
+            AnalysisQuery("3.3 followees", recommendation.FOLLOWEES_QUERY, params=lambda user_id: (user_id,)),
+        ],
+    }
+
+
+QUERIES = _project_queries()
+
+# a plan step that reads a whole table: "SCAN posts", "SCAN p" (an alias), "SCAN p USING
+# [COVERING] INDEX ..." (every entry of an index is read) or, before SQLite 3.36,
+# "SCAN TABLE posts AS p ..."; SEARCH steps only read the matching range of an index
+_TABLE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(?: |$)")
+_TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+
+
+def _sample_user(conn):
+    """A user that has reactions and follows, bound where a query filters by user."""
+    row = conn.execute("""
+        SELECT r.user_id FROM reactions r JOIN follows f ON f.follower_id = r.user_id
+        GROUP BY r.user_id ORDER BY COUNT(*) DESC LIMIT 1
+    """).fetchone()
+    return row[0] if row else 1
+
+
+def create_indexes(conn):
+    for sql in INDEXES.values():
+        conn.execute(sql)
+    conn.commit()
+
+
+def drop_indexes(conn):
+    for name in INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+
+
+def query_plan(conn, query, user_id):
+    """The detail column of EXPLAIN QUERY PLAN, one string per step."""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query.sql}", query.params(user_id))]
+
+
+def table_scans(conn, query, user_id):
+    """Plan steps that read a whole table or index (scans of subqueries and CTEs are not counted)."""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    aliases = {}
+    for table, alias in _TABLE_REFERENCE.findall(query.sql):
+        if table in tables:
+            aliases[table] = table
+            if alias:
+                aliases[alias] = table
+    scans = []
+    for detail in query_plan(conn, query, user_id):
+        match = _TABLE_SCAN.match(detail.strip())
+        if match and match.group(1) in aliases:
+            scans.append(detail.strip())
+    return scans
+
+
+def time_query(conn, query, user_id, repeat=5):
+    """Best wall time (seconds) of running the query and fetching every row."""
+    params = query.params(user_id)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(query.sql, params).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def optimize(db_path, project, rebuild=False, check_only=False, repeat=5):
+    """
+    Times every query of the project, creates the indexes (unless check_only), times them
+    again and checks the plans. Returns (rows, failures): one dict per query, and the
+    queries that still scan a table.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        user_id = _sample_user(conn)
+        if rebuild and not check_only:
+            drop_indexes(conn)
+        queries = QUERIES[project]
+        before = {q.name: time_query(conn, q, user_id, repeat) for q in queries}
+        if not check_only:
+            create_indexes(conn)
+        rows, failures = [], []
+        for q in queries:
+            scans = table_scans(conn, q, user_id)
+            if scans and not (q.full_read or q.ordered):
+                failures.append((q.name, scans))
+            rows.append({
+                "query": q.name,
+                "before_ms": 1000 * before[q.name],
+                "after_ms": 1000 * time_query(conn, q, user_id, repeat),
+                "plan": ("full read" if q.full_read else "ordered scan" if q.ordered
+                         else "TABLE SCAN" if scans else "indexed"),
+            })
+        return rows, failures
+    finally:
+        conn.close()
+
+
+def print_report(project, db_path, rows, failures):
+    print(f"\nProject {project}: {db_path}")
+    print(f"{'query':<30}{'before ms':>11}{'after ms':>11}{'speedup':>9}  plan")
+    for row in rows:
+        speedup = row["before_ms"] / row["after_ms"] if row["after_ms"] else float("inf")
+        print(f"{row['query']:<30}{row['before_ms']:>11.3f}{row['after_ms']:>11.3f}{speedup:>8.1f}x  {row['plan']}")
+    for name, scans in failures:
+        print(f"FULL TABLE SCAN in {name}: {'; '.join(scans)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create analysis indexes and check the query plans")
+    parser.add_argument("--project", choices=sorted(QUERIES), help="one project (default: all)")
+    parser.add_argument("--db", help="database path (with --project; default: the project's database.sqlite)")
+    parser.add_argument("--rebuild", action="store_true", help="drop the indexes first so 'before' is the bare schema")
+    parser.add_argument("--check-only", action="store_true", help="only check the plans, do not create indexes")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per timing (the best one is reported)")
+    args = parser.parse_args()
+    if args.db and not args.project:
+        parser.error("--db needs --project")
+
+    projects = [args.project] if args.project else sorted(QUERIES)
+    failed = False
+    for project in projects:
+        db_path = args.db or DATABASES[project]
+        rows, failures = optimize(db_path, project, args.rebuild, args.check_only, args.repeat)
+        print_report(project, db_path, rows, failures)
+        failed = failed or bool(failures)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
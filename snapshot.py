@@ -0,0 +1,356 @@
+# =========================
+# Columnar Snapshot – memory-mapped platform tables
+# =========================
+# Every analysis script opens database.sqlite and reads whole tables through read_sql_query,
+# which turns every id into a Python int and every created_at into a string that is parsed
+# again afterwards. export() writes users, posts, comments, reactions and follows once into a
+# directory of NumPy .npy files, one file per column:
+#   - INTEGER columns (ids, rowid) as int64,
+#   - date/time columns as int64 epoch seconds ("%Y-%m-%d %H:%M:%S", then "%Y-%m-%d", like the
+#     analyses parse them; NULL or unparsed values are int64 min, which is NaT as datetime64),
+#   - reactions.reaction_type dictionary-encoded: int32 codes (-1 for NULL) and the categories
+#     in the manifest,
+#   - other text as one UTF-8 byte array plus int64 offsets,
+#   - a bool .null.npy mask next to any column that has NULLs.
+# manifest.json (written last, so a snapshot without it is incomplete) holds the schema, the row
+# counts and the last rowid of every table. users.password is not exported, no analysis reads it.
+#
+# Snapshot(directory) opens the files with np.load(mmap_mode="r"): numeric columns are read-only
+# views of the page cache, nothing is decoded until a column is used. Set SNAPSHOT_DIR to a
+# snapshot directory and the analysis scripts read their tables from it instead of SQLite.
+#
+# Usage:
+#   python snapshot.py --project 2                     # writes <project>/snapshot next to database.sqlite
+#   python snapshot.py --db database.sqlite --out snapshot
+#   python snapshot.py --project 2 --bench             # cold-load time, SQLite vs snapshot
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PROJECTS = {
+    "1": os.path.join(HERE, "Project-1-Social-Network-Database-Analysis", "Project-1-Social-Network-Database-Analysis"),
+    "2": os.path.join(HERE, "Project-2-Platform-Growth-Virality-Lifecycle"),
+    "3": os.path.join(HERE, "Project-3-Moderation-Risk-Recommendation"),
+}
+
+sys.path.append(PROJECTS["3"])  # timestamps are parsed like the risk analysis parses them
+from risk import parse_timestamps  # noqa: E402
+
+TABLES = ("users", "posts", "comments", "reactions", "follows")
+
+# (table, column): text columns stored as codes + categories
+DICTIONARY_COLUMNS = {("reactions", "reaction_type")}
+EXCLUDED_COLUMNS = {("users", "password")}
+
+NAT = np.iinfo(np.int64).min
+FORMAT_VERSION = 1
+
+
+def _kind(table, name, declared):
+    declared = (declared or "").lower()
+    if (table, name) in DICTIONARY_COLUMNS:
+        return "category"
+    if "date" in declared or "time" in declared:
+        return "time"
+    if "int" in declared:
+        return "int"
+    if any(t in declared for t in ("real", "floa", "doub")):
+        return "float"
+    return "text"
+
+
+def epochs(values):
+    """Timestamp strings as int64 epoch seconds, NAT where they are NULL or do not parse."""
+    return parse_timestamps(values).to_numpy(dtype="datetime64[s]").view(np.int64)
+
+
+class _ColumnWriter:
+    """Collects the chunks of one column and writes its files."""
+
+    def __init__(self, table, name, kind):
+        self.table, self.name, self.kind = table, name, kind
+        self.parts, self.nulls = [], []
+        self.categories = {}
+
+    def add(self, values):
+        null = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+        self.nulls.append(null)
+        if self.kind == "int":
+            try:
+                self.parts.append(np.array([0 if v is None else v for v in values], dtype=np.int64))
+            except (TypeError, ValueError, OverflowError):
+                raise ValueError(f"{self.table}.{self.name} holds values that are not integers") from None
+        elif self.kind == "float":
+            self.parts.append(np.array([np.nan if v is None else v for v in values], dtype=np.float64))
+        elif self.kind == "time":
+            self.parts.append(epochs(values))
+        elif self.kind == "category":
+            codes = [-1 if v is None else self.categories.setdefault(v, len(self.categories)) for v in values]
+            self.parts.append(np.array(codes, dtype=np.int32))
+        else:
+            self.parts.append([b"" if v is None else str(v).encode("utf-8") for v in values])
+
+    def write(self, directory):
+        null = np.concatenate(self.nulls) if self.nulls else np.zeros(0, dtype=bool)
+        meta = {"kind": self.kind, "nulls": bool(null.any())}
+        path = os.path.join(directory, self.name)
+        if self.kind == "text":
+            encoded = [value for part in self.parts for value in part]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            np.save(path + ".offsets.npy", offsets)
+            np.save(path + ".data.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        else:
+            dtype = {"int": np.int64, "float": np.float64, "time": np.int64, "category": np.int32}[self.kind]
+            np.save(path + ".npy", np.concatenate(self.parts) if self.parts else np.zeros(0, dtype=dtype))
+        if self.kind == "category":
+            meta["categories"] = list(self.categories)
+        if meta["nulls"]:
+            np.save(path + ".null.npy", null)
+        return meta
+
+
+def export(conn, directory, tables=TABLES, chunk_size=50_000):
+    """
+    Args
+        conn: sqlite3 connection to database.sqlite.
+        directory: output directory (created; files of an older snapshot are overwritten).
+        tables: tables to export.
+        chunk_size: rows fetched at a time.
+
+    Returns:
+        The manifest (also written to directory/manifest.json).
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)  # the snapshot is incomplete until the new manifest is written
+
+    manifest = {"version": FORMAT_VERSION, "tables": {}}
+    for table in tables:
+        schema = [(name, decl) for _, name, decl, *_ in conn.execute(f"PRAGMA table_info({table})")]
+        schema = [(name, decl) for name, decl in schema if (table, name) not in EXCLUDED_COLUMNS]
+        writers = [_ColumnWriter(table, "rowid", "int")]
+        writers += [_ColumnWriter(table, name, _kind(table, name, decl)) for name, decl in schema]
+        names = ", ".join(["rowid"] + [f'"{name}"' for name, _ in schema])
+        cursor = conn.execute(f"SELECT {names} FROM {table} ORDER BY rowid")
+        rows = 0
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            for writer, values in zip(writers, zip(*chunk)):
+                writer.add(values)
+            rows += len(chunk)
+
+        table_dir = os.path.join(directory, table)
+        os.makedirs(table_dir, exist_ok=True)
+        for name in os.listdir(table_dir):  # columns of an older schema
+            os.remove(os.path.join(table_dir, name))
+        columns = {writer.name: writer.write(table_dir) for writer in writers}
+        last_rowid = int(np.load(os.path.join(table_dir, "rowid.npy"), mmap_mode="r")[-1]) if rows else 0
+        manifest["tables"][table] = {"rows": rows, "last_rowid": last_rowid, "columns": columns}
+
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+class Snapshot:
+    """Read-only view of an exported snapshot directory; every column is memory-mapped on first use."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{directory}: snapshot format {self.manifest.get('version')}, expected {FORMAT_VERSION}")
+        self._arrays = {}
+
+    @property
+    def tables(self):
+        return list(self.manifest["tables"])
+
+    def rows(self, table):
+        return self.manifest["tables"][table]["rows"]
+
+    def columns(self, table):
+        return list(self.manifest["tables"][table]["columns"])
+
+    def _meta(self, table, column):
+        try:
+            return self.manifest["tables"][table]["columns"][column]
+        except KeyError:
+            raise KeyError(f"{table}.{column} is not in the snapshot") from None
+
+    def _load(self, table, filename):
+        key = (table, filename)
+        array = self._arrays.get(key)
+        if array is None:
+            array = self._arrays[key] = np.load(os.path.join(self.directory, table, filename), mmap_mode="r")
+        return array
+
+    def array(self, table, column):
+        """
+        The stored array, memory-mapped and not copied: int64 values (0 where NULL), int64 epoch
+        seconds (NAT where NULL), int32 category codes (-1 where NULL) or float64. Text columns
+        have no single array, use column().
+        """
+        meta = self._meta(table, column)
+        if meta["kind"] == "text":
+            raise TypeError(f"{table}.{column} is a text column")
+        return self._load(table, column + ".npy")
+
+    def null_mask(self, table, column):
+        """Bool array, True where the column is NULL (None when the column has no NULLs)."""
+        return self._load(table, column + ".null.npy") if self._meta(table, column)["nulls"] else None
+
+    def kind(self, table, column):
+        """"int", "float", "time", "category" or "text"."""
+        return self._meta(table, column)["kind"]
+
+    def categories(self, table, column):
+        return self._meta(table, column)["categories"]
+
+    def column(self, table, column, start=0, stop=None):
+        """
+        Rows [start, stop) of the column ready for pandas: datetime64[s] (a view of the epochs),
+        a Categorical, a nullable Int64 array when an integer column has NULLs, decoded strings
+        for text (None where NULL), otherwise a slice of the memory-mapped array itself.
+        """
+        kind = self.kind(table, column)
+        start, stop, _ = slice(start, stop).indices(self.rows(table))
+        stop = max(start, stop)
+        null = self.null_mask(table, column)
+        if null is not None:
+            null = null[start:stop]
+        if kind == "text":
+            bounds = self._load(table, column + ".offsets.npy")[start:stop + 1].tolist()
+            data = self._load(table, column + ".data.npy")[bounds[0]:bounds[-1]].tobytes()
+            values = np.empty(len(bounds) - 1, dtype=object)
+            values[:] = [data[a - bounds[0]:b - bounds[0]].decode("utf-8") for a, b in zip(bounds, bounds[1:])]
+            if null is not None:
+                values[null] = None
+            return values
+        values = self.array(table, column)[start:stop]
+        if kind == "time":
+            return values.view("datetime64[s]")
+        if kind == "category":
+            return pd.Categorical.from_codes(values, categories=self.categories(table, column))
+        if kind == "int" and null is not None:
+            return pd.arrays.IntegerArray(np.asarray(values), np.asarray(null))
+        return values
+
+    def frame(self, table, columns=None, start=0, stop=None):
+        """A DataFrame of rows [start, stop) of the given columns (default: all but rowid) in rowid order."""
+        if columns is None:
+            columns = [name for name in self.columns(table) if name != "rowid"]
+        return pd.DataFrame({name: self.column(table, name, start, stop) for name in columns}, copy=False)
+
+    def frames(self, table, columns=None, chunk_size=10_000):
+        """The table as DataFrames of chunk_size rows, like read_sql_query(..., chunksize=chunk_size)."""
+        for start in range(0, self.rows(table), chunk_size):
+            yield self.frame(table, columns, start, start + chunk_size)
+
+    def stale(self, conn):
+        """Tables whose row count or last rowid in the database differ from the snapshot."""
+        changed = []
+        for table, meta in self.manifest["tables"].items():
+            rows, last = conn.execute(f"SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM {table}").fetchone()
+            if rows != meta["rows"] or last != meta["last_rowid"]:
+                changed.append(table)
+        return changed
+
+
+def from_environment(conn=None):
+    """
+    The Snapshot in $SNAPSHOT_DIR, or None when the variable is not set. With conn, a snapshot
+    that no longer matches the database is not used (None, with a warning): export it again.
+    """
+    directory = os.environ.get("SNAPSHOT_DIR")
+    if not directory:
+        return None
+    snapshot = Snapshot(directory)
+    if conn is not None:
+        changed = snapshot.stale(conn)
+        if changed:
+            warnings.warn(f"snapshot {directory} is older than the database ({', '.join(changed)} changed), "
+                          "reading from SQLite")
+            return None
+    return snapshot
+
+
+def bench(db_path, directory, repeat=5):
+    """
+    Cold-load time in milliseconds (best of `repeat`) of every table:
+      sqlite: read_sql_query("SELECT * ...") and parsing created_at, as the analyses do,
+      mmap: opening the snapshot and mapping every non-text column,
+      frame: opening the snapshot and building the DataFrames, text decoded.
+    """
+    def best(load):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            load()
+            times.append(time.perf_counter() - start)
+        return 1000 * min(times)
+
+    def sqlite_load():
+        conn = sqlite3.connect(db_path)
+        for table in TABLES:
+            df = pd.read_sql_query(f"SELECT * FROM {table}", conn)
+            for name in df.columns:
+                if name in ("created_at", "birthdate"):
+                    df[name] = pd.to_datetime(df[name], errors="coerce")
+        conn.close()
+
+    def mmap_load():
+        snapshot = Snapshot(directory)
+        for table in snapshot.tables:
+            for name in snapshot.columns(table):
+                if snapshot.kind(table, name) != "text":
+                    snapshot.array(table, name)
+
+    def frame_load():
+        snapshot = Snapshot(directory)
+        for table in snapshot.tables:
+            snapshot.frame(table)
+
+    return {"sqlite": best(sqlite_load), "mmap": best(mmap_load), "frame": best(frame_load)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the platform tables to a memory-mapped columnar snapshot")
+    parser.add_argument("--project", choices=sorted(PROJECTS), help="use the database.sqlite of this project")
+    parser.add_argument("--db", help="database path (default: the project's database.sqlite)")
+    parser.add_argument("--out", help="snapshot directory (default: snapshot/ next to the database)")
+    parser.add_argument("--bench", action="store_true", help="compare cold-load times after the export")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(PROJECTS[args.project or "1"], "database.sqlite")
+    directory = args.out or os.path.join(os.path.dirname(os.path.abspath(db_path)), "snapshot")
+    conn = sqlite3.connect(db_path)
+    start = time.perf_counter()
+    manifest = export(conn, directory)
+    seconds = time.perf_counter() - start
+    conn.close()
+    for table, meta in manifest["tables"].items():
+        print(f"{table:10s} {meta['rows']:>8,} rows  {', '.join(meta['columns'])}")
+    print(f"snapshot written to {directory} in {seconds:.2f}s")
+    if args.bench:
+        for name, ms in bench(db_path, directory).items():
+            print(f"cold load ({name}): {ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()